@@ -0,0 +1,2 @@
+"""Local stand-ins for Boxer's external services, and benchmarks of the sync path against them.
+   Run from the server directory, e.g.: python3 -m bench.sync --help"""
@@ -0,0 +1,409 @@
+"""A local stand-in for the parts of the GitHub API that Boxer uses.
+   Serves the organization, rate limit, team membership and team repository REST endpoints, and a small GraphQL
+   resolver that understands the organization{teams,repositories,membersWithRole,team} queries Boxer sends,
+   including aliases, variables and pagination. Latency, rate limits and transient errors can be configured, and
+   every request is counted so benchmarks can report what a sync run cost.
+
+   Can also be run on its own, for pointing a dev instance of Boxer at (github.api_url in boxer.yaml):
+       python3 -m bench.fakegithub --port 8090 --projects 300 --people 8000 --repos 2000"""
+import argparse
+import asyncio
+import datetime
+import json
+import random
+import re
+import time
+import typing
+
+import aiohttp.web
+
+import bench.synthetic
+
+ROUTES = (  # For counting requests per endpoint
+    (re.compile(r"^/orgs/[^/]+$"), "/orgs/{org}"),
+    (re.compile(r"^/orgs/[^/]+/teams$"), "/orgs/{org}/teams"),
+    (re.compile(r"^/repos/[^/]+/[^/]+$"), "/repos/{owner}/{repo}"),
+    (re.compile(r"^/organizations/\d+/team/\d+/memberships/[^/]+$"), "/organizations/{org}/team/{team}/memberships/{user}"),
+    (re.compile(r"^/organizations/\d+/team/\d+/repos/[^/]+/[^/]+$"), "/organizations/{org}/team/{team}/repos/{owner}/{repo}"),
+)
+TOKEN_RE = re.compile(r'\s+|,|#[^\n]*|("(?:[^"\\]|\\.)*"|\$?[_A-Za-z][_0-9A-Za-z]*|-?\d+|[{}():!\[\]=])')
+
+
+class Variable:
+    def __init__(self, name: str):
+        self.name = name
+
+
+class Field:
+    """A field in a GraphQL selection set"""
+
+    def __init__(self, name: str, alias: str, args: dict, selections: typing.Optional[typing.List["Field"]]):
+        self.name = name
+        self.alias = alias
+        self.args = args
+        self.selections = selections
+
+
+def parse_query(query: str) -> typing.List[Field]:
+    """Parses the subset of GraphQL that Boxer sends: a single (optionally named, optionally with variable
+       definitions) query with nested fields, aliases and scalar/variable arguments."""
+    tokens = [m.group(1) for m in TOKEN_RE.finditer(query) if m.group(1)]
+    pos = 0
+
+    def take(expected: typing.Optional[str] = None) -> str:
+        nonlocal pos
+        token = tokens[pos]
+        assert expected is None or token == expected, f"Expected {expected} in query, got {token}"
+        pos += 1
+        return token
+
+    def value():
+        token = take()
+        if token.startswith("$"):
+            return Variable(token[1:])
+        if token.startswith('"'):
+            return json.loads(token)
+        if token == "null":
+            return None
+        if token in ("true", "false"):
+            return token == "true"
+        return int(token)
+
+    def selection_set() -> typing.List[Field]:
+        fields = []
+        take("{")
+        while tokens[pos] != "}":
+            alias = name = take()
+            if tokens[pos] == ":":
+                take(":")
+                name = take()
+            args = {}
+            if tokens[pos] == "(":
+                take("(")
+                while tokens[pos] != ")":
+                    arg = take()
+                    take(":")
+                    args[arg] = value()
+                take(")")
+            selections = selection_set() if tokens[pos] == "{" else None
+            fields.append(Field(name, alias, args, selections))
+        take("}")
+        return fields
+
+    if tokens[pos] == "query":
+        take()
+        if tokens[pos] not in ("(", "{"):
+            take()  # Query name
+        if tokens[pos] == "(":
+            while take() != ")":  # Variable definitions, we only need the values
+                pass
+    return selection_set()
+
+
+class Connection:
+    """A paginated list of nodes, as GraphQL connections go"""
+
+    def __init__(self, items: list, args: dict, edge_fields: typing.Optional[typing.Callable] = None):
+        first = args.get("first") or 100
+        offset = int(args.get("after") or 0)
+        self.items = items
+        self.page = items[offset: offset + first]
+        self.end = offset + len(self.page)
+        self.edge_fields = edge_fields
+
+    def field(self, name: str, args: dict):
+        if name == "totalCount":
+            return len(self.items)
+        if name == "pageInfo":
+            return {"hasNextPage": self.end < len(self.items), "endCursor": str(self.end)}
+        if name == "edges":
+            return [Edge(node, self.edge_fields) for node in self.page]
+        if name == "nodes":
+            return self.page
+        raise KeyError(name)
+
+
+class Edge:
+    def __init__(self, node, edge_fields: typing.Optional[typing.Callable]):
+        self.node = node
+        self.edge_fields = edge_fields
+
+    def field(self, name: str, args: dict):
+        if name == "node":
+            return self.node
+        return self.edge_fields(self.node, name)
+
+
+class FakeUser:
+    def __init__(self, login: str, mfa: bool):
+        self.login = login
+        self.mfa = mfa
+
+    def field(self, name: str, args: dict):
+        return {"login": self.login}[name]
+
+
+class FakeRepo:
+    def __init__(self, name: str, databaseid: int):
+        self.name = name
+        self.databaseid = databaseid
+
+    def field(self, name: str, args: dict):
+        return {"name": self.name, "databaseId": self.databaseid}[name]
+
+
+class FakeTeam:
+    def __init__(self, github: "FakeGitHub", databaseid: int, name: str, members: list, repos: list):
+        self.github = github
+        self.databaseid = databaseid
+        self.name = name
+        self.slug = name.replace(" ", "-")
+        self.members: typing.List[str] = list(members)
+        self.repos: typing.List[str] = list(repos)
+
+    def field(self, name: str, args: dict):
+        if name == "members":
+            return Connection([self.github.user(login) for login in self.members], args)
+        if name == "repositories":
+            return Connection([self.github.repos[repo] for repo in self.repos if repo in self.github.repos], args)
+        return {"name": self.name, "slug": self.slug, "databaseId": self.databaseid}[name]
+
+
+class FakeGitHub:
+    """An in-memory GitHub organization, with a web app serving it"""
+
+    def __init__(
+        self,
+        org: bench.synthetic.SyntheticOrg,
+        login: str = "apache",
+        latency: float = 0.0,
+        core_limit: int = 5000,
+        graphql_limit: int = 5000,
+        rate_window: int = 3600,
+        error_rate: float = 0.0,
+        seed: int = 42,
+    ):
+        self.login = login
+        self.orgid = 47359
+        self.latency = latency
+        self.limits = {"core": core_limit, "graphql": graphql_limit}
+        self.rate_window = rate_window
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.window_start = time.time()
+        self.used = {"core": 0, "graphql": 0}
+        self.requests: typing.Dict[str, int] = {}
+        self.graphql_cost = 0
+        self.users: typing.Dict[str, FakeUser] = {}
+        for person in org.people.values():
+            if person.github_login:
+                self.users[person.github_login] = FakeUser(person.github_login, person.mfa)
+        self.repos = {name: FakeRepo(name, 1000 + i) for i, name in enumerate(org.github_repos)}
+        self.teams: typing.Dict[int, FakeTeam] = {}
+        for name, (members, repos) in org.github_teams.items():
+            self.add_team(name, members, repos)
+
+    def user(self, login: str) -> FakeUser:
+        if login not in self.users:
+            self.users[login] = FakeUser(login, False)
+        return self.users[login]
+
+    def add_team(self, name: str, members: list = (), repos: list = ()) -> FakeTeam:
+        team = FakeTeam(self, 5000 + len(self.teams), name, members, repos)
+        self.teams[team.databaseid] = team
+        return team
+
+    def add_repository(self, name: str) -> FakeRepo:
+        """Creates a repository, as when a new gitbox repository is mirrored to GitHub"""
+        repo = self.repos.get(name) or FakeRepo(name, 1000 + len(self.repos))
+        self.repos[name] = repo
+        return repo
+
+    def field(self, name: str, args: dict):
+        """Root fields of the GraphQL schema"""
+        if name == "organization":
+            return self if args.get("login") == self.login else None
+        if name == "rateLimit":
+            return self.rate_limit("graphql")
+        if name == "teams":
+            return Connection(sorted(self.teams.values(), key=lambda t: t.slug), args)
+        if name == "repositories":
+            return Connection(list(self.repos.values()), args)
+        if name == "membersWithRole":
+            members = sorted(self.users.values(), key=lambda u: u.login)
+            return Connection(members, args, lambda user, field: {"hasTwoFactorEnabled": user.mfa, "role": "MEMBER"}[field])
+        if name == "team":
+            for team in self.teams.values():
+                if team.slug == args.get("slug"):
+                    return team
+            return None
+        if name == "login":
+            return self.login
+        raise KeyError(name)
+
+    def reset_time(self) -> float:
+        if time.time() - self.window_start >= self.rate_window:
+            self.window_start = time.time()
+            self.used = {"core": 0, "graphql": 0}
+        return self.window_start + self.rate_window
+
+    def rate_limit(self, resource: str) -> dict:
+        reset = self.reset_time()
+        return {
+            "limit": self.limits[resource],
+            "used": self.used[resource],
+            "remaining": max(self.limits[resource] - self.used[resource], 0),
+            "reset": int(reset),
+            "resetAt": datetime.datetime.utcfromtimestamp(reset).strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "cost": 1,
+        }
+
+    def resolve(self, value, selections: typing.Optional[typing.List[Field]], variables: dict):
+        if isinstance(value, list):
+            return [self.resolve(item, selections, variables) for item in value]
+        if value is None or selections is None:
+            return value
+        result = {}
+        for field in selections:
+            args = {k: variables.get(v.name) if isinstance(v, Variable) else v for k, v in field.args.items()}
+            if isinstance(value, dict):
+                result[field.alias] = self.resolve(value[field.name], field.selections, variables)
+            else:
+                result[field.alias] = self.resolve(value.field(field.name, args), field.selections, variables)
+        return result
+
+    @staticmethod
+    def query_cost(selections: typing.List[Field], variables: dict, multiplier: int = 1) -> int:
+        """Works out the number of requests a query needs, the way GitHub does it: every connection costs one
+           request per parent node it is fetched for."""
+        requests = 0
+        for field in selections or []:
+            if "first" in field.args:
+                first = field.args["first"]
+                first = variables.get(first.name) if isinstance(first, Variable) else first
+                requests += multiplier
+                requests += FakeGitHub.query_cost(field.selections, variables, multiplier * (first or 100))
+            else:
+                requests += FakeGitHub.query_cost(field.selections, variables, multiplier)
+        return requests
+
+    def count(self, key: str):
+        self.requests[key] = self.requests.get(key, 0) + 1
+
+    def headers(self, resource: str) -> dict:
+        budget = self.rate_limit(resource)
+        return {
+            "X-RateLimit-Limit": str(budget["limit"]),
+            "X-RateLimit-Remaining": str(budget["remaining"]),
+            "X-RateLimit-Used": str(budget["used"]),
+            "X-RateLimit-Reset": str(budget["reset"]),
+            "X-RateLimit-Resource": resource,
+        }
+
+    async def handle(self, request: aiohttp.web.Request) -> aiohttp.web.Response:
+        """Handles every request, routing it to the right emulated endpoint"""
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        path = request.path
+        method = request.method
+        resource = "graphql" if path == "/graphql" else "core"
+        route = path
+        for route_re, label in ROUTES:
+            if route_re.match(path):
+                route = label
+                break
+        self.count(f"{method} {route}")
+        if path == "/rate_limit":
+            return aiohttp.web.json_response({"rate": self.rate_limit("core")}, headers=self.headers("core"))
+        if self.error_rate and self.rng.random() < self.error_rate:
+            self.count("errors")
+            return aiohttp.web.Response(status=502, text="Server Error")
+        cost = 1
+        if resource == "graphql":
+            payload = await request.json()
+            selections = parse_query(payload["query"])
+            variables = payload.get("variables") or {}
+            cost = max(1, round(self.query_cost(selections, variables) / 100))
+        self.reset_time()
+        if self.used[resource] + cost > self.limits[resource]:
+            self.count("rate_limited")
+            return aiohttp.web.Response(status=403, text="API rate limit exceeded", headers=self.headers(resource))
+        self.used[resource] += cost
+
+        if resource == "graphql":
+            self.graphql_cost += cost
+            data = self.resolve(self, selections, variables)
+            if "rateLimit" in data:
+                data["rateLimit"]["cost"] = cost
+            return aiohttp.web.json_response({"data": data}, headers=self.headers("graphql"))
+        return self.handle_rest(request, method, path, await request.text())
+
+    def handle_rest(self, request: aiohttp.web.Request, method: str, path: str, body: str) -> aiohttp.web.Response:
+        headers = self.headers("core")
+        if method == "GET" and path == f"/orgs/{self.login}":
+            return aiohttp.web.json_response({"login": self.login, "id": self.orgid}, headers=headers)
+        if method == "GET" and path.startswith(f"/repos/{self.login}/") and path.split("/")[-1] in self.repos:
+            repo = self.repos[path.split("/")[-1]]
+            return aiohttp.web.json_response({"name": repo.name, "id": repo.databaseid}, headers=headers)
+        if method == "POST" and path == f"/orgs/{self.login}/teams":
+            team = self.add_team(json.loads(body)["name"])
+            return aiohttp.web.json_response(
+                {"id": team.databaseid, "slug": team.slug, "name": team.name}, status=201, headers=headers
+            )
+        m = re.match(r"^/organizations/(\d+)/team/(\d+)/(memberships|repos)/(.+)$", path)
+        if m and int(m.group(1)) == self.orgid and int(m.group(2)) in self.teams:
+            team = self.teams[int(m.group(2))]
+            if m.group(3) == "memberships":
+                login = m.group(4)
+                if method == "PUT":
+                    if login not in team.members:
+                        team.members.append(login)
+                    return aiohttp.web.json_response({"state": "active", "role": "member"}, headers=headers)
+                if method == "DELETE" and login in team.members:
+                    team.members.remove(login)
+                    return aiohttp.web.Response(status=204, headers=headers)
+            else:
+                owner, _, repo = m.group(4).partition("/")
+                if owner == self.login and repo in self.repos:
+                    if method == "PUT":
+                        if repo not in team.repos:
+                            team.repos.append(repo)
+                        return aiohttp.web.Response(status=204, headers=headers)
+                    if method == "DELETE" and repo in team.repos:
+                        team.repos.remove(repo)
+                        return aiohttp.web.Response(status=204, headers=headers)
+        return aiohttp.web.json_response({"message": "Not Found"}, status=404, headers=headers)
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> typing.Tuple[aiohttp.web.AppRunner, str]:
+        """Starts serving on the given host and port (a random free port by default). Returns the runner and the
+           base URL of the API."""
+        app = aiohttp.web.Application()
+        app.router.add_route("*", "/{path:.*}", self.handle)
+        runner = aiohttp.web.AppRunner(app, access_log=None)
+        await runner.setup()
+        site = aiohttp.web.TCPSite(runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]  # type: ignore
+        return runner, f"http://{host}:{port}"
+
+
+async def serve(args: argparse.Namespace):
+    org = bench.synthetic.SyntheticOrg(projects=args.projects, people=args.people, repos=args.repos, seed=args.seed)
+    github = FakeGitHub(org, login=args.org, latency=args.latency, rate_window=args.rate_window)
+    runner, url = await github.start(port=args.port)
+    print(f"Fake GitHub API for organization '{args.org}' serving at {url}")
+    while True:
+        await asyncio.sleep(3600)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8090, help="Port to serve on (default: 8090)")
+    parser.add_argument("--org", default="apache", help="Organization login to emulate (default: apache)")
+    parser.add_argument("--projects", type=int, default=300, help="Number of projects (default: 300)")
+    parser.add_argument("--people", type=int, default=8000, help="Number of people (default: 8000)")
+    parser.add_argument("--repos", type=int, default=2000, help="Number of repositories (default: 2000)")
+    parser.add_argument("--latency", type=float, default=0.05, help="Per-request latency in seconds (default: 0.05)")
+    parser.add_argument("--rate-window", type=int, default=3600, help="Rate limit window in seconds (default: 3600)")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed for the synthetic data (default: 42)")
+    asyncio.run(serve(parser.parse_args()))
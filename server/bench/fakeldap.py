@@ -0,0 +1,177 @@
+"""An in-process stand-in for the ASF LDAP server, for testing and profiling Boxer's LDAP client.
+   Serves cn=<project>,ou=project,ou=groups,dc=apache,dc=org entries built from a synthetic organization, through
+   connections that look enough like bonsai's for plugins.ldap.LDAPClient to use them (pass a FakeLDAP as its
+   backend). Every search costs a configurable latency, and searches, entries returned and connections opened are
+   counted so benchmarks can compare lookup strategies.
+
+   It can also generate a projects.yaml-style set of overrides, with the matching entries outside the project group
+   base, to exercise the ldap, ldap_owner, member_attr, owner_attr, members and owners overrides."""
+import asyncio
+import datetime
+import random
+import typing
+
+import bonsai
+
+import bench.synthetic
+
+PEOPLE_BASE = "ou=people,dc=apache,dc=org"
+GROUP_BASE = "cn=%s,ou=project,ou=groups,dc=apache,dc=org"
+SERVICE_BASE = "cn=%s,ou=groups,ou=services,dc=apache,dc=org"
+OVERRIDE_TYPES = ("ldap", "ldap_owner", "attrs", "static")
+
+
+def timestamp(when: float) -> str:
+    """Formats a time as an LDAP GeneralizedTime, as in modifyTimestamp"""
+    return datetime.datetime.fromtimestamp(when, datetime.timezone.utc).strftime("%Y%m%d%H%M%SZ")
+
+
+def uid(asf_id: str) -> str:
+    return f"uid={asf_id},{PEOPLE_BASE}"
+
+
+class FakeConnection:
+    """A connection to the fake LDAP server, with the subset of bonsai.LDAPConnection that LDAPClient uses"""
+
+    def __init__(self, ldap: "FakeLDAP"):
+        self.ldap = ldap
+        self.closed = False
+
+    async def search(self, base: str, scope: bonsai.LDAPSearchScope, filter_exp=None, attrlist=None) -> list:
+        """Searches for the base entry only; Boxer never needs anything below a group"""
+        return await self.ldap.search([base] if base in self.ldap.entries else [], filter_exp, attrlist)
+
+    async def paged_search(
+        self, base: str, scope: bonsai.LDAPSearchScope, filter_exp=None, attrlist=None, page_size: int = 500
+    ) -> typing.AsyncIterator[dict]:
+        """Searches the entries directly below the base, one page (and one round of latency) at a time"""
+        suffix = "," + base
+        dns = [dn for dn in self.ldap.entries if dn.endswith(suffix) and "," not in dn[: -len(suffix)]]
+
+        async def pages():
+            for start in range(0, max(len(dns), 1), page_size):
+                for entry in await self.ldap.search(dns[start:start + page_size], filter_exp, attrlist):
+                    yield entry
+
+        return pages()
+
+    def close(self):
+        self.closed = True
+
+
+class FakeLDAP:
+    """A fake LDAP server holding the project groups of a synthetic organization"""
+
+    entries: typing.Dict[str, dict]
+    overrides: dict
+
+    def __init__(
+        self,
+        org: bench.synthetic.SyntheticOrg,
+        latency: float = 0.01,
+        connect_latency: float = 0.05,
+        overrides: int = 0,
+        seed: int = 42,
+    ):
+        self.latency = latency
+        self.connect_latency = connect_latency
+        self.entries = {}
+        self.overrides = {}
+        self.connections = 0
+        self.searches = 0
+        self.entries_returned = 0
+        self.inflight = 0
+        self.peak_inflight = 0
+        # The fake server's clock starts at the epoch and ticks a second per group created or modified, so that
+        # entries always get distinct, increasing modifyTimestamps however fast the benchmark runs.
+        self.clock = 0
+        for project in org.projects.values():
+            self.clock += 1
+            self.entries[GROUP_BASE % project.name] = {
+                "cn": [project.name],
+                "member": [uid(x) for x in project.committers],
+                "owner": [uid(x) for x in project.pmc],
+                "modifyTimestamp": [timestamp(self.clock)],
+            }
+        rng = random.Random(seed)
+        for i, project in enumerate(rng.sample(list(org.projects.values()), min(overrides, len(org.projects)))):
+            self.add_override(project, OVERRIDE_TYPES[i % len(OVERRIDE_TYPES)])
+
+    def add_override(self, project: bench.synthetic.SyntheticProject, kind: str):
+        """Moves a project's group data somewhere else, the way the projects.yaml overrides expect to find it"""
+        name = project.name
+        if kind == "ldap":  # Committers and PMC in a services group instead of the project group
+            self.entries[SERVICE_BASE % name] = dict(self.entries.pop(GROUP_BASE % name))
+            self.overrides[name] = {"ldap": SERVICE_BASE % name}
+        elif kind == "ldap_owner":  # PMC in a separate group
+            self.entries[SERVICE_BASE % (name + "-pmc")] = {
+                "cn": [name + "-pmc"],
+                "owner": [uid(x) for x in project.pmc],
+            }
+            self.entries[GROUP_BASE % name]["owner"] = []
+            self.overrides[name] = {"ldap_owner": SERVICE_BASE % (name + "-pmc")}
+        elif kind == "attrs":  # Non-standard attribute names
+            entry = self.entries[GROUP_BASE % name]
+            entry["memberUid"] = entry.pop("member")
+            entry["ownerUid"] = entry.pop("owner")
+            self.overrides[name] = {"member_attr": "memberUid", "owner_attr": "ownerUid"}
+        elif kind == "static":  # Hardcoded in projects.yaml, not in LDAP at all
+            del self.entries[GROUP_BASE % name]
+            self.overrides[name] = {"members": list(project.committers), "owners": list(project.pmc)}
+        else:
+            raise ValueError(f"Unknown override type: {kind}")
+
+    def modify(self, group: str, members: typing.List[str], owners: typing.List[str]):
+        """Changes the members and owners of a project group, bumping its modifyTimestamp"""
+        self.clock += 1
+        self.entries[GROUP_BASE % group] = {
+            "cn": [group],
+            "member": [uid(x) for x in members],
+            "owner": [uid(x) for x in owners],
+            "modifyTimestamp": [timestamp(self.clock)],
+        }
+
+    @staticmethod
+    def matches(entry: dict, filter_exp: typing.Optional[str]) -> bool:
+        """Understands the filters Boxer sends: none, (cn=*) and (&(cn=*)(modifyTimestamp>=...))"""
+        if not filter_exp or filter_exp == "(cn=*)":
+            return "cn" in entry
+        if filter_exp.startswith("(&(cn=*)(modifyTimestamp>="):
+            since = filter_exp[len("(&(cn=*)(modifyTimestamp>="):].rstrip(")")
+            return "cn" in entry and entry.get("modifyTimestamp", [""])[0] >= since
+        raise ValueError(f"Unsupported filter: {filter_exp}")
+
+    async def search(self, dns: typing.List[str], filter_exp, attrlist) -> typing.List[dict]:
+        self.searches += 1
+        self.inflight += 1
+        self.peak_inflight = max(self.peak_inflight, self.inflight)
+        try:
+            await asyncio.sleep(self.latency)
+        finally:
+            self.inflight -= 1
+        results = []
+        for dn in dns:
+            entry = self.entries[dn]
+            if self.matches(entry, filter_exp):
+                results.append({k: list(v) for k, v in entry.items() if not attrlist or k in attrlist})
+        self.entries_returned += len(results)
+        return results
+
+    async def connect(self) -> FakeConnection:
+        self.connections += 1
+        await asyncio.sleep(self.connect_latency)
+        return FakeConnection(self)
+
+    def statistics(self) -> dict:
+        return {
+            "connections": self.connections,
+            "searches": self.searches,
+            "entries": self.entries_returned,
+            "peak_inflight": self.peak_inflight,
+        }
+
+    def reset_statistics(self):
+        self.connections = 0
+        self.searches = 0
+        self.entries_returned = 0
+        self.peak_inflight = 0
@@ -0,0 +1,152 @@
+"""Benchmark of Boxer's LDAP lookup strategies against an in-process LDAP stand-in.
+   Fetches the members and owners of every project group of a synthetic organization with each strategy the LDAP
+   client has (one group at a time on a single connection, concurrently over a connection pool, in bulk with one
+   paged search, and incrementally after a handful of groups changed), then runs compile_data with bulk lookups on
+   and off. Reports wall time, searches, connections and entries returned per strategy, and checks that every
+   strategy comes up with the same groups as the one group at a time baseline.
+
+   Usage, from the server directory:
+       python3 -m bench.lookups --projects 300 --people 8000 --latency 0.01 --overrides 8 --pool-size 4"""
+import argparse
+import asyncio
+import json
+import time
+import typing
+
+import bench.fakeldap
+import bench.synthetic
+import plugins.ldap
+import plugins.projects
+import plugins.repositories
+
+
+def make_client(
+    fake: bench.fakeldap.FakeLDAP, pool_size: int = 1, bulk: bool = True, incremental: bool = False
+) -> plugins.ldap.LDAPClient:
+    config = plugins.ldap.LDAPConfig(
+        {
+            "groupbase": bench.fakeldap.GROUP_BASE,
+            "pool_size": pool_size,
+            "bulk": bulk,
+            "incremental": incremental,
+        }
+    )
+    client = plugins.ldap.LDAPClient(config, ldap_override_yaml=None, backend=fake)
+    client.ldap_override = fake.overrides
+    return client
+
+
+def synthetic_repositories(org: bench.synthetic.SyntheticOrg) -> typing.List[plugins.repositories.Repository]:
+    repositories = []
+    for project in org.projects.values():
+        for repo in project.public_repos:
+            repositories.append(plugins.repositories.Repository(False, f"/x1/repos/asf/{repo}.git"))
+        for repo in project.private_repos:
+            repositories.append(plugins.repositories.Repository(True, f"/x1/repos/private/{project.name}/{repo}.git"))
+    return repositories
+
+
+async def per_group(client: plugins.ldap.LDAPClient, groups: typing.List[str]):
+    """The way compile_data used to do it: one search per group, one after the other"""
+    return {group: await client.get_members(group) for group in groups}
+
+
+async def run_strategies(args: argparse.Namespace) -> typing.List[dict]:
+    org = bench.synthetic.SyntheticOrg(projects=args.projects, people=args.people, repos=args.repos, seed=args.seed)
+    fake = bench.fakeldap.FakeLDAP(
+        org, latency=args.latency, connect_latency=args.connect_latency, overrides=args.overrides, seed=args.seed
+    )
+    groups = list(org.projects)
+    results = []
+    baseline: typing.Dict[str, typing.Tuple[list, list]] = {}
+
+    async def measure(strategy: str, client: plugins.ldap.LDAPClient, lookup: typing.Callable[[], typing.Awaitable]):
+        fake.reset_statistics()
+        start = time.time()
+        await client.connect()
+        groups_found = await lookup()
+        seconds = time.time() - start
+        await client.close()
+        result = dict(strategy=strategy, seconds=seconds, **fake.statistics())
+        if isinstance(groups_found, dict):
+            if not baseline:
+                baseline.update(groups_found)
+            result["mismatches"] = sum(1 for group in groups if groups_found.get(group) != baseline.get(group))
+        results.append(result)
+
+    client = make_client(fake, pool_size=1)
+    await measure("per-group", client, lambda: per_group(client, groups))
+    client = make_client(fake, pool_size=args.pool_size)
+    await measure(f"concurrent (pool of {args.pool_size})", client, lambda: client.get_members_many(groups))
+    client = make_client(fake, pool_size=args.pool_size)
+    await measure("bulk", client, lambda: client.get_all_members(groups))
+
+    client = make_client(fake, pool_size=args.pool_size, incremental=True)
+    await client.connect()
+    await client.sync(groups)  # The first sync is a full one
+    changed = [group for group in groups if group not in fake.overrides][: args.changes]
+    for group in changed:
+        project = org.projects[group]
+        project.committers = project.committers[1:] or project.committers
+        fake.modify(group, project.committers, project.pmc)
+    for group in changed:  # The baseline for the groups we just changed is out of date
+        baseline[group] = (sorted(org.projects[group].committers), sorted(org.projects[group].pmc))
+
+    async def incremental():
+        found = await client.sync(groups)
+        assert found == set(changed), f"Expected {len(changed)} changed groups, sync found {len(found)}"
+        return client.groups
+
+    await measure(f"incremental ({len(changed)} changed)", client, incremental)
+
+    repositories = synthetic_repositories(org)
+    for bulk in (False, True):
+        client = make_client(fake, pool_size=args.pool_size, bulk=bulk)
+        await measure(
+            f"compile_data (bulk {'on' if bulk else 'off'})",
+            client,
+            lambda: plugins.projects.compile_data(client.config, repositories, None, client=client),
+        )
+    return results
+
+
+def report(results: typing.List[dict]):
+    print(
+        "%-32s %10s %10s %12s %10s %10s %11s"
+        % ("strategy", "seconds", "searches", "connections", "entries", "peak", "mismatches")
+    )
+    for result in results:
+        print(
+            "%-32s %10.3f %10u %12u %10u %10u %11s"
+            % (
+                result["strategy"],
+                result["seconds"],
+                result["searches"],
+                result["connections"],
+                result["entries"],
+                result["peak_inflight"],
+                result.get("mismatches", "-"),
+            )
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--projects", type=int, default=300, help="Number of projects (default: 300)")
+    parser.add_argument("--people", type=int, default=8000, help="Number of people (default: 8000)")
+    parser.add_argument("--repos", type=int, default=2000, help="Number of repositories (default: 2000)")
+    parser.add_argument("--latency", type=float, default=0.01, help="Per-search latency in seconds (default: 0.01)")
+    parser.add_argument(
+        "--connect-latency", type=float, default=0.05, help="Latency of opening a connection in seconds (default: 0.05)"
+    )
+    parser.add_argument("--overrides", type=int, default=8, help="Number of groups with projects.yaml overrides (default: 8)")
+    parser.add_argument("--pool-size", type=int, default=4, help="LDAP connection pool size (default: 4)")
+    parser.add_argument("--changes", type=int, default=5, help="Number of groups to change for the incremental sync (default: 5)")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed for the synthetic data (default: 42)")
+    parser.add_argument("--json", help="Also write the per-strategy results to this JSON file")
+    args = parser.parse_args()
+    results = asyncio.run(run_strategies(args))
+    report(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,137 @@
+"""Memory benchmark of Boxer's in-memory model of the organization.
+   Builds what a background run keeps in memory (gitbox repositories, projects with their committers and PMC, the
+   per-person repository and project sets, and the GitHub teams) for a synthetic organization, and reports how much
+   memory that takes, per object type and per 10k committers, as traced by tracemalloc and as seen in the resident
+   set size of the process.
+
+   Usage, from the server directory:
+       python3 -m bench.memory --projects 300 --people 10000 --repos 2000"""
+import argparse
+import gc
+import json
+import os
+import tracemalloc
+import typing
+
+import bench.synthetic
+import plugins.github
+import plugins.projects
+import plugins.repositories
+
+
+def resident_size() -> int:
+    """Returns the resident set size of this process in bytes, or 0 if we can't tell"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def fresh(value: str) -> str:
+    """Returns a copy of a string that is a separate object, like the strings parsed out of LDAP, GitHub or
+       database responses are, even when they hold the same ID"""
+    return "".join(list(value))
+
+
+def build_repositories(org: bench.synthetic.SyntheticOrg) -> typing.List[plugins.repositories.Repository]:
+    repositories = []
+    for project in org.projects.values():
+        for repo in project.public_repos:
+            repositories.append(plugins.repositories.Repository(False, f"/x1/repos/asf/{repo}.git"))
+        for repo in project.private_repos:
+            repositories.append(plugins.repositories.Repository(True, f"/x1/repos/private/{project.name}/{repo}.git"))
+    return repositories
+
+
+def build_organization(
+    org: bench.synthetic.SyntheticOrg, repositories: typing.List[plugins.repositories.Repository]
+) -> plugins.projects.Organization:
+    """Builds the organization the way compile_data does, from strings that are new copies every time, as they are
+       when they come out of LDAP or the ids table"""
+    asf_org = plugins.projects.Organization()
+    for project in org.projects.values():
+        asf_org.add_project(
+            name=project.name,
+            committers=[fresh(asf_id) for asf_id in project.committers],
+            pmc=[fresh(asf_id) for asf_id in project.pmc],
+        )
+    for repo in repositories:
+        asf_org.projects[repo.project].add_repository(repo, repo.private)
+    for person in asf_org.committers:
+        synthetic_person = org.people[person.asf_id]
+        if synthetic_person.github_login:
+            asf_org.link_github(person, fresh(synthetic_person.github_login))
+        person.github_mfa = synthetic_person.mfa
+    return asf_org
+
+
+def build_teams(org: bench.synthetic.SyntheticOrg) -> typing.List[plugins.github.GitHubTeam]:
+    github_org = plugins.github.GitHubOrganisation(login="apache", personal_access_token="0" * 40)
+    teams = []
+    for i, (name, (members, repos)) in enumerate(org.github_teams.items()):
+        nodedata = {
+            "node": {
+                "databaseId": i + 1,
+                "slug": name.replace(" ", "-"),
+                "name": name,
+                "members": {"edges": [{"node": {"login": fresh(login)}} for login in members]},
+                "repositories": {"edges": [{"node": {"name": fresh(repo)}} for repo in repos]},
+            },
+        }
+        teams.append(plugins.github.GitHubTeam(github_org, nodedata))
+    return teams
+
+
+def measure(args: argparse.Namespace) -> dict:
+    org = bench.synthetic.SyntheticOrg(projects=args.projects, people=args.people, repos=args.repos, seed=args.seed)
+    results: typing.Dict[str, typing.Any] = {"committers": 0, "stages": {}}
+    kept = []
+    gc.collect()
+    tracemalloc.start()
+    rss_start = resident_size()
+    for stage, build in (
+        ("repositories", lambda: build_repositories(org)),
+        ("organization", lambda: build_organization(org, kept[0])),
+        ("teams", lambda: build_teams(org)),
+    ):
+        gc.collect()
+        before = tracemalloc.get_traced_memory()[0]
+        kept.append(build())
+        gc.collect()
+        results["stages"][stage] = tracemalloc.get_traced_memory()[0] - before
+    results["traced"] = sum(results["stages"].values())
+    results["resident"] = resident_size() - rss_start
+    tracemalloc.stop()
+    results["committers"] = len(kept[1].committers)
+    results["memberships"] = sum(len(person.projects) for person in kept[1].committers)
+    results["repository_links"] = sum(len(person.repositories) for person in kept[1].committers)
+    return results
+
+
+def report(results: dict):
+    per_10k = 10000 / max(results["committers"], 1)
+    print(
+        "%u committers, %u project memberships, %u repository links"
+        % (results["committers"], results["memberships"], results["repository_links"])
+    )
+    print("%-16s %14s %18s" % ("stage", "traced bytes", "per 10k committers"))
+    for stage, size in results["stages"].items():
+        print("%-16s %14u %18u" % (stage, size, size * per_10k))
+    print("%-16s %14u %18u" % ("TOTAL", results["traced"], results["traced"] * per_10k))
+    print("%-16s %14u %18u" % ("resident", results["resident"], results["resident"] * per_10k))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--projects", type=int, default=300, help="Number of projects (default: 300)")
+    parser.add_argument("--people", type=int, default=10000, help="Number of people (default: 10000)")
+    parser.add_argument("--repos", type=int, default=2000, help="Number of repositories (default: 2000)")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed for the synthetic data (default: 42)")
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+    results = measure(args)
+    report(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,180 @@
+"""End-to-end benchmark of Boxer's GitHub sync path against a local GitHub stand-in.
+   Runs the same stages as a background run (org ID, GitHub snapshot, project compilation, planning and applying
+   team changes) against bench.fakegithub, and reports wall time, request counts and GraphQL cost per stage.
+   LDAP and gitbox are replaced by the synthetic organization the fake GitHub was seeded from.
+
+   Usage, from the server directory:
+       python3 -m bench.sync --projects 300 --people 8000 --repos 2000 --latency 0.05 --cycles 2"""
+import argparse
+import asyncio
+import json
+import time
+import typing
+
+import bench.fakegithub
+import bench.synthetic
+import plugins.configuration
+import plugins.github
+import plugins.projects
+import plugins.reconcile
+import plugins.repositories
+
+
+class BenchServer:
+    """Just enough of a Server for the sync stages to run against"""
+
+    def __init__(self):
+        self.data = plugins.configuration.InterData()
+
+
+class StageTimer:
+    """Records wall time, requests and GraphQL cost of each benchmark stage"""
+
+    def __init__(self, github: bench.fakegithub.FakeGitHub):
+        self.github = github
+        self.results: typing.List[dict] = []
+
+    async def run(self, cycle: int, stage: str, coro: typing.Awaitable):
+        requests_before = dict(self.github.requests)
+        cost_before = self.github.graphql_cost
+        start = time.time()
+        result = await coro
+        requests = {
+            key: count - requests_before.get(key, 0)
+            for key, count in self.github.requests.items()
+            if count != requests_before.get(key, 0)
+        }
+        self.results.append(
+            {
+                "cycle": cycle,
+                "stage": stage,
+                "seconds": time.time() - start,
+                "requests": sum(requests.values()),
+                "graphql_cost": self.github.graphql_cost - cost_before,
+                "by_endpoint": requests,
+            }
+        )
+        return result
+
+    def report(self):
+        print("%-6s %-32s %10s %10s %10s" % ("cycle", "stage", "seconds", "requests", "gql cost"))
+        for result in self.results:
+            print(
+                "%-6u %-32s %10.3f %10u %10u"
+                % (result["cycle"], result["stage"], result["seconds"], result["requests"], result["graphql_cost"])
+            )
+        for cycle in sorted(set(result["cycle"] for result in self.results)):
+            results = [result for result in self.results if result["cycle"] == cycle]
+            print(
+                "%-6u %-32s %10.3f %10u %10u"
+                % (
+                    cycle,
+                    "TOTAL",
+                    sum(result["seconds"] for result in results),
+                    sum(result["requests"] for result in results),
+                    sum(result["graphql_cost"] for result in results),
+                )
+            )
+
+
+async def compile_synthetic(org: bench.synthetic.SyntheticOrg) -> plugins.projects.Organization:
+    """Compiles projects and people the way plugins.projects.compile_data would, from synthetic LDAP/gitbox data"""
+    asf_org = plugins.projects.Organization()
+    for project in org.projects.values():
+        asf_project = asf_org.add_project(name=project.name, committers=project.committers, pmc=project.pmc)
+        for repo in project.public_repos:
+            asf_project.add_repository(plugins.repositories.Repository(False, f"/x1/repos/asf/{repo}.git"), False)
+        for repo in project.private_repos:
+            filepath = f"/x1/repos/private/{project.name}/{repo}.git"
+            asf_project.add_repository(plugins.repositories.Repository(True, filepath), True)
+    for person in asf_org.committers:
+        synthetic_person = org.people[person.asf_id]
+        asf_org.link_github(person, synthetic_person.github_login)
+        person.github_mfa = synthetic_person.mfa
+    return asf_org
+
+
+async def run_cycle(
+    cycle: int,
+    server: BenchServer,
+    github_org: plugins.github.GitHubOrganisation,
+    org: bench.synthetic.SyntheticOrg,
+    timer: StageTimer,
+    fingerprints: typing.Optional[plugins.reconcile.TeamFingerprints] = None,
+):
+    await timer.run(cycle, "Get organization ID", github_org.get_id())
+    snapshot = await timer.run(cycle, "GitHub snapshot", github_org.load_snapshot())
+    server.data.mfa = snapshot.mfa
+    server.data.github_repos = snapshot.repositories
+    server.data.teams = snapshot.teams
+    asf_org = await timer.run(cycle, "Compile projects", compile_synthetic(org))
+    server.data.projects = asf_org.projects
+    server.data.people = asf_org.committers
+
+    async def plan():
+        return plugins.reconcile.plan_reconciliation(server, github_org, fingerprints=fingerprints)
+
+    reconciliation = await timer.run(cycle, "Plan team changes", plan())
+    print(
+        f"Cycle {cycle}: planned {len(reconciliation)} changes: {reconciliation.summary()}, "
+        f"{reconciliation.skipped} teams unchanged"
+    )
+    await timer.run(cycle, "Apply team changes", plugins.reconcile.apply_plan(github_org, reconciliation))
+    if fingerprints is not None:
+        fingerprints.commit(reconciliation, github_org.teams)
+
+
+async def main(args: argparse.Namespace):
+    org = bench.synthetic.SyntheticOrg(
+        projects=args.projects, people=args.people, repos=args.repos, drift=args.drift, seed=args.seed
+    )
+    github = bench.fakegithub.FakeGitHub(
+        org, login="apache", latency=args.latency, rate_window=args.rate_window, error_rate=args.error_rate
+    )
+    runner, url = await github.start()
+    github_org = plugins.github.GitHubOrganisation(
+        login="apache",
+        personal_access_token="0" * 40,
+        api_url=url,
+        connection_limit=args.connections,
+        max_inflight=args.max_inflight,
+        team_inflight=args.team_inflight,
+    )
+    server = BenchServer()
+    server.data.github_org = github_org
+    timer = StageTimer(github)
+    fingerprints = plugins.reconcile.TeamFingerprints() if args.fingerprints else None
+    try:
+        for cycle in range(1, args.cycles + 1):
+            await run_cycle(cycle, server, github_org, org, timer, fingerprints)
+    finally:
+        await github_org.close()
+        await runner.cleanup()
+    timer.report()
+    print("Connection pool:", github_org.pool_statistics())
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(timer.results, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--projects", type=int, default=300, help="Number of projects (default: 300)")
+    parser.add_argument("--people", type=int, default=8000, help="Number of people (default: 8000)")
+    parser.add_argument("--repos", type=int, default=2000, help="Number of repositories (default: 2000)")
+    parser.add_argument("--drift", type=float, default=0.02, help="How far GitHub has drifted from LDAP (default: 0.02)")
+    parser.add_argument("--latency", type=float, default=0.05, help="Per-request latency in seconds (default: 0.05)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Ratio of requests failing with a 502 (default: 0)")
+    parser.add_argument(
+        "--rate-window", type=int, default=3600, help="Rate limit window of the fake GitHub in seconds (default: 3600)"
+    )
+    parser.add_argument("--connections", type=int, default=16, help="Connection pool size (default: 16)")
+    parser.add_argument("--max-inflight", type=int, default=8, help="Org-wide in-flight mutations (default: 8)")
+    parser.add_argument("--team-inflight", type=int, default=4, help="Per-team in-flight mutations (default: 4)")
+    parser.add_argument(
+        "--no-fingerprints", dest="fingerprints", action="store_false", help="Plan every team in full on every cycle"
+    )
+    parser.add_argument("--cycles", type=int, default=2, help="Number of sync cycles to run (default: 2)")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed for the synthetic data (default: 42)")
+    parser.add_argument("--json", help="Also write the per-stage results to this JSON file")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,114 @@
+"""Synthetic ASF-like organization data for Boxer benchmarks.
+   Generates a reproducible set of projects, people and repositories, along with the (slightly drifted) state
+   GitHub would have for them, so that a sync run has a realistic amount of work to do."""
+import random
+import typing
+
+
+class SyntheticPerson:
+    asf_id: str
+    github_login: typing.Optional[str]
+    mfa: bool
+
+    def __init__(self, asf_id: str, github_login: typing.Optional[str], mfa: bool):
+        self.asf_id = asf_id
+        self.github_login = github_login
+        self.mfa = mfa
+
+
+class SyntheticProject:
+    name: str
+    committers: typing.List[str]
+    pmc: typing.List[str]
+    public_repos: typing.List[str]
+    private_repos: typing.List[str]
+
+    def __init__(self, name: str):
+        self.name = name
+        self.committers = []
+        self.pmc = []
+        self.public_repos = []
+        self.private_repos = []
+
+
+class SyntheticOrg:
+    """A synthetic organization: projects with committers/PMC members and repositories, people with GitHub
+       logins and MFA statuses, and the current state of each GitHub team (drifted from the desired state)"""
+
+    projects: typing.Dict[str, SyntheticProject]
+    people: typing.Dict[str, SyntheticPerson]
+    github_teams: typing.Dict[str, typing.Tuple[typing.List[str], typing.List[str]]]
+
+    def __init__(
+        self,
+        projects: int = 300,
+        people: int = 8000,
+        repos: int = 2000,
+        private_ratio: float = 0.1,
+        mfa_ratio: float = 0.95,
+        drift: float = 0.02,
+        seed: int = 42,
+    ):
+        rng = random.Random(seed)
+        self.projects = {}
+        self.people = {}
+        self.github_teams = {}
+        for i in range(people):
+            asf_id = f"user{i:05d}"
+            linked = rng.random() < 0.9
+            self.people[asf_id] = SyntheticPerson(asf_id, f"gh-{asf_id}" if linked else None, rng.random() < mfa_ratio)
+        asf_ids = list(self.people)
+
+        names = [f"project{i:03d}" for i in range(projects)]
+        for name in names:
+            self.projects[name] = SyntheticProject(name)
+        # Project sizes follow a long tail, like the real thing: a few huge projects, lots of small ones.
+        weights = [1.0 / (rank + 1) for rank in range(projects)]
+        for asf_id in asf_ids:
+            for name in set(rng.choices(names, weights=weights, k=rng.randint(1, 3))):
+                self.projects[name].committers.append(asf_id)
+        for project in self.projects.values():
+            if not project.committers:
+                project.committers.append(rng.choice(asf_ids))
+            project.pmc = rng.sample(project.committers, max(1, len(project.committers) // 5))
+
+        for i in range(repos):
+            project = self.projects[names[i % projects]] if i < projects else self.projects[rng.choices(names, weights=weights)[0]]
+            if i < projects:
+                repo = project.name
+            else:
+                repo = f"{project.name}-{len(project.public_repos) + len(project.private_repos)}"
+            if i >= projects and rng.random() < private_ratio:
+                project.private_repos.append(repo)
+            else:
+                project.public_repos.append(repo)
+
+        # Current GitHub state: the desired state, with a bit of drift in either direction
+        for project in self.projects.values():
+            for role, repos, members in (
+                ("committers", project.public_repos, project.committers),
+                ("private", project.private_repos, project.pmc),
+            ):
+                if not repos:
+                    continue
+                desired = [
+                    self.people[x].github_login for x in members if self.people[x].github_login and self.people[x].mfa
+                ]
+                current = [login for login in desired if rng.random() >= drift]
+                current.extend(
+                    f"gh-{rng.choice(asf_ids)}" for _ in range(int(len(desired) * drift + rng.random()))
+                )
+                current_repos = [repo for repo in repos if rng.random() >= drift]
+                self.github_teams[f"{project.name} {role}"] = (sorted(set(current)), current_repos)
+
+    @property
+    def github_repos(self) -> typing.List[str]:
+        repos = []
+        for project in self.projects.values():
+            repos.extend(project.public_repos)
+            repos.extend(project.private_repos)
+        return repos
+
+    @property
+    def mfa(self) -> typing.Dict[str, bool]:
+        return {person.github_login: person.mfa for person in self.people.values() if person.github_login}
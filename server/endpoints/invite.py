@@ -30,7 +30,7 @@ async def process(
             if person.asf_id == session.credentials.uid:
                 print(f"Unlinking GitHub login from user {person.asf_id}")
                 person.github_login = ""
-                person.save(server.database.client)
+                person.save(server.database.links)
                 return {
                     "okay": True,
                     "reauth": True,
@@ -46,7 +46,7 @@ async def process(
                 if person.github_login == session.credentials.github_login:
                     print(f"Removing stale GitHub login from user {person.asf_id}")
                     person.github_login = ""
-                    person.save(server.database.client)
+                    person.save(server.database.links)
                     break
         return {
             "okay": False,
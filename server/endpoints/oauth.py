@@ -50,7 +50,8 @@ async def process(
 
     if rv and oatype == "apache":
         ghid = None
-        person = plugins.projects.Committer(asf_id=rv["uid"], linkdb=server.database.client)
+        await server.database.links.ready()
+        person = plugins.projects.Committer(asf_id=rv["uid"], linkdb=server.database.links)
         if person and person.github_login:
             ghid = person.github_login
             if person not in server.data.people:
@@ -68,15 +69,16 @@ async def process(
             print(f"Removing stale GitHub link entry for {session.credentials.uid}")
             server.data.people.remove(session.credentials.uid)
 
+        await server.database.links.ready()
         person = plugins.projects.Committer(
             asf_id=session.credentials.uid,
-            linkdb=server.database.client,
+            linkdb=server.database.links,
         )
         person.github_login = session.credentials.github_login
         person.github_id = session.credentials.github_id
         person.real_name = session.credentials.name
         person.github_mfa = session.credentials.github_login in server.data.mfa and server.data.mfa[session.credentials.github_login]
-        person.save(server.database.client)
+        person.save(server.database.links)
         server.data.people.append(person)
         return {
             "okay": True,
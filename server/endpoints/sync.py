@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import plugins.basetypes
+import plugins.session
+
+""" GitHub org admin endpoint for Boxer to have projects reconciled with GitHub right away"""
+
+
+async def process(
+        server: plugins.basetypes.Server, session: plugins.session.SessionObject, indata: dict
+) -> dict:
+    if session.credentials and session.credentials.admin:
+        if server.data.scheduler is None:
+            return {
+                "okay": False,
+                "message": "Background tasks have not started yet!",
+            }
+        projects = indata.get('projects', [])
+        if isinstance(projects, str):
+            projects = projects.split()
+        if projects:
+            server.data.scheduler.trigger("reconcile", projects)
+            message = f"Reconciling GitHub teams of {len(projects)} projects shortly"
+        else:
+            server.data.scheduler.trigger("run")
+            message = "Full background run scheduled"
+        return {
+            "okay": True,
+            "message": message,
+        }
+    else:
+        return {
+            "okay": False,
+            "message": "This endpoint requires administrative access!",
+        }
+
+
+def register(server: plugins.basetypes.Server):
+    return plugins.basetypes.Endpoint(process)
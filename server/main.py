@@ -22,6 +22,7 @@ import asyncio
 import importlib
 import json
 import os
+import signal
 import sys
 import traceback
 
@@ -161,10 +162,22 @@ class Server(plugins.basetypes.Server):
 
     def run(self):
         loop = asyncio.get_event_loop()
+        main_task = loop.create_task(self.server_loop(loop))
+        # Being stopped by the service manager shuts down as cleanly as Ctrl+C does, so queued writes are not lost
+        loop.add_signal_handler(signal.SIGTERM, main_task.cancel)
         try:
-            loop.run_until_complete(self.server_loop(loop))
-        except KeyboardInterrupt:
+            loop.run_until_complete(main_task)
+        except (KeyboardInterrupt, asyncio.CancelledError):
             pass
+        loop.run_until_complete(self.database.close())  # Don't lose GitHub links that are still waiting to be written
+        if self.data.github_org:
+            loop.run_until_complete(self.data.github_org.close())
+        if self.data.ldap_client:
+            loop.run_until_complete(self.data.ldap_client.close())
+        if self.data.fallback:
+            loop.run_until_complete(self.data.fallback.close())
+        if self.data.watcher:
+            self.data.watcher.close()
         loop.close()
 
 
@@ -2,6 +2,7 @@ import asyncio
 import datetime
 import sys
 import time
+import typing
 
 import plugins.basetypes
 import plugins.configuration
@@ -9,175 +10,513 @@ import plugins.database
 import plugins.repositories
 import plugins.projects
 import plugins.github
+import plugins.ldap
+import plugins.reconcile
+import plugins.scheduler
+import plugins.state
+import plugins.transport
 
 
 class ProgTimer:
-    """A simple task timer that displays when a sub-task is begun, ends, and the time taken."""
+    """A simple task timer that displays when a sub-task is begun, ends, and the time taken.
+    If the sub-task runs alongside others (as stages of a Pipeline do), those are listed when it begins, and it is
+    named again when done, so interleaved output can still be told apart."""
 
-    def __init__(self, title):
+    def __init__(self, title, alongside: typing.Optional[typing.Iterable[str]] = None):
         self.title: str = title
         self.time: float = time.time()
+        self.alongside = None if alongside is None else list(alongside)
 
     async def __aenter__(self):
-        sys.stdout.write("[%s] %s...\n" % (datetime.datetime.now().strftime("%H:%M:%S"), self.title))
+        alongside = " (alongside: %s)" % ", ".join(self.alongside) if self.alongside else ""
+        sys.stdout.write("[%s] %s...%s\n" % (datetime.datetime.now().strftime("%H:%M:%S"), self.title, alongside))
         sys.stdout.flush()
         self.start = time.time()
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
-        print("[%s] Done in %.2f seconds" % (datetime.datetime.now().strftime("%H:%M:%S"), time.time() - self.start))
+        now = datetime.datetime.now().strftime("%H:%M:%S")
+        if self.alongside is None:
+            print("[%s] Done in %.2f seconds" % (now, time.time() - self.start))
+        else:
+            print("[%s] %s: done in %.2f seconds" % (now, self.title, time.time() - self.start))
 
 
-async def adjust_teams(server: plugins.basetypes.Server):
-    """Adjusts GitHub teams:
-    - Adds new LDAP members with MFA enabled
-    - Removes members no longer in LDAP or no longer with MFA enabled
+class AbortRun(Exception):
+    """Raised by a stage when the background run cannot go on, to try again after retry_in seconds"""
+
+    def __init__(self, message: str, retry_in: float):
+        super().__init__(message)
+        self.retry_in = retry_in
+
+
+class Stage:
+    """A stage of a background run: a coroutine function and the names of the stages it needs the results of"""
+
+    def __init__(self, name: str, title: str, run: typing.Callable[[], typing.Awaitable], after: typing.Iterable[str]):
+        self.name = name
+        self.title = title
+        self.run = run
+        self.after = tuple(after)
+        self.started: typing.Optional[float] = None
+        self.finished: typing.Optional[float] = None
+
+
+class Pipeline:
+    """Runs the stages of a background run as a dependency graph: every stage starts as soon as the stages it runs
+    after are done, so stages that don't depend on each other (fetching from gitbox, GitHub and LDAP) run
+    concurrently. If a stage fails, the stages that have not finished yet are cancelled and the error is raised."""
+
+    def __init__(self):
+        self.stages: typing.Dict[str, Stage] = {}
+        self.tasks: typing.Dict[str, asyncio.Future] = {}
+        self.running: typing.List[str] = []
+        self.started = 0.0
+        self.finished = 0.0
+
+    def add(self, name: str, title: str, run: typing.Callable[[], typing.Awaitable], after: typing.Iterable[str] = ()):
+        for dependency in after:
+            assert dependency in self.stages, f"Stage {name} runs after unknown stage {dependency}"
+        self.stages[name] = Stage(name, title, run, after)
+
+    def result(self, name: str):
+        """Returns the result of a stage that is done"""
+        return self.tasks[name].result()
+
+    async def run_stage(self, stage: Stage):
+        if stage.after:
+            await asyncio.gather(*(self.tasks[dependency] for dependency in stage.after))
+        async with ProgTimer(stage.title, alongside=self.running):
+            self.running.append(stage.name)
+            stage.started = time.time()
+            try:
+                return await stage.run()
+            finally:
+                stage.finished = time.time()
+                self.running.remove(stage.name)
+
+    async def run(self):
+        self.started = time.time()
+        self.tasks = {name: asyncio.ensure_future(self.run_stage(stage)) for name, stage in self.stages.items()}
+        try:
+            await asyncio.gather(*self.tasks.values())
+        except BaseException:
+            for task in self.tasks.values():
+                task.cancel()
+            await asyncio.gather(*self.tasks.values(), return_exceptions=True)
+            raise
+        finally:
+            self.finished = time.time()
+
+    def critical_path(self) -> typing.List[Stage]:
+        """Returns the chain of stages that held up the run: the stage that finished last, the stage it waited for
+        last, and so on back to a stage that did not have to wait for anything"""
+        done = [stage for stage in self.stages.values() if stage.finished is not None]
+        if not done:
+            return []
+        path = [max(done, key=lambda stage: stage.finished)]
+        while path[-1].after:
+            path.append(max((self.stages[name] for name in path[-1].after), key=lambda stage: stage.finished))
+        return path[::-1]
+
+    def report(self):
+        """Prints how long the stages took, how much of that was spent running alongside each other, and the
+        critical path"""
+        wall = self.finished - self.started
+        busy = sum(
+            stage.finished - stage.started for stage in self.stages.values() if stage.finished and stage.started
+        )
+        path = self.critical_path()
+        print(
+            "Stages took %.2f seconds in total, done in %.2f seconds (%.2f seconds saved by running them alongside "
+            "each other)." % (busy, wall, max(busy - wall, 0))
+        )
+        print(
+            "Critical path: %s, %.2f seconds."
+            % (" -> ".join(stage.name for stage in path), sum(stage.finished - stage.started for stage in path))
+        )
+
+
+def merge_people(server: plugins.basetypes.Server, org: plugins.projects.Organization):
+    """Brings server.data.people in step with the organization: people new to it are added, and any entry that is
+    not the organization's own object (one from an earlier organization, or the standalone one a GitHub login
+    adds) is replaced by it, so the repositories, GitHub links and MFA status of the organization show in
+    server.data.people as well"""
+    known = set()
+    for i, existing in enumerate(server.data.people):
+        known.add(existing.asf_id)
+        person = org.accounts.get(existing.asf_id)
+        if person is None or person is existing:
+            continue
+        # What we only know from someone logging in is not in the organization
+        if not person.real_name:
+            person.real_name = existing.real_name
+        if getattr(person, "github_id", None) is None and getattr(existing, "github_id", None) is not None:
+            person.github_id = existing.github_id
+        server.data.people[i] = person
+    server.data.people.extend(person for person in org.committers if person.asf_id not in known)
+
+
+async def check_gitbox(
+    server: plugins.basetypes.Server,
+    scheduler: plugins.scheduler.Scheduler,
+    watcher: typing.Optional[plugins.repositories.RepositoryWatcher] = None,
+    fallback: typing.Optional[plugins.repositories.FallbackList] = None,
+):
     """
-    async with ProgTimer("Adjusting GitHub teams according to LDAP/MFA"):
-        for team in server.data.teams:
-            if team.type == "committers":
-                asf_project = server.data.projects.get(team.project)
-                if asf_project:
-                    if asf_project.public_repos:
-                        ldap_github_team = asf_project.public_github_team(server.data.mfa)
-                        if asf_project.committers:  # Only set if we got LDAP data back
-                            added, removed = await team.set_membership(ldap_github_team)
-                            if added:
-                                print(f"Added {len(added)} members to team {team.slug}: {', '.join(added)}")
-                            if removed:
-                                print(f"Removed {len(removed)} members from team {team.slug}: {', '.join(removed)}")
-                else:
-                    print(f"Could not find an ASF project for team {team.slug}!!")
-
-            # PMC Groups
-            elif team.type == "private":
-                asf_project = server.data.projects.get(team.project)
-                if asf_project:
-                    if asf_project.private_repos:
-                        ldap_github_team = asf_project.private_github_team(server.data.mfa)
-                        if asf_project.pmc:  # Only set if we got LDAP data back
-                            added, removed = await team.set_membership(ldap_github_team)
-                            if added:
-                                print(f"Added {len(added)} members to team {team.slug}: {', '.join(added)}")
-                            if removed:
-                                print(f"Removed {len(removed)} members from team {team.slug}: {', '.join(removed)}")
-                else:
-                    print(f"Could not find an ASF project for team {team.slug}!!")
-
-
-async def adjust_repositories(server: plugins.basetypes.Server):
-    """Adjusts repositories, adding/removing disparities between GitBox and GitHub"""
-    async with ProgTimer("Adjusting GitHub team repositories according to gitbox repos"):
-        for team in server.data.teams:
-            if team.type == "committers":
-                asf_project = server.data.projects.get(team.project)
-                if asf_project:
-                    managed_repos = [
-                        x.filename for x in asf_project.public_repos if x.filename in server.data.github_repos
-                    ]
-                    added, removed = await team.set_repositories(managed_repos)
-                    for repo in added:
-                        print(f"- Added {repo}.git to GitHub team {team.slug}")
-                    for repo in removed:
-                        print(f"- Removed {repo}.git from GitHub team {team.slug}")
-            elif team.type == "private":
-                asf_project = server.data.projects.get(team.project)
-                if asf_project:
-                    managed_repos = [
-                        x.filename for x in asf_project.private_repos if x.filename in server.data.github_repos
-                    ]
-                    added, removed = await team.set_repositories(managed_repos)
-                    for repo in added:
-                        print(f"- Added {repo}.git to GitHub team {team.slug}")
-                    for repo in removed:
-                        print(f"- Removed {repo}.git from GitHub team {team.slug}")
+        Looks for repositories added to or removed from gitbox since the last look, and has the projects they belong
+        to reconciled right away, instead of waiting for the next full run. With a watcher, these are the ones it saw
+        come and go, otherwise gitbox is listed and compared to the last listing.
+    """
+    if server.data.organization is None:
+        return  # Nothing to go on till the first full run is done
+    if watcher is not None and watcher.active:
+        added, removed = watcher.drain()
+        if not added and not removed:
+            return
+        server.data.repositories = await plugins.repositories.list_all(server.config.repos, watcher, fallback)
+    else:
+        repositories = await plugins.repositories.list_all(server.config.repos, fallback=fallback)
+        known = set(repo.filepath for repo in server.data.repositories)
+        current = set(repo.filepath for repo in repositories)
+        if known == current:
+            return
+        added = [repo for repo in repositories if repo.filepath not in known]
+        removed = [repo for repo in server.data.repositories if repo.filepath not in current]
+        server.data.repositories = repositories
+    # New repositories only get assigned to teams once they are on GitHub, which the last snapshot can't know yet
+    for repo in added:
+        if repo.filename not in server.data.github_repos and await server.data.github_org.has_repository(repo.filename):
+            if repo.filename not in server.data.github_repos:
+                server.data.github_repos.append(repo.filename)
+    projects = set(repo.project for repo in added + removed)
+    print(
+        "%u repositories added and %u removed on gitbox, reconciling %s"
+        % (len(added), len(removed), ", ".join(sorted(projects)))
+    )
+    scheduler.trigger("reconcile", projects)
+
+
+async def check_mfa(server: plugins.basetypes.Server, scheduler: plugins.scheduler.Scheduler):
+    """
+        Fetches the MFA status of the GitHub organization members, and if it changed for anyone since the last look,
+        has the projects they are on reconciled right away, instead of waiting for the next full run.
+    """
+    asf_org = server.data.organization
+    if asf_org is None or asf_org.linkdb is not server.database.links:
+        return  # Nothing to go on till the first full run is done
+    mfa = await server.data.github_org.get_mfa_status()
+    previous_mfa = server.data.mfa
+    server.data.mfa = mfa
+    changes = plugins.projects.ChangeSet()
+    plugins.projects.sync_mfa(asf_org, changes, mfa, previous_mfa)
+    if changes.projects:
+        print(
+            "MFA status changed for %u people, reconciling %u projects" % (len(changes.people), len(changes.projects))
+        )
+        scheduler.trigger("reconcile", changes.projects)
+
+
+async def reconcile_projects(
+    server: plugins.basetypes.Server,
+    fingerprints: plugins.reconcile.TeamFingerprints,
+    projects: typing.Optional[typing.Set[str]],
+):
+    """
+        Brings the organization up to date with what changed on gitbox, in LDAP and in the link table since the
+        last look (see plugins.projects.update_data), and reconciles the GitHub teams of the projects that changed,
+        and of the projects it was triggered for, right away. Runs every ldap/poll_interval seconds in between full
+        runs, so LDAP changes are picked up quickly as well.
+    """
+    asf_org = server.data.organization
+    asf_github_org = server.data.github_org
+    if not asf_org or asf_org.linkdb is not server.database.links or not asf_github_org.teams:
+        return  # Nothing to go on till the first full run is done
+    await server.database.links.refresh()
+    changes = await plugins.projects.update_data(
+        asf_org,
+        server.config.ldap,
+        server.data.repositories,
+        client=server.data.ldap_client,
+        mfa=server.data.mfa,
+        previous_mfa=server.data.mfa,
+        relinked=server.database.links.pop_changed(),
+    )
+    merge_people(server, asf_org)
+    to_plan = changes.projects | (set(asf_org.projects) if projects is None else projects)
+    if not to_plan:
+        return
+    print("Reconciling GitHub teams of %u projects: %s" % (len(to_plan), ", ".join(sorted(to_plan))))
+    # The next full run's change set won't know about these, and projects asked for are to be looked at in full
+    fingerprints.forget(to_plan)
+    plan = plugins.reconcile.plan_reconciliation(server, asf_github_org, to_plan, fingerprints)
+    plan = plan.fit_to_budget(asf_github_org.ratelimit.bucket("core").budget())
+    if server.config.github.dry_run:
+        print("Dry run, not applying %u changes." % len(plan))
+        return
+    if plan:
+        await asf_github_org.get_id()  # Not fetched yet if we are going on the state loaded at startup
+        async with ProgTimer("Applying %u GitHub team changes for %u projects" % (len(plan), len(to_plan))):
+            await plugins.reconcile.apply_plan(asf_github_org, plan)
+    fingerprints.commit(plan, asf_github_org.teams)
 
 
 async def run_tasks(server: plugins.basetypes.Server):
     """
         Runs long-lived background data gathering tasks such as gathering repositories, projects and ldap/mfa data.
 
-        Generally runs every 2½ minutes, or whatever is set in tasks/refresh_rate in boxer.yaml
+        A full run happens every 2½ minutes, or whatever is set in tasks/refresh_rate in boxer.yaml. In between,
+        gitbox (tasks/gitbox_interval), MFA status (tasks/mfa_interval) and LDAP (ldap/poll_interval) are checked
+        more often, and the projects that changed are reconciled right away. Any of these can also be triggered
+        through server.data.scheduler.
     """
 
-    while True:
+    # The organisation client is kept across runs, so its connection pool and org ID are reused.
+    asf_github_org = plugins.github.GitHubOrganisation(
+        login=server.config.github.org,
+        personal_access_token=server.config.github.token,
+        connection_limit=server.config.github.connection_limit,
+        max_inflight=server.config.github.max_inflight,
+        team_inflight=server.config.github.team_inflight,
+        max_retries=server.config.github.max_retries,
+        api_url=server.config.github.api_url,
+    )
+    server.data.github_org = asf_github_org
+    # Likewise for LDAP, connections are pooled and kept open between runs.
+    ldap_client = plugins.ldap.LDAPClient(server.config.ldap)
+    server.data.ldap_client = ldap_client
+    # Fingerprints of every team as of the last cycle that reconciled it, so unchanged teams can be skipped
+    fingerprints = plugins.reconcile.TeamFingerprints()
+    scheduler = plugins.scheduler.Scheduler()
+    server.data.scheduler = scheduler
+    # Repositories coming and going on gitbox are seen as they happen, if we can watch the repo dirs
+    watcher = None
+    if server.config.repos.watch:
+        watcher = plugins.repositories.RepositoryWatcher(server.config.repos)
+        try:
+            watcher.start()
+            watcher.listeners.append(lambda: scheduler.trigger("gitbox"))
+        except OSError as e:
+            print("Could not watch the repository dirs, listing them instead: %s" % e)
+            watcher.close()
+            watcher = None
+    server.data.watcher = watcher
+    # The old server's repository list is only downloaded again when it changed, and its last copy kept around
+    fallback = plugins.repositories.FallbackList(server.config.repos) if server.config.repos.fallback else None
+    server.data.fallback = fallback
+    last_full_rebuild = 0.0
+
+    # Load the state saved by the previous run, so we have something to serve before the first run is done
+    if server.config.tasks.state_file:
+        if plugins.state.load_state(server, server.config.tasks.state_file):
+            last_full_rebuild = time.time()  # The first run brings the loaded organization up to date
+
+    async def full_run(projects: typing.Optional[typing.Set[str]]):
+        nonlocal last_full_rebuild
         now = time.time()
         print(f"Processing GitHub organization '{server.config.github.org}'...")
-        asf_github_org = plugins.github.GitHubOrganisation(
-            login=server.config.github.org, personal_access_token=server.config.github.token
+        # Rate limits are tracked from the responses GitHub sends us, no need to poll for them.
+        core_spent = asf_github_org.ratelimit.bucket("core").spent
+        graphql_spent = asf_github_org.ratelimit.bucket("graphql").spent
+        previous_mfa = server.data.mfa
+        previous_org = server.data.organization
+        full_rebuild = (
+            not server.config.tasks.incremental
+            or previous_org is None
+            or previous_org.linkdb is not server.database.links  # Loaded from the state file, or not compiled by us
+            or time.time() - last_full_rebuild >= server.config.tasks.full_rebuild_interval
         )
-        await asf_github_org.get_id()  # For security reasons, we must call this before we can add/remove members
-        limit, used, resets = await asf_github_org.rate_limit_rest()
-        while used >= (limit-25):
-            how_long_to_wait = resets - int(time.time()-1)
-            print("GitHub REST rate limit reached, waiting till %u (%u seconds)" % (resets, how_long_to_wait))
-            await asyncio.sleep(how_long_to_wait)
-            limit, used, resets = await asf_github_org.rate_limit_rest()
-        print("Used %u out of %u REST tokens this hour." % (used, limit))
-        limit, used, resets = await asf_github_org.rate_limit_graphql()
-        while used >= (limit-25):
-            how_long_to_wait = resets - int(time.time()-1)
-            print("GitHub GraphQL rate limit reached, waiting till %u (%u seconds)" % (resets, how_long_to_wait))
-            await asyncio.sleep(how_long_to_wait)
-            limit, used, resets = await asf_github_org.rate_limit_graphql()
-        print("Used %u out of %u GraphQL tokens this hour." % (used, limit))
-
-        async with ProgTimer("Gathering list of repositories on gitbox"):
+
+        async def get_org_id():
+            await asf_github_org.get_id()  # For security reasons, we must call this before we can add/remove members
+
+        async def list_repositories():
             try:
-                server.data.repositories = await plugins.repositories.list_all(server.config.repos)
+                if watcher is not None:
+                    watcher.drain()  # Everything the watcher saw is in this listing already
+                server.data.repositories = await plugins.repositories.list_all(
+                    server.config.repos, watcher, fallback
+                )
             except Exception as e:
                 print("Could not fetch repositories - source server down or not connected: %s" % e)
-                await asyncio.sleep(10)
-                continue
+                raise AbortRun("gitbox is unavailable", 10)
 
-        async with ProgTimer("Gathering MFA status of GitHub users"):
-            server.data.mfa = await asf_github_org.get_mfa_status()
+        async def load_github():
+            try:
+                snapshot = await asf_github_org.load_snapshot()
+            except plugins.transport.GitHubAPIError as e:
+                print("Could not fetch GitHub organization data - GitHub is having trouble: %s" % e)
+                raise AbortRun("GitHub is unavailable", plugins.transport.BREAKER_COOLDOWN)
+            server.data.mfa = snapshot.mfa
+            server.data.github_repos = snapshot.repositories
+            server.data.teams = snapshot.teams
 
-        async with ProgTimer("Gathering list of repositories on GitHub"):
-            server.data.github_repos = await asf_github_org.load_repositories()
-        async with ProgTimer("Compiling list of projects, repos and memberships"):
+        async def sync_ldap() -> typing.Set[str]:
+            """Brings the LDAP groups of the projects we knew of up to date while gitbox is being listed. New
+            projects, if any, are fetched when compiling."""
+            if previous_org is None:
+                return set()
             try:
-                asf_org = await plugins.projects.compile_data(
-                    server.config.ldap, server.data.repositories, server.database.client
-                )
-                server.data.projects = asf_org.projects
-                for person in asf_org.committers:
-                    # Append?
-                    if person not in server.data.people:
-                        server.data.people.append(person)
-                    # Update?
-                    else:
-                        for p in server.data.people:
-                            if p.asf_id == person.asf_id:
-                                p.repositories = person.repositories
-                                p.projects = person.projects
-                                break
+                return await ldap_client.sync(previous_org.projects.keys())
             except Exception as e:
-                print("Could not fetch repositories - ldap source down or not connected: %s" % e)
+                print("Could not sync LDAP groups ahead of compiling, will try again when compiling: %s" % e)
+                return set()
 
-        async with ProgTimer("Adjusting MFA status for users"):
-            for person in server.data.people:
-                if person.github_login and person.github_login in server.data.mfa:
-                    if person.github_mfa is not server.data.mfa[person.github_login]:
-                        person.github_mfa = server.data.mfa[person.github_login]
-                        person.save(server.database.client)  # Update sqlite db if changed
+        async def compile_projects() -> bool:
+            nonlocal last_full_rebuild
+            try:
+                await server.database.links.refresh()  # One query for all GitHub links, instead of one per committer
+                if full_rebuild:
+                    server.database.links.pop_changed()
+                    asf_org = await plugins.projects.compile_data(
+                        server.config.ldap, server.data.repositories, server.database.links, client=ldap_client
+                    )
+                    server.data.organization = asf_org
+                    server.data.projects = asf_org.projects
+                    server.data.changes = plugins.projects.ChangeSet(full=True)
+                    merge_people(server, asf_org)
+                    last_full_rebuild = time.time()
                 else:
-                    person.github_mfa = False  # Flag as no MFA if person was not found
+                    changes = await plugins.projects.update_data(
+                        previous_org,
+                        server.config.ldap,
+                        server.data.repositories,
+                        client=ldap_client,
+                        relinked=server.database.links.pop_changed(),
+                        changed_groups=pipeline.result("ldap"),
+                    )
+                    server.data.changes = changes
+                    merge_people(server, previous_org)
+                return True
+            except Exception as e:
+                print("Could not fetch repositories - ldap source down or not connected: %s" % e)
+                server.data.changes = None  # Don't know what changed, so plan every team in full
+                last_full_rebuild = 0  # Start over from scratch next time
+                return False
+
+        async def adjust_mfa():
+            if full_rebuild or server.data.changes is None:
+                for person in server.data.people:
+                    plugins.projects.update_mfa(person, server.data.mfa, server.database.links)
+            else:
+                plugins.projects.sync_mfa(server.data.organization, server.data.changes, server.data.mfa, previous_mfa)
+                print("Changes since the previous run: %s" % server.data.changes)
+
+        async def plan_changes() -> plugins.reconcile.ReconciliationPlan:
+            # Projects triggered for (also by the reconcile job this run covers) are planned in full, and all of
+            # them if the run was triggered for everything, so teams that drifted on GitHub are not skipped
+            if projects is None:
+                fingerprints.clear()
+            elif projects:
+                fingerprints.forget(projects)
+            plan = plugins.reconcile.plan_reconciliation(server, asf_github_org, fingerprints=fingerprints)
+            budget = asf_github_org.ratelimit.bucket("core").budget()
+            print(
+                "Planned %u changes (%s) for %u teams, %u teams unchanged since the last run, "
+                "estimated cost %u REST calls, %s left this hour." % (
+                    len(plan),
+                    ", ".join(f"{count} {action}" for action, count in plan.summary().items() if count),
+                    len(plan.fingerprints) - plan.skipped,
+                    plan.skipped,
+                    plan.cost()["core"],
+                    budget if budget is not None else "unknown",
+                )
+            )
+            plan = plan.fit_to_budget(budget)
+            if plan.deferred:
+                print("Not enough REST budget left, deferring %u changes to the next run." % plan.deferred)
+            if server.config.github.plan_file:
+                plan.save(server.config.github.plan_file)
+            return plan
 
-        async with ProgTimer("Getting GitHub teams and their members"):
-            server.data.teams = await asf_github_org.load_teams()
+        async def apply_changes():
+            plan = pipeline.result("plan")
+            if server.config.github.dry_run:
+                print("Dry run, not applying any changes to GitHub.")
+                return
+            await plugins.reconcile.apply_plan(asf_github_org, plan)
+            fingerprints.commit(plan, asf_github_org.teams)
 
-        async with ProgTimer("Looking for missing/invalid GitHub teams"):
-            await asf_github_org.setup_teams(server.data.projects)
+        pipeline = Pipeline()
+        pipeline.add("org_id", "Fetching GitHub organization ID", get_org_id)
+        pipeline.add("gitbox", "Gathering list of repositories on gitbox", list_repositories)
+        pipeline.add("github", "Gathering GitHub teams, repositories and MFA status of users", load_github)
+        pipeline.add("ldap", "Syncing LDAP groups of known projects", sync_ldap)
+        pipeline.add(
+            "compile", "Compiling list of projects, repos and memberships", compile_projects, ("gitbox", "ldap")
+        )
+        pipeline.add("mfa", "Adjusting MFA status for users", adjust_mfa, ("compile", "github"))
+        pipeline.add(
+            "plan", "Planning GitHub team changes according to LDAP/MFA and gitbox repos", plan_changes, ("mfa",)
+        )
+        pipeline.add("apply", "Applying GitHub team changes", apply_changes, ("plan", "org_id"))
+        completed = False
+        try:
+            await pipeline.run()
+            completed = True
+        except AbortRun as e:
+            scheduler.defer("run", e.retry_in)
+            return
+        finally:
+            if not completed:
+                # The LDAP sync and compiling may have run already, moving the LDAP cursor and the previous
+                # organization on past changes that were then never planned. Those won't show in a diff anymore,
+                # so start over from scratch next time.
+                last_full_rebuild = 0
+            pipeline.report()
+        ldap_ok = pipeline.result("compile")
 
-        await adjust_teams(server)
-        await adjust_repositories(server)
+        if server.config.tasks.state_file and ldap_ok:
+            async with ProgTimer("Saving state to disk"):
+                try:
+                    plugins.state.save_state(server, server.config.tasks.state_file)
+                except OSError as e:
+                    print("Could not save state to %s: %s" % (server.config.tasks.state_file, e))
 
-        alimit, aused, aresets = await asf_github_org.rate_limit_graphql()
-        used_gql = aused
-        if used < aused:
-            used_gql -= used
         time_taken = time.time() - now
         print(
-            "Background task run finished after %u seconds. Used %u GraphQL tokens for this." % (time_taken, used_gql)
+            "Background task run finished after %u seconds. Used %u REST calls and %u GraphQL tokens for this." % (
+                time_taken,
+                asf_github_org.ratelimit.bucket("core").spent - core_spent,
+                asf_github_org.ratelimit.bucket("graphql").spent - graphql_spent,
+            )
+        )
+        for resource, budget in asf_github_org.ratelimit.status().items():
+            if budget["limit"] is not None:
+                print("%u out of %u %s tokens left this hour." % (budget["remaining"], budget["limit"], resource))
+        pool_stats = asf_github_org.pool_statistics()
+        print(
+            "GitHub connection pool: %u requests, %u connections opened, %u reused (%.1f%% reuse)" % (
+                pool_stats["requests"], pool_stats["connections_created"], pool_stats["connections_reused"],
+                pool_stats["reuse_ratio"] * 100,
+            )
         )
-        await asyncio.sleep(server.config.tasks.refresh_rate)
+        link_stats = server.database.links.statistics()
+        print(
+            "GitHub links: %u updates, %u rows written in %u transactions, %u waiting" % (
+                link_stats["updates"], link_stats["written"], link_stats["flushes"], link_stats["pending"],
+            )
+        )
+        print("Database: %s" % ", ".join(
+            "%s (%u queries, %.1fms avg, %.1fms max)" % (name, stats["count"], stats["avg"] * 1000, stats["max"] * 1000)
+            for name, stats in server.database.statistics().items()
+        ))
+        print("Scheduled jobs: %s" % ", ".join(
+            "%s (%u runs, %u triggers, %u coalesced)" % (name, stats["runs"], stats["triggers"], stats["coalesced"])
+            for name, stats in scheduler.statistics().items()
+        ))
+
+    # Most urgent first: reconciling projects that changed, then looking for changes, then the full run, which does
+    # all of the others' work as well.
+    reconcile_interval = server.config.ldap.poll_interval if server.config.ldap.incremental else None
+    scheduler.add(
+        "reconcile", lambda projects: reconcile_projects(server, fingerprints, projects), reconcile_interval, 0
+    )
+    scheduler.add(
+        "gitbox",
+        lambda projects: check_gitbox(server, scheduler, watcher, fallback),
+        server.config.tasks.gitbox_interval,
+        1,
+    )
+    scheduler.add("mfa", lambda projects: check_mfa(server, scheduler), server.config.tasks.mfa_interval, 2)
+    scheduler.add("run", full_run, server.config.tasks.refresh_rate, 3, covers=("reconcile", "gitbox", "mfa"))
+    await scheduler.run()
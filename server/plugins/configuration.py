@@ -2,7 +2,9 @@ from __future__ import annotations
 import plugins.basetypes
 import plugins.ldap
 import plugins.github
+import plugins.projects
 import plugins.repositories
+import plugins.scheduler
 import os
 import typing
 
@@ -19,6 +21,13 @@ class TaskConfig:
     def __init__(self, subyaml: dict):
         self.refresh_rate: int = int(subyaml.get("refresh_rate", 150))
         assert self.refresh_rate >= 60, "Refresh rate must be at least 60 seconds!"
+        self.state_file: str = subyaml.get("state_file", "")
+        # Update the organization compiled by the previous run in place, instead of compiling it from scratch
+        self.incremental: bool = bool(subyaml.get("incremental", True))
+        self.full_rebuild_interval: int = int(subyaml.get("full_rebuild_interval", 3600))
+        # How often to look for new repositories on gitbox and MFA changes in between full runs. 0 to not look.
+        self.gitbox_interval: int = int(subyaml.get("gitbox_interval", 60))
+        self.mfa_interval: int = int(subyaml.get("mfa_interval", 300))
 
 
 class OAuthConfig:
@@ -35,6 +44,11 @@ class DBConfig:
     def __init__(self, subyaml: dict):
         self.dbtype: str = subyaml.get("dbtype", "sqlite")
         self.dbfile: str = subyaml.get("dbfile", "boxer.db")
+        # Writes to the ids table are batched, and written at least this often (seconds, 0 to write right away)
+        self.flush_interval: float = float(subyaml.get("flush_interval", 5))
+        self.flush_batch: int = int(subyaml.get("flush_batch", 500))
+        # Threads for reading the database off the event loop (writes have a thread of their own)
+        self.readers: int = int(subyaml.get("readers", 2))
         assert self.dbtype == 'sqlite', "DB type must be SQLite for now, I dunno other types"
         assert isinstance(self.dbfile, str) and os.path.exists(self.dbfile), "DB File must exist on disk!"
 
@@ -44,6 +58,14 @@ class GitHubConfig:
     def __init__(self, subyaml: dict):
         self.token: str = subyaml.get("token", "")
         self.org: str = subyaml.get("org", "asftest")
+        self.api_url: str = subyaml.get("api_url", plugins.github.API_URL)
+        self.connection_limit: int = int(subyaml.get("connection_limit", 16))
+        self.max_inflight: int = int(subyaml.get("max_inflight", 8))
+        self.team_inflight: int = int(subyaml.get("team_inflight", 4))
+        self.max_retries: int = int(subyaml.get("max_retries", 5))
+        self.dry_run: bool = bool(subyaml.get("dry_run", False))
+        self.plan_file: str = subyaml.get("plan_file", "")
+        assert self.max_inflight >= 1 and self.team_inflight >= 1, "GitHub in-flight limits must be at least 1!"
         assert isinstance(self.token, str) and len(self.token) == 40, "GitHub token must be a valid token!"
 
 
@@ -72,4 +94,11 @@ class InterData:
         self.projects: dict = {}
         self.mfa: dict = {}
         self.teams: typing.List[plugins.github.GitHubTeam] = []
+        self.github_org: typing.Optional[plugins.github.GitHubOrganisation] = None
+        self.ldap_client: typing.Optional[plugins.ldap.LDAPClient] = None
+        self.organization: typing.Optional[plugins.projects.Organization] = None
+        self.changes: typing.Optional[plugins.projects.ChangeSet] = None
+        self.scheduler: typing.Optional[plugins.scheduler.Scheduler] = None
+        self.watcher: typing.Optional[plugins.repositories.RepositoryWatcher] = None
+        self.fallback: typing.Optional[plugins.repositories.FallbackList] = None
 
@@ -19,21 +19,124 @@
 This is the Database library stub for ASF Infra Boxer
 """
 
+from __future__ import annotations
+import asyncio
+import concurrent.futures
+import sqlite3
+import threading
+import time
+import typing
 import uuid
 import asfpy.sqlite
 import plugins.configuration
+import plugins.projects
+
+# The sqlite3 module keeps the compiled statement for each SQL string, per connection, so this is only prepared
+# once per database thread.
+IDS_SELECT_ALL = "SELECT * FROM ids"
 
 
 class DatabaseError(asfpy.sqlite.AsfpyDBError):
     pass
 
 
+class QueryStats:
+    """Latency of one kind of query, as seen by the coroutines waiting for it, so including the time spent waiting
+    for a database thread"""
+
+    __slots__ = ("count", "total", "max")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, elapsed: float):
+        self.count += 1
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+
+
 class Database:
+    """The Boxer database. The awaitable methods run their SQLite work off the event loop: writes on a dedicated
+    writer thread, one at a time and in order, and reads on a small pool of reader threads, each with its own
+    connection. The database is in WAL mode, so readers don't wait for the writer or its fsyncs, and the other way
+    around. The client handle is still there for code that has to query the database synchronously."""
+
     client: asfpy.sqlite.DB
     config: plugins.configuration.DBConfig
+    links: plugins.projects.LinkTable
 
     def __init__(self, config: plugins.configuration.DBConfig):
         self.config = config
         self.uuid = str(uuid.uuid4())
         self.client = asfpy.sqlite.DB(config.dbfile)
+        # Persistent, so this is for every connection from now on
+        self.client.connector.execute("PRAGMA journal_mode=WAL").fetchall()
+        self.writer = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix="boxer-db-writer")
+        self.readers = concurrent.futures.ThreadPoolExecutor(config.readers, thread_name_prefix="boxer-db-reader")
+        self.local = threading.local()
+        self.connections: typing.List[sqlite3.Connection] = []
+        self.stats: typing.Dict[str, QueryStats] = {}
+        self.links = plugins.projects.LinkTable(
+            self.client, flush_interval=config.flush_interval, flush_batch=config.flush_batch, store=self
+        )
+
+    def connection(self) -> sqlite3.Connection:
+        """Returns the connection of the database thread we are on, opening it the first time"""
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            # Only ever used by this thread, but closed by close() from the main thread
+            connection = sqlite3.connect(self.config.dbfile, isolation_level=None, check_same_thread=False)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA synchronous=NORMAL")  # Safe in WAL mode, only checkpoints need to fsync
+            connection.execute("PRAGMA busy_timeout=5000")
+            self.local.connection = connection
+            self.connections.append(connection)
+        return connection
+
+    async def run(
+        self, name: str, executor: concurrent.futures.Executor, work: typing.Callable[[sqlite3.Connection], typing.Any]
+    ):
+        """Runs work with the connection of a database thread, and records how long it took under name"""
+        start = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(executor, lambda: work(self.connection()))
+        finally:
+            self.stats.setdefault(name, QueryStats()).add(time.perf_counter() - start)
+
+    async def fetch_links(self) -> typing.List[dict]:
+        """Fetches the whole ids table"""
+        rows = await self.run(
+            "fetch_links", self.readers, lambda connection: connection.execute(IDS_SELECT_ALL).fetchall()
+        )
+        return [dict(row) for row in rows]
+
+    async def upsert_links(self, values: typing.List[tuple]):
+        """Inserts or updates ids rows, given as (asfid, githubid, mfa, updated), in a single transaction"""
+
+        def upsert(connection: sqlite3.Connection):
+            connection.execute("BEGIN")
+            try:
+                connection.executemany(plugins.projects.IDS_UPSERT, values)
+                connection.execute("COMMIT")
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+
+        await self.run("upsert_links", self.writer, upsert)
+
+    def statistics(self) -> typing.Dict[str, dict]:
+        return {
+            name: {"count": stats.count, "avg": stats.total / stats.count, "max": stats.max}
+            for name, stats in self.stats.items()
+        }
 
+    async def close(self):
+        """Writes what the link table still has queued, and closes the database threads and their connections"""
+        await self.links.sync()
+        self.writer.shutdown()
+        self.readers.shutdown()
+        for connection in self.connections:
+            connection.close()
+        self.connections = []
@@ -1,12 +1,141 @@
 """Miscellaneous GitHub classes for Boxer"""
 import aiohttp
+import asyncio
 import typing
 import json
-import plugins.projects
-import dateutil.parser
-
-GRAPHQL_URL = "https://api.github.com/graphql"
-DEBUG = False  # We don't wanna do the PUT/DELETE right now, so let's not...
+import sys
+import plugins.ratelimit
+import plugins.transport
+
+API_URL = "https://api.github.com"
+KEEPALIVE_TIMEOUT = 60  # Keep idle pooled connections around for a minute
+
+# Combined organization snapshot query. Each connection is aliased and paginated with its own cursor.
+SNAPSHOT_QUERY = """
+query($login: String!, %s) {
+    organization(login: $login) {
+        %s
+    }
+    rateLimit {
+        limit
+        cost
+        remaining
+        resetAt
+    }
+}
+"""
+SNAPSHOT_CONNECTIONS = {
+    "teams": """
+        teams: teams(first: 100, after: $teams_cursor) {
+            pageInfo {
+                hasNextPage
+                endCursor
+            }
+            edges {
+                node {
+                    name
+                    slug
+                    databaseId
+                    members(first: 100) {
+                        totalCount
+                        pageInfo {
+                            hasNextPage
+                            endCursor
+                        }
+                        edges {
+                            node {
+                                login
+                            }
+                        }
+                    }
+                    repositories(first: 100) {
+                        totalCount
+                        pageInfo {
+                            hasNextPage
+                            endCursor
+                        }
+                        edges {
+                            node {
+                                name
+                            }
+                        }
+                    }
+                }
+            }
+        }""",
+    "repositories": """
+        repositories: repositories(first: 100, after: $repositories_cursor) {
+            pageInfo {
+                hasNextPage
+                endCursor
+            }
+            edges {
+                node {
+                    name
+                }
+            }
+        }""",
+    "members": """
+        members: membersWithRole(first: 100, after: $members_cursor) {
+            pageInfo {
+                hasNextPage
+                endCursor
+            }
+            edges {
+                hasTwoFactorEnabled
+                node {
+                    login
+                }
+            }
+        }""",
+}
+
+
+# Batched continuation query for oversized teams. Each team connection is aliased with its own slug and cursor.
+TEAM_FILL_QUERY = """
+query($login: String!, %s) {
+    organization(login: $login) {
+        %s
+    }
+    rateLimit {
+        limit
+        cost
+        remaining
+        resetAt
+    }
+}
+"""
+TEAM_FILL_CONNECTIONS = {
+    "members": """
+        team%(index)u: team(slug: $slug%(index)u) {
+            members(first: 100, after: $cursor%(index)u) {
+                pageInfo {
+                    hasNextPage
+                    endCursor
+                }
+                edges {
+                    node {
+                        login
+                    }
+                }
+            }
+        }""",
+    "repositories": """
+        team%(index)u: team(slug: $slug%(index)u) {
+            repositories(first: 100, after: $cursor%(index)u) {
+                pageInfo {
+                    hasNextPage
+                    endCursor
+                }
+                edges {
+                    node {
+                        name
+                    }
+                }
+            }
+        }""",
+}
+TEAM_FILL_BATCH = 20  # Max number of team connections to page through in a single query
 
 
 class GitHubOrganisation:
@@ -23,6 +152,12 @@ class GitHubOrganisation:
         login: str = "apache",
         personal_access_token: str = "",
         bearer_token: str = "",
+        connection_limit: int = 16,
+        dns_cache_ttl: int = 300,
+        max_inflight: int = 8,
+        team_inflight: int = 4,
+        max_retries: int = plugins.transport.MAX_RETRIES,
+        api_url: str = API_URL,
     ):
         """
         Instantiate a GitHub Organization
@@ -30,60 +165,151 @@ class GitHubOrganisation:
         :param login: The GitHub organization to instantiate, e.g. apache
         :param personal_access_token: Personal access token from an org owner account
         :param bearer_token: If using bearer token instead of PAT, use it here
+        :param connection_limit: Maximum number of pooled connections to the GitHub API
+        :param dns_cache_ttl: How long (in seconds) to cache DNS lookups for the GitHub API
+        :param max_inflight: Maximum number of PUT/POST/DELETE calls in flight for the whole organization
+        :param team_inflight: Maximum number of membership/repository changes in flight per team
+        :param max_retries: How many times to retry an API call that failed with a transient error
+        :param api_url: Base URL of the GitHub API, for GitHub Enterprise or a local stand-in
         """
         assert (
             personal_access_token or bearer_token
         ), "You must specify either a PAT or a bearer token!"
         self.login = login
+        self.api_url = api_url.rstrip("/")
         self.orgid = None
         self.teams = list()
         self.repositories = list()
+        self.connection_limit = connection_limit
+        self.dns_cache_ttl = dns_cache_ttl
+        self.pool_stats = {
+            "requests": 0,
+            "connections_created": 0,
+            "connections_reused": 0,
+        }
+        self._session = None
+        self.inflight = asyncio.Semaphore(max(1, max_inflight))
+        self.team_inflight = max(1, team_inflight)
+        self.ratelimit = plugins.ratelimit.RateLimitTracker()
+        self.transport = plugins.transport.Transport(lambda: self.session, self.ratelimit, max_retries=max_retries)
         if personal_access_token:
             self.api_headers = {"Authorization": "token %s" % personal_access_token}
         else:
             self.api_headers = {"Authorization": "bearer %s" % bearer_token}
 
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """Returns the long-lived HTTP session shared by all API calls, creating it on first use.
+           The session keeps a pool of keep-alive connections to api.github.com, so subsequent calls
+           (and subsequent background runs) skip the TCP/TLS handshake."""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.connection_limit,
+                limit_per_host=self.connection_limit,
+                ttl_dns_cache=self.dns_cache_ttl,
+                keepalive_timeout=KEEPALIVE_TIMEOUT,
+            )
+            tracer = aiohttp.TraceConfig()
+            tracer.on_request_start.append(self._trace_request)
+            tracer.on_request_end.append(self._trace_response)
+            tracer.on_connection_create_end.append(self._trace_connection_created)
+            tracer.on_connection_reuseconn.append(self._trace_connection_reused)
+            self._session = aiohttp.ClientSession(
+                headers=self.api_headers, connector=connector, trace_configs=[tracer]
+            )
+        return self._session
+
+    async def close(self):
+        """Closes the shared HTTP session and its connection pool"""
+        if self._session and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def _trace_request(self, session, context, params):
+        self.pool_stats["requests"] += 1
+
+    async def _trace_response(self, session, context, params):
+        self.ratelimit.update_from_headers(params.response.headers)
+
+    async def _trace_connection_created(self, session, context, params):
+        self.pool_stats["connections_created"] += 1
+
+    async def _trace_connection_reused(self, session, context, params):
+        self.pool_stats["connections_reused"] += 1
+
+    def pool_statistics(self) -> dict:
+        """Returns connection pool statistics, including how often a pooled connection was reused"""
+        stats = dict(self.pool_stats)
+        connections = stats["connections_created"] + stats["connections_reused"]
+        stats["reuse_ratio"] = stats["connections_reused"] / connections if connections else 0.0
+        return stats
+
+    async def api_get(self, url: str) -> dict:
+        """GETs a REST API URL and returns the JSON response"""
+        status, txt = await self.transport.request("GET", url)
+        return json.loads(txt)
+
+    async def graphql(self, query: str, variables: typing.Optional[dict] = None) -> dict:
+        """Runs a GraphQL query and returns the JSON response. GraphQL reports errors with a 200 status: rate
+           limited and timed out queries are retried by the transport, a response without data is raised as a
+           GitHubAPIError, and errors that came with (partial) data are logged."""
+        payload: typing.Dict[str, typing.Any] = {"query": query}
+        if variables:
+            payload["variables"] = variables
+        url = f"{self.api_url}/graphql"
+        status, txt = await self.transport.request("POST", url, resource="graphql", json=payload)
+        js = json.loads(txt)
+        if isinstance(js.get("data"), dict) and js["data"].get("rateLimit"):
+            self.ratelimit.update_from_graphql(js["data"]["rateLimit"])
+        errors = js.get("errors") or []
+        message = "; ".join(str(error.get("message", "")) for error in errors)
+        if not isinstance(js.get("data"), dict):
+            raise plugins.transport.GitHubAPIError("POST", url, status, message[:200] or "(no data in response)")
+        if errors:
+            print(f"GraphQL query returned partial data, {len(errors)} error(s): {message[:200]}")
+        return js
+
+    @staticmethod
+    async def run_bounded(
+        jobs: typing.List[typing.Awaitable], limit: int = 1
+    ) -> typing.List[typing.Optional[Exception]]:
+        """Runs a list of API calls with at most `limit` of them in flight at any time.
+           Returns the exception raised by each call (or None if it succeeded), in the same order as the jobs given."""
+        semaphore = asyncio.Semaphore(max(1, limit))
+
+        async def run_one(job):
+            async with semaphore:
+                try:
+                    await job
+                except Exception as e:
+                    return e
+            return None
+
+        return await asyncio.gather(*[run_one(job) for job in jobs])
+
     async def get_id(self):
         """Fetches the organization's GitHub ID.
            This must be called once before membership or repository additions/deletions, to ensure
            we can perform these calls using database IDs only."""
         if self.orgid is None:
-            async with aiohttp.ClientSession(headers=self.api_headers) as session:
-                url = f"https://api.github.com/orgs/{self.login}"
-                async with session.get(url) as rv:
-                    js = await rv.json()
-                    self.orgid = js["id"]
+            js = await self.api_get(f"{self.api_url}/orgs/{self.login}")
+            self.orgid = js["id"]
         return self.orgid
 
     async def api_delete(self, url: str):
-        if DEBUG:
-            print("[DEBUG] DELETE", url)
-        else:
-            async with aiohttp.ClientSession(headers=self.api_headers) as session:
-                async with session.delete(url) as rv:
-                    txt = await rv.text()
-                    assert rv.status == 204, f"Unexpected retun code for DELETE on {url}: {rv.status}"
-                    return txt
+        async with self.inflight:
+            status, txt = await self.transport.request("DELETE", url, expected=(204,))
+            return txt
 
     async def api_put(self, url: str, jsdata: typing.Optional[dict] = None):
-        if DEBUG:
-            print("[DEBUG] PUT", url)
-        else:
-            async with aiohttp.ClientSession(headers=self.api_headers) as session:
-                async with session.put(url, json=jsdata) as rv:
-                    txt = await rv.text()
-                    assert rv.status in [200, 204], f"Unexpected retun code for PUT on {url}: {rv.status}"
-                    return txt
+        async with self.inflight:
+            status, txt = await self.transport.request("PUT", url, expected=(200, 204), json=jsdata)
+            return txt
 
     async def api_post(self, url: str, jsdata: typing.Optional[dict] = None):
-        if DEBUG:
-            print("[DEBUG] POST", url)
-        else:
-            async with aiohttp.ClientSession(headers=self.api_headers) as session:
-                async with session.post(url, json=jsdata) as rv:
-                    txt = await rv.text()
-                    assert rv.status == 201, f"Unexpected retun code for POST on {url}: {rv.status}"
-                    return txt
+        async with self.inflight:
+            status, txt = await self.transport.request("POST", url, expected=(201,), json=jsdata)
+            return txt
 
     def get_team(self, team: str, private: bool) -> typing.Optional["GitHubTeam"]:
         """Locate a GitHub team and return it"""
@@ -95,195 +321,127 @@ class GitHubOrganisation:
                 return xteam
         return None
 
-    async def rate_limit_rest(self):
-        """Fetches the hourly REST API limit and how many uses have been expended this hour."""
-        async with aiohttp.ClientSession(headers=self.api_headers) as session:
-            url = "https://api.github.com/rate_limit"
-            async with session.get(url) as rv:
-                js = await rv.json()
-                return js["rate"]["limit"], js["rate"]["used"], js["rate"]["reset"]
-
-    async def rate_limit_graphql(self):
-        """Fetches the hourly GraphQL API limit and how many uses have been expended this hour."""
-        query = """
-        {
-            rateLimit
-            {
-                limit
-                cost
-                used
-                resetAt
-            }
-        }
-        """
-        async with aiohttp.ClientSession(headers=self.api_headers) as session:
-            async with session.post(GRAPHQL_URL, json={"query": query}) as rv:
-                js = await rv.json()
-                resets = dateutil.parser.parse(js["data"]["rateLimit"]["resetAt"]).timestamp()
-                return js["data"]["rateLimit"]["limit"], js["data"]["rateLimit"]["used"], resets
-
-    async def load_teams(self) -> typing.List["GitHubTeam"]:
-        """Loads all GitHub teams in this organization using GraphQL"""
-        query = """
-        {
-            organization(login: "%s") {
-                teams(first: 100, after:%s) {
-                    pageInfo {
-                        hasNextPage
-                        endCursor
-                    }
-                    edges {
-                        node {
-                            name
-                            slug
-                            databaseId
-                            members {
-                                totalCount
-                                edges {
-                                    node {
-                                        login
-                                    }
-                                }
-                            }
-                            repositories {
-                                totalCount
-                                edges {
-                                    node {
-                                        name
-                                    }
-                                }
-                            }
-                        }
-                    }
-                }
-            }
-        }
-        """
-
-        teams = []
-
-        async with aiohttp.ClientSession(headers=self.api_headers) as session:
-            next_page = True
-            after = "null"
-            while next_page:
-                async with session.post(
-                    GRAPHQL_URL, json={"query": query % (self.login, after)}
-                ) as rv:
-                    js = await rv.json()
-                    for edge in js["data"]["organization"]["teams"]["edges"]:
-                        team = GitHubTeam(self, edge)
-                        total_members = edge["node"]["members"]["totalCount"]
-                        total_repos = edge["node"]["repositories"]["totalCount"]
-                        slug = edge["node"]["slug"]
-                        if total_members > 100:
-                            print(
-                                f"{slug} has {total_members} members, need to fill specifically..."
-                            )
-                            await team.get_members()
-                            print("Filled with %u members!" % len(team.members))
-                        if total_repos > 100:
-                            print(
-                                f"{slug} has {total_repos} repos assigned, need to fill specifically..."
-                            )
-                            await team.get_repositories()
-                            print("Filled with %u repos!" % len(team.repos))
-                        teams.append(team)
-                    next_page = js["data"]["organization"]["teams"]["pageInfo"][
-                        "hasNextPage"
-                    ]
-                    after = (
-                        '"%s"'
-                        % js["data"]["organization"]["teams"]["pageInfo"]["endCursor"]
-                    )
-        self.teams = teams
-        return teams
-
-    async def load_repositories(self) -> typing.List[str]:
-        """Loads all GitHub repositories in this organization using GraphQL"""
-        query = """
-        {
-            organization(login: "%s") {
-                repositories(first: 100, after:%s) {
-                    pageInfo {
-                        hasNextPage
-                        endCursor
-                    }
-                    edges {
-                        node {
-                            name
-                            databaseId
-                        }
-                    }
-                }
-            }
-        }
-        """
-        repos = []
-        async with aiohttp.ClientSession(headers=self.api_headers) as session:
-            next_page = True
-            after = "null"
-            while next_page:
-                async with session.post(
-                    GRAPHQL_URL, json={"query": query % (self.login, after)}
-                ) as rv:
-                    js = await rv.json()
-                    for edge in js["data"]["organization"]["repositories"]["edges"]:
-                        repo = edge['node']['name']
-                        repos.append(repo)
-                    next_page = js["data"]["organization"]["repositories"]["pageInfo"][
-                        "hasNextPage"
-                    ]
-                    after = (
-                        '"%s"'
-                        % js["data"]["organization"]["repositories"]["pageInfo"]["endCursor"]
-                    )
-        self.repositories = repos
-        return repos
+    async def fill_teams(self, teams: typing.List["GitHubTeam"], batch_size: int = TEAM_FILL_BATCH):
+        """Fetches the remaining members and repositories of teams too large to fit in a single page.
+           The remaining pages of all oversized teams are fetched together, with up to `batch_size` team
+           connections aliased into each query, so the number of round trips follows the largest team."""
+        pending = []
+        for team in teams:
+            if team.total_members > len(team.members):
+                print(f"{team.slug} has {team.total_members} members, need to fill specifically...")
+                pending.append((team, "members", team.members_cursor))
+            if team.total_repos > len(team.repos):
+                print(f"{team.slug} has {team.total_repos} repos assigned, need to fill specifically...")
+                pending.append((team, "repositories", team.repos_cursor))
+        if not pending:
+            return
+        known = {id(team): (set(team.members), set(team.repos)) for team, connection, cursor in pending}
+        filled = [team for team in teams if id(team) in known]
+        while pending:
+            batch = pending[:batch_size]
+            pending = pending[batch_size:]
+            arguments = ", ".join(f"$slug{index}: String!, $cursor{index}: String" for index in range(len(batch)))
+            selections = "\n".join(
+                TEAM_FILL_CONNECTIONS[connection] % {"index": index}
+                for index, (team, connection, cursor) in enumerate(batch)
+            )
+            variables: typing.Dict[str, typing.Any] = {"login": self.login}
+            for index, (team, connection, cursor) in enumerate(batch):
+                variables[f"slug{index}"] = team.slug
+                variables[f"cursor{index}"] = cursor
+            js = await self.graphql(TEAM_FILL_QUERY % (arguments, selections), variables)
+            organization = js["data"].get("organization") or {}
+            for index, (team, connection, cursor) in enumerate(batch):
+                found = organization.get(f"team{index}")
+                if not found:  # Deleted while we were walking the teams
+                    print(f"{team.slug} is no longer on GitHub, not filling it any further")
+                    filled = [other for other in filled if other is not team]
+                    continue
+                data = found[connection]
+                members, repos = known[id(team)]
+                for edge in data["edges"]:
+                    if not edge:
+                        continue
+                    if connection == "members":
+                        login = sys.intern(edge["node"]["login"])
+                        if login not in members:
+                            members.add(login)
+                            team.members.append(login)
+                    else:
+                        reponame = sys.intern(edge["node"]["name"])
+                        if reponame not in repos:
+                            repos.add(reponame)
+                            team.repos.append(reponame)
+                if data["pageInfo"]["hasNextPage"]:
+                    pending.append((team, connection, data["pageInfo"]["endCursor"]))
+        for team in filled:
+            print(f"Filled {team.slug} with {len(team.members)} members and {len(team.repos)} repos!")
+
+    async def walk_snapshot(self, connections: typing.Iterable[str] = tuple(SNAPSHOT_CONNECTIONS)) -> "GitHubSnapshot":
+        """Walks the given snapshot connections (teams, repositories, members) in one combined GraphQL walk. Each
+           connection is aliased in the same query with its own cursor, and is dropped from the query once it has
+           been exhausted, so the number of round trips is that of the longest connection. Oversized teams are
+           not filled in yet."""
+        snapshot = GitHubSnapshot()
+        active = list(connections)
+        cursors: typing.Dict[str, typing.Optional[str]] = {name: None for name in active}
+        while active:
+            arguments = ", ".join(f"${name}_cursor: String" for name in active)
+            selections = "\n".join(SNAPSHOT_CONNECTIONS[name] for name in active)
+            query = SNAPSHOT_QUERY % (arguments, selections)
+            variables = {f"{name}_cursor": cursors[name] for name in active}
+            variables["login"] = self.login
+            js = await self.graphql(query, variables)
+            organization = js["data"].get("organization")
+            if organization is None:
+                raise plugins.transport.GitHubAPIError(
+                    "POST", f"{self.api_url}/graphql", 200, f"(organization {self.login} not in response)"
+                )
+            # Anything GitHub could not resolve comes back as null, next to the rest of the page
+            for edge in organization.get("teams", {}).get("edges", []):
+                if edge and edge.get("node"):
+                    snapshot.teams.append(GitHubTeam(self, edge))
+            for edge in organization.get("repositories", {}).get("edges", []):
+                if edge and edge.get("node"):
+                    snapshot.repositories.append(edge["node"]["name"])
+            for edge in organization.get("members", {}).get("edges", []):
+                if edge and edge.get("node"):
+                    snapshot.mfa[edge["node"]["login"]] = edge["hasTwoFactorEnabled"]
+            for name in list(active):
+                page_info = organization[name]["pageInfo"]
+                if page_info["hasNextPage"]:
+                    cursors[name] = page_info["endCursor"]
+                else:
+                    active.remove(name)
+        return snapshot
+
+    async def load_snapshot(self) -> "GitHubSnapshot":
+        """Loads all teams, repositories and member MFA statuses of this organization (see walk_snapshot)"""
+        snapshot = await self.walk_snapshot()
+        await self.fill_teams(snapshot.teams)
+        self.teams = snapshot.teams
+        self.repositories = snapshot.repositories
+        mfa_enabled = len([x for x in snapshot.mfa.values() if x is True])
+        mfa_disabled = len([x for x in snapshot.mfa.values() if x is False])
+        print("%u with 2FA, %u without!" % (mfa_enabled, mfa_disabled))
+        return snapshot
+
+    async def has_repository(self, name: str) -> bool:
+        """Checks whether a repository exists in the organization, for repositories created since the last
+           snapshot. Found repositories are added to self.repositories."""
+        try:
+            await self.api_get(f"{self.api_url}/repos/{self.login}/{name}")
+        except plugins.transport.GitHubAPIError as e:
+            if e.status == 404:
+                return False
+            raise
+        if name not in self.repositories:
+            self.repositories.append(name)
+        return True
 
     async def get_mfa_status(self) -> dict:
         """Get MFA status for all org members, return as a dict[str, bool] of people and whether 2fa is enabled"""
-        query = """
-        {
-            organization(login: "%s") {
-                membersWithRole(first: 100, after:%s) {
-                    pageInfo {
-                        hasNextPage
-                        endCursor
-                    }
-                    edges {
-                        hasTwoFactorEnabled
-                        node {
-                            login
-                        }
-                    }
-                }
-            }
-        }
-        """
-
-        mfa = {}
-
-        async with aiohttp.ClientSession(headers=self.api_headers) as session:
-            next_page = True
-            after = "null"
-            while next_page:
-                async with session.post(
-                    GRAPHQL_URL, json={"query": query % (self.login, after)}
-                ) as rv:
-                    js = await rv.json()
-                    for user in js["data"]["organization"]["membersWithRole"]["edges"]:
-                        login = user["node"]["login"]
-                        mfa_status = user["hasTwoFactorEnabled"]
-                        mfa[login] = mfa_status
-                    next_page = js["data"]["organization"]["membersWithRole"][
-                        "pageInfo"
-                    ]["hasNextPage"]
-                    after = (
-                        '"%s"'
-                        % js["data"]["organization"]["membersWithRole"]["pageInfo"][
-                            "endCursor"
-                        ]
-                    )
+        mfa = (await self.walk_snapshot(("members",))).mfa
         mfa_enabled = len([x for x in mfa.values() if x is True])
         mfa_disabled = len([x for x in mfa.values() if x is False])
         print("%u with 2FA, %u without!" % (mfa_enabled, mfa_disabled))
@@ -293,7 +451,7 @@ class GitHubOrganisation:
         """Adds a new GitHub team to the organization"""
         assert self.orgid, "Parent GitHubOrganization needs a call to .get_id() prior to membership updates!"
         assert project, "GitHub team needs a name to be added to the organization"
-        url = f"https://api.github.com/orgs/{self.login}/teams"
+        url = f"{self.api_url}/orgs/{self.login}/teams"
         data = {
             "name": f"{project} {role}",
         }
@@ -307,55 +465,46 @@ class GitHubOrganisation:
         else:
             raise AssertionError("Github did not respond with a JSON payload!!")
 
-    async def setup_teams(self, projects: typing.Dict[str, plugins.projects.Project]):
-        """Looks for and sets up missing teams on GitHub"""
-        for project in projects.values():
-
-            # Check if public team needs to be made
-            committer_team = f"{project.name} committers"
-            if project.public_repos and committer_team not in self.teams:
-                print(f"Team '{project.name} committers' was not found on GitHub, setting it up for the first time.")
-                teamid = await self.add_team(project.name, "committers")
-                nodedata = {
-                    "node": {
-                        "databaseId": teamid,
-                        "slug": committer_team.replace(" ", "-"),
-                        "name": committer_team,
-                        "members": {
-                            "edges": []
-                        },
-                        "repositories": {
-                            "edges": []
-                        },
-                    },
-                }
-                newteam = GitHubTeam(self, nodedata)
-                self.teams.append(newteam)
-
-            # Check if private (pmc) team needs to be made
-            private_team = f"{project.name} private"
-            if project.private_repos and private_team not in self.teams:
-                print(
-                    f"Team '{project.name} private' was not found on GitHub, setting it up for the first time.")
-                teamid = await self.add_team(project.name, "private")
-                nodedata = {
-                    "node": {
-                        "databaseId": teamid,
-                        "slug": private_team.replace(" ", "-"),
-                        "name": private_team,
-                        "members": {
-                            "edges": []
-                        },
-                        "repositories": {
-                            "edges": []
-                        },
-                    },
-                }
-                newteam = GitHubTeam(self, nodedata)
-                self.teams.append(newteam)
+    async def create_team(self, project: str, role: str = "committers") -> "GitHubTeam":
+        """Adds a new GitHub team to the organization and returns it"""
+        team_name = f"{project} {role}"
+        teamid = await self.add_team(project, role)
+        nodedata = {
+            "node": {
+                "databaseId": teamid,
+                "slug": team_name.replace(" ", "-"),
+                "name": team_name,
+                "members": {
+                    "edges": []
+                },
+                "repositories": {
+                    "edges": []
+                },
+            },
+        }
+        newteam = GitHubTeam(self, nodedata)
+        self.teams.append(newteam)
+        return newteam
+
+
+class GitHubSnapshot:
+    """A point-in-time view of a GitHub organization's teams, repositories and member MFA statuses"""
+
+    teams: typing.List["GitHubTeam"]
+    repositories: typing.List[str]
+    mfa: typing.Dict[str, bool]
+
+    def __init__(self):
+        self.teams = list()
+        self.repositories = list()
+        self.mfa = dict()
 
 
 class GitHubTeam:
+    __slots__ = (
+        "org", "id", "slug", "name", "project", "type", "members", "repos", "total_members", "total_repos",
+        "members_cursor", "repos_cursor", "errors",
+    )
     org: GitHubOrganisation
     id: int
     slug: str
@@ -364,6 +513,11 @@ class GitHubTeam:
     type: str
     members: list
     repos: list
+    total_members: int
+    total_repos: int
+    members_cursor: typing.Optional[str]
+    repos_cursor: typing.Optional[str]
+    errors: typing.List[typing.Tuple[str, Exception]]
 
     def __init__(self, org: GitHubOrganisation, nodedata):
         self.org = org
@@ -379,11 +533,17 @@ class GitHubTeam:
             self.type = "admin"
         self.members = []
         self.repos = []
+        self.errors = []
+        self.total_members = nodedata["node"]["members"].get("totalCount", 0)
+        self.total_repos = nodedata["node"]["repositories"].get("totalCount", 0)
+        self.members_cursor = nodedata["node"]["members"].get("pageInfo", {}).get("endCursor")
+        self.repos_cursor = nodedata["node"]["repositories"].get("pageInfo", {}).get("endCursor")
         for member in nodedata["node"]["members"]["edges"]:
-            self.members.append(member["node"]["login"])
+            if member:
+                self.members.append(sys.intern(member["node"]["login"]))
         for repo in nodedata["node"]["repositories"]["edges"]:
             if repo:
-                self.repos.append(repo["node"]["name"])
+                self.repos.append(sys.intern(repo["node"]["name"]))
 
     def __eq__(self, other):
         if isinstance(other, str):
@@ -395,127 +555,20 @@ class GitHubTeam:
     def __hash__(self):
         return self.name.lower()
 
-    async def get_members(self):
-        """Fetches all members of a team using GraphQL"""
-        query = """
-            {
-                organization (login: "%s") {
-                    team(slug: "%s") {
-                        members(first: 100, after:%s) {
-                            totalCount
-                            pageInfo {
-                                hasNextPage
-                                endCursor
-                            }
-                            edges {
-                                node {
-                                    login
-                                }
-                            }
-                        }
-                    }
-                }
-            }
-            """
-
-        async with aiohttp.ClientSession(headers=self.org.api_headers) as session:
-            next_page = True
-            after = "null"
-            while next_page:
-                async with session.post(
-                    GRAPHQL_URL,
-                    json={"query": query % (self.org.login, self.slug, after)},
-                ) as rv:
-                    js = await rv.json()
-                    for edge in js["data"]["organization"]["team"]["members"]["edges"]:
-                        login = edge["node"]["login"]
-                        if login not in self.members:
-                            self.members.append(login)
-                    next_page = js["data"]["organization"]["team"]["members"][
-                        "pageInfo"
-                    ]["hasNextPage"]
-                    after = (
-                        '"%s"'
-                        % js["data"]["organization"]["team"]["members"]["pageInfo"][
-                            "endCursor"
-                        ]
-                    )
-
-    async def get_repositories(self):
-        """Fetches all repositories belonging to a GitHub Team using GraphQL"""
-        query = """
-            {
-                organization (login: "%s") {
-                    team(slug: "%s") {
-                        repositories(first: 100, after:%s) {
-                            totalCount
-                            pageInfo {
-                                hasNextPage
-                                endCursor
-                            }
-                            edges {
-                                node {
-                                    name
-                                }
-                            }
-                        }
-                    }
-                }
-            }
-            """
-
-        async with aiohttp.ClientSession(headers=self.org.api_headers) as session:
-            next_page = True
-            after = "null"
-            while next_page:
-                async with session.post(
-                    GRAPHQL_URL,
-                    json={"query": query % (self.org.login, self.slug, after)},
-                ) as rv:
-                    js = await rv.json()
-                    for edge in js["data"]["organization"]["team"]["repositories"][
-                        "edges"
-                    ]:
-                        if edge:
-                            reponame = edge["node"]["name"]
-                            if reponame not in self.repos:
-                                self.repos.append(reponame)
-                    next_page = js["data"]["organization"]["team"]["repositories"][
-                        "pageInfo"
-                    ]["hasNextPage"]
-                    after = (
-                        '"%s"'
-                        % js["data"]["organization"]["team"]["repositories"][
-                            "pageInfo"
-                        ]["endCursor"]
-                    )
-
-    async def set_membership(
-        self, github_ids: typing.List[str], ignore_prefix: str = "asf-ci"
-    ) -> typing.Tuple[list, list]:
-        """Adjusts GitHub teams according to the list provided, removing people that are a member of the team but
-           not on the provided list, and adding those missing from the team
-           :param github_ids:
-           :param ignore_prefix:
-           :return: A tuple of github IDs added and removed"""
-        github_team = set([x for x in self.members if not x.startswith(ignore_prefix)])
-        asf_team = set([x for x in github_ids if not x.startswith(ignore_prefix)])
-        to_remove = github_team - asf_team
-        to_add = asf_team - github_team
-
-        # If we are okay, and we have people to add/remove, do so.
-        for gh_person in to_add:
-            await self.add_member(gh_person)
-        for gh_person in to_remove:
-            await self.remove_member(gh_person)
-        return list(to_add), list(to_remove)
+    @staticmethod
+    def diff_repositories(current: typing.Iterable[str], desired: typing.Iterable[str]) -> typing.Tuple[list, list]:
+        """Works out which repositories to add to and remove from a team with the given current repositories.
+           Repositories are never removed from teams automatically, so the removal list is always empty for now."""
+        repos_assigned = set(current)
+        repos_to_assign = set(desired)
+        return sorted(repos_to_assign - repos_assigned), sorted(repos_to_assign - repos_to_assign)
 
     async def add_member(self, github_id: str):
         """Adds a new person to this github team"""
         assert (
             self.org.orgid
         ), "Parent GitHubOrganization needs a call to .get_id() prior to membership updates!"
-        url = f"https://api.github.com/organizations/{self.org.orgid}/team/{self.id}/memberships/{github_id}"
+        url = f"{self.org.api_url}/organizations/{self.org.orgid}/team/{self.id}/memberships/{github_id}"
         await self.org.api_put(url)
 
     async def remove_member(self, github_id: str):
@@ -523,27 +576,15 @@ class GitHubTeam:
         assert (
             self.org.orgid
         ), "Parent GitHubOrganization needs a call to .get_id() prior to membership updates!"
-        url = f"https://api.github.com/organizations/{self.org.orgid}/team/{self.id}/memberships/{github_id}"
+        url = f"{self.org.api_url}/organizations/{self.org.orgid}/team/{self.id}/memberships/{github_id}"
         await self.org.api_delete(url)
 
-    async def set_repositories(self, repositories: typing.List[str]) -> typing.Tuple[list, list]:
-        """Assigns a list of repositories to a team. Returns a tuple of repos added and removed from the team"""
-        repos_assigned = set(self.repos)
-        repos_to_assign = set(repositories)
-        to_add = repos_to_assign - repos_assigned
-        to_remove = repos_to_assign - repos_to_assign
-        for repo in to_add:
-            await self.add_repository(repo)
-        for repo in to_remove:
-            await self.remove_repository(repo)
-        return list(to_add), list(to_remove)
-
     async def remove_repository(self, reponame: str):
         """Removes a single repository from the team"""
         assert (
             self.org.orgid
         ), "Parent GitHubOrganization needs a call to .get_id() prior to membership updates!"
-        url = f"https://api.github.com/organizations/{self.org.orgid}/team/{self.id}/repos/{self.org.login}/{reponame}"
+        url = f"{self.org.api_url}/organizations/{self.org.orgid}/team/{self.id}/repos/{self.org.login}/{reponame}"
         await self.org.api_delete(url)
 
     async def add_repository(self, reponame: str):
@@ -551,5 +592,5 @@ class GitHubTeam:
         assert (
             self.org.orgid
         ), "Parent GitHubOrganization needs a call to .get_id() prior to membership updates!"
-        url = f"https://api.github.com/organizations/{self.org.orgid}/team/{self.id}/repos/{self.org.login}/{reponame}"
+        url = f"{self.org.api_url}/organizations/{self.org.orgid}/team/{self.id}/repos/{self.org.login}/{reponame}"
         await self.org.api_put(url, {'permission': 'push'})
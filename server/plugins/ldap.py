@@ -11,13 +11,18 @@
      members: kp sk humbedooh
      owners: sk
 """
+import asyncio
 import bonsai
+import time
 import typing
 import re
+import sys
 import yaml
 import os
 
 UID_RE = re.compile(r"^(?:uid=)?([^,]+)")
+BULK_PAGE_SIZE = 500  # Number of group entries per page when fetching all project groups in bulk
+CONNECTION_ERRORS = (bonsai.ConnectionError, bonsai.TimeoutError)  # Errors that warrant a fresh connection
 
 
 class LDAPConfig:
@@ -27,6 +32,12 @@ class LDAPConfig:
     userbase: str
     ldapbase: str
     groupbase: str
+    bulk: bool
+    pool_size: int
+    sync_connect: bool
+    incremental: bool
+    full_sync_interval: int
+    poll_interval: int
 
     def __init__(self, subyaml: dict = {}):
         self.uri = str(subyaml.get("uri", ""))
@@ -35,19 +46,67 @@ class LDAPConfig:
         self.userbase = str(subyaml.get("userbase", ""))
         self.ldapbase = str(subyaml.get("ldapbase", ""))
         self.groupbase = str(subyaml.get("groupbase", ""))
+        self.bulk = bool(subyaml.get("bulk", True))
+        self.pool_size = int(subyaml.get("pool_size", 4))
+        # Hack around GnuTLS bug with async... - https://github.com/noirello/bonsai/issues/25
+        # Connecting synchronously blocks the event loop during the handshake, so only do so where needed.
+        self.sync_connect = bool(subyaml.get("sync_connect", True))
+        self.incremental = bool(subyaml.get("incremental", True))
+        self.full_sync_interval = int(subyaml.get("full_sync_interval", 3600))
+        self.poll_interval = int(subyaml.get("poll_interval", 30))
+        assert self.pool_size >= 1, "LDAP pool size must be at least 1!"
+
+
+class LDAPBackend(typing.Protocol):
+    """Where LDAPClient gets its connections from. Connections must provide the subset of bonsai.LDAPConnection that
+       LDAPClient uses: search(), paged_search() (returning an async iterator of entries), close() and closed."""
+
+    async def connect(self) -> bonsai.LDAPConnection:
+        ...
+
+
+class BonsaiBackend:
+    """Connects to a real LDAP server using bonsai"""
+
+    def __init__(self, config: LDAPConfig):
+        self.config = config
+        self.client = bonsai.LDAPClient(config.uri)
+        self.client.set_credentials("SIMPLE", config.binddn, config.bindpw)
+        self.client.set_cert_policy("allow")  # TODO: Load our cert(?)
+
+    async def connect(self) -> bonsai.LDAPConnection:
+        if self.config.sync_connect:
+            bonsai.set_connect_async(False)
+        try:
+            return await self.client.connect(is_async=True)
+        finally:
+            bonsai.set_connect_async(True)
 
 
 class LDAPClient:
+    """LDAP client with a pool of connections, so that lookups for many groups can run concurrently.
+       The pool can be kept open across background runs; broken connections are replaced on the fly."""
     config: LDAPConfig
-    client: typing.Optional[bonsai.LDAPClient]
-    connection: typing.Optional[bonsai.LDAPConnection]
+    backend: typing.Optional[LDAPBackend]
+    idle: typing.List[bonsai.LDAPConnection]
     ldap_override: dict
+    groups: typing.Dict[str, typing.Tuple[list, list]]
+    failed: typing.Set[str]
+    last_modified: typing.Optional[str]
+    last_full_sync: float
 
-    def __init__(self, config: LDAPConfig, ldap_override_yaml="projects.yaml"):
+    def __init__(
+        self, config: LDAPConfig, ldap_override_yaml="projects.yaml", backend: typing.Optional[LDAPBackend] = None
+    ):
         self.config = config
-        self.client = None
-        self.connnection = None
+        self.backend = backend
+        self.idle = []
+        self.slots: typing.Optional[asyncio.Semaphore] = None
         self.ldap_override = {}
+        self.groups = {}  # Last known (members, owners) of each project group, as kept up to date by sync()
+        self.failed = set()  # Groups whose last lookup failed, looked up again on the next sync
+        self.last_modified = None  # Newest modifyTimestamp seen in the project groups
+        self.last_full_sync = 0.0
         if ldap_override_yaml and os.path.exists(ldap_override_yaml):
             try:
                 self.ldap_override = yaml.safe_load(open(ldap_override_yaml))
@@ -55,16 +114,76 @@ class LDAPClient:
                 print(f"Could not load ldap override yaml, {ldap_override_yaml}: {err}")
 
     async def __aenter__(self):
-        """Initializes an LDAP connection and returns the connection is success, None otherwise"""
-        self.client = bonsai.LDAPClient(self.config.uri)
-        self.client.set_credentials("SIMPLE", self.config.binddn, self.config.bindpw)
-        self.client.set_cert_policy("allow")  # TODO: Load our cert(?)
-        # Hack around GnuTLS bug with async... - https://github.com/noirello/bonsai/issues/25
-        bonsai.set_connect_async(False)
-        self.connection = await self.client.connect(is_async=True)
-        bonsai.set_connect_async(True)
+        """Initializes the LDAP connection pool and opens the first connection"""
+        await self.connect()
         return self
 
+    async def connect(self):
+        """Initializes the LDAP connection pool, if not already done, and makes sure we can connect"""
+        if self.backend is None:
+            self.backend = BonsaiBackend(self.config)
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(self.config.pool_size)
+        if not self.idle:
+            self.idle.append(await self._open())
+
+    async def _open(self) -> bonsai.LDAPConnection:
+        """Opens a new connection for the pool"""
+        assert self.backend, "LDAP client not initialized"
+        return await self.backend.connect()
+
+    async def acquire(self) -> bonsai.LDAPConnection:
+        """Takes a connection from the pool, opening a new one if none are idle. Waits if the pool is exhausted."""
+        assert self.slots, "LDAP Not connected"
+        await self.slots.acquire()
+        try:
+            while self.idle:
+                connection = self.idle.pop()
+                if not connection.closed:
+                    return connection
+            return await self._open()
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def release(self, connection: bonsai.LDAPConnection, broken: bool = False):
+        """Returns a connection to the pool, or throws it away if it is broken"""
+        assert self.slots, "LDAP Not connected"
+        if broken or connection.closed:
+            try:
+                connection.close()
+            except Exception:
+                pass
+        else:
+            self.idle.append(connection)
+        self.slots.release()
+
+    async def search(self, base: str, scope: bonsai.LDAPSearchScope, attrs: typing.List[str]) -> list:
+        """Runs a search on a pooled connection, retrying once on a fresh connection if the connection failed"""
+        for attempt in (1, 2):
+            connection = await self.acquire()
+            try:
+                rv = await connection.search(base, scope, None, attrs)
+            except CONNECTION_ERRORS as e:
+                self.release(connection, broken=True)
+                if attempt == 2:
+                    raise
+                print(f"LDAP connection failed ({e}), reconnecting...")
+                continue
+            except BaseException:
+                self.release(connection)
+                raise
+            self.release(connection)
+            return rv
+        return []
+
+    async def get_members_many(self, groups: typing.Iterable[str]) -> typing.Dict[str, typing.Tuple[list, list]]:
+        """Fetches members/owners of many groups concurrently, as many at a time as the connection pool allows.
+        Returns a dict of group name -> (members, owners)."""
+        groups = list(groups)
+        results = await asyncio.gather(*[self.get_members(group) for group in groups])
+        return dict(zip(groups, results))
+
     async def get_members(self, group: str):
         """Async fetching of members/owners of a standard project group."""
         ldap_base = self.config.groupbase % group
@@ -98,37 +217,140 @@ class LDAPClient:
             return owners, members
         try:
             attrs = set([member_attr, owner_attr])
-            assert self.connection, "LDAP Not connected"
-            rv = await self.connection.search(
-                ldap_base, bonsai.LDAPSearchScope.SUBTREE, None, list(attrs)
-            )
+            rv = await self.search(ldap_base, bonsai.LDAPSearchScope.SUBTREE, list(attrs))
             if rv:
                 if not members and member_attr in rv[0]:
                     for member in rv[0][member_attr]:
                         m = UID_RE.match(member)
                         if m:
-                            members.append(m.group(1))
+                            members.append(sys.intern(m.group(1)))
                 if (not ldap_owner_base) and not owners and owner_attr in rv[0]:
                     for owner in rv[0][owner_attr]:
                         m = UID_RE.match(owner)
                         if m:
-                            owners.append(m.group(1))
+                            owners.append(sys.intern(m.group(1)))
             if ldap_owner_base:
-                rv = await self.connection.search(
-                    ldap_owner_base, bonsai.LDAPSearchScope.SUBTREE, None, [owner_attr]
-                )
+                rv = await self.search(ldap_owner_base, bonsai.LDAPSearchScope.SUBTREE, [owner_attr])
                 if rv:
                     if not owners and owner_attr in rv[0]:
                         for owner in rv[0][owner_attr]:
                             m = UID_RE.match(owner)
                             if m:
-                                owners.append(m.group(1))
+                                owners.append(sys.intern(m.group(1)))
+            self.failed.discard(group)
             return list(sorted(members)), list(sorted(owners))
 
         except Exception as e:
             print(f"LDAP Exception for group {group}: {e}")
+            self.failed.add(group)
             return [], []
 
+    async def search_groups(
+        self, wanted: typing.Set[str], search_filter: str = "(cn=*)"
+    ) -> typing.Optional[typing.Dict[str, typing.Tuple[list, list]]]:
+        """Runs a single paged search for the entries directly under the project group base that match the filter,
+        and returns the members/owners of the wanted groups that were found, skipping groups with overrides.
+        Also keeps track of the newest modifyTimestamp seen. Returns None if the groups cannot be searched in bulk."""
+        # cn=%s,ou=project,ou=groups,dc=apache,dc=org -> ou=project,ou=groups,dc=apache,dc=org
+        if not self.config.groupbase.startswith("cn=%s,"):
+            return None
+        parent_base = self.config.groupbase[len("cn=%s,"):]
+        overrides = self.ldap_override or {}
+        results: typing.Dict[str, typing.Tuple[list, list]] = {}
+        last_modified = self.last_modified
+        connection = await self.acquire()
+        broken = False
+        try:
+            entries = await connection.paged_search(
+                parent_base,
+                bonsai.LDAPSearchScope.ONELEVEL,
+                search_filter,
+                ["cn", "member", "owner", "modifyTimestamp"],
+                page_size=BULK_PAGE_SIZE,
+            )
+            async for entry in entries:
+                if "modifyTimestamp" in entry:
+                    modified = str(entry["modifyTimestamp"][0])
+                    if not last_modified or modified > last_modified:
+                        last_modified = modified
+                group = entry["cn"][0] if "cn" in entry else None
+                if group not in wanted or group in overrides:
+                    continue
+                members = [sys.intern(m.group(1)) for m in (UID_RE.match(x) for x in entry.get("member", [])) if m]
+                owners = [sys.intern(m.group(1)) for m in (UID_RE.match(x) for x in entry.get("owner", [])) if m]
+                results[group] = (sorted(members), sorted(owners))
+        except Exception as e:
+            print(f"LDAP Exception while searching project groups in bulk: {e}")
+            broken = isinstance(e, CONNECTION_ERRORS)
+            return None
+        finally:
+            self.release(connection, broken=broken)
+        self.last_modified = last_modified
+        self.failed.difference_update(results)
+        return results
+
+    async def get_all_members(self, groups: typing.Iterable[str]) -> typing.Dict[str, typing.Tuple[list, list]]:
+        """Fetches members/owners of many standard project groups at once, using a single paged search for all
+        entries directly under the project group base. Only groups with overrides in projects.yaml are looked up one
+        by one, unless the bulk search fails, in which case all groups are.
+        Returns a dict of group name -> (members, owners)."""
+        groups = list(groups)
+        overrides = self.ldap_override or {}
+        results = await self.search_groups(set(groups))
+        if results is None:
+            print("Could not fetch project groups from LDAP in bulk, falling back to one by one")
+            one_by_one = groups
+            results = {}
+        else:
+            print(f"Fetched {len(results)} project groups from LDAP in bulk")
+            one_by_one = [group for group in groups if group in overrides]
+        results.update(await self.get_members_many(one_by_one))
+        for group in groups:
+            if group not in results:
+                results[group] = ([], [])  # No such project group
+        return results
+
+    async def sync(self, groups: typing.Iterable[str]) -> typing.Set[str]:
+        """Brings the cache of project groups (self.groups) up to date and returns the names of the groups whose
+        members or owners changed since the last sync. After the first (full) sync, only the groups modified since
+        then are fetched, using a modifyTimestamp filter. A full sync is done again every full_sync_interval seconds,
+        to pick up deleted groups and changes to groups with overrides in projects.yaml, which are not under the
+        project group base and thus not tracked incrementally. A group that could not be looked up keeps its last
+        known members and owners, and is looked up again on the next sync."""
+        groups = list(groups)
+        wanted = set(groups)
+        previous = self.groups
+        retry = self.failed & wanted
+        full_sync = (
+            not self.config.incremental
+            or not self.last_modified
+            or time.time() - self.last_full_sync >= self.config.full_sync_interval
+        )
+        if full_sync:
+            if self.config.bulk:
+                current = await self.get_all_members(groups)
+            else:
+                current = await self.get_members_many(groups)
+            self.last_full_sync = time.time()
+        else:
+            current = {group: members for group, members in previous.items() if group in wanted}
+            modified = await self.search_groups(wanted, f"(&(cn=*)(modifyTimestamp>={self.last_modified}))")
+            if modified is None:  # Could not search incrementally, try again with a full sync next time
+                self.last_modified = None
+                modified = {}
+            current.update(modified)
+            new_groups = [group for group in groups if group not in current or group in retry]
+            current.update(await self.get_members_many(new_groups))
+        for group in self.failed & wanted:
+            if group in previous:
+                current[group] = previous[group]  # Rather the last good copy than a group that looks empty
+        self.groups = current
+        return set(group for group in groups if previous.get(group) != current.get(group))
+
+    async def close(self):
+        """Closes all idle connections in the pool"""
+        while self.idle:
+            self.idle.pop().close()
+
     async def __aexit__(self, exc_type, exc_val, exc_tb):
-        if self.connection:
-            self.connection.close()
+        await self.close()
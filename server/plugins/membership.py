@@ -0,0 +1,54 @@
+"""Membership matrix for Boxer.
+   Holds who should be on which GitHub team as a sparse project × person matrix: one row of GitHub logins per project
+   role (committers, PMC), next to the set of logins with MFA enabled. The desired members of a team are then a
+   single intersection of its row with the MFA set, and the members to add or remove two set differences against
+   the team's current members, all done in C, instead of an MFA lookup and a filter per person for every team.
+   Accounts with the ignore prefix (CI accounts) are only filtered out of the (usually tiny) differences."""
+import typing
+
+import plugins.projects
+
+IGNORE_PREFIX = "asf-ci"
+
+
+class MembershipMatrix:
+    """Project × person membership, as a set of GitHub logins per project role"""
+
+    rows: typing.Dict[typing.Tuple[str, str], typing.FrozenSet[str]]
+    enabled: typing.FrozenSet[str]
+
+    def __init__(
+        self,
+        projects: typing.Iterable[plugins.projects.Project],
+        mfa: typing.Optional[typing.Dict[str, bool]] = None,
+        ignore_prefix: str = IGNORE_PREFIX,
+    ):
+        projects = list(projects)
+        self.ignore_prefix = ignore_prefix
+        self.rows = {}
+        for project in projects:
+            self.rows[(project.name, "committers")] = frozenset(person.github_login for person in project.committers)
+            self.rows[(project.name, "private")] = frozenset(person.github_login for person in project.pmc)
+        if mfa:
+            self.enabled = frozenset(login for login, has_mfa in mfa.items() if has_mfa)
+        else:  # Without MFA data from GitHub, go by what we last knew about each person
+            self.enabled = frozenset(
+                person.github_login
+                for project in projects
+                for person in project.committers + project.pmc
+                if person.github_mfa
+            )
+        self.enabled -= {None, ""}
+
+    def desired(self, project: str, role: str) -> typing.FrozenSet[str]:
+        """Returns the logins that should be on the team for a project role: everyone in the role with MFA enabled"""
+        return self.rows.get((project, role), frozenset()) & self.enabled
+
+    def diff(self, project: str, role: str, current: typing.Iterable[str]) -> typing.Tuple[list, list]:
+        """Works out which logins to add to and remove from the team for a project role, given its current members"""
+        desired = self.desired(project, role)
+        current = set(current)
+        return (
+            sorted(login for login in desired - current if not login.startswith(self.ignore_prefix)),
+            sorted(login for login in current - desired if not login.startswith(self.ignore_prefix)),
+        )
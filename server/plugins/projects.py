@@ -1,12 +1,24 @@
 import plugins.ldap
 import plugins.repositories
 import asfpy.sqlite
+import asyncio
 import typing
 import datetime
+import sys
+
+# Batched upsert of ids rows, one prepared statement for the whole batch
+IDS_UPSERT = (
+    "INSERT INTO ids (asfid, githubid, mfa, updated) VALUES (?, ?, ?, ?) ON CONFLICT(asfid) DO UPDATE SET "
+    "githubid = excluded.githubid, mfa = excluded.mfa, updated = excluded.updated"
+)
 
 
 class Committer:
-    def save(self, dbhandle: asfpy.sqlite.DB):
+    # There are thousands of these, rebuilt on every run, so keep them small. IDs are interned, so the many copies
+    # of the same ID that come out of LDAP, the link table and GitHub all end up as one string.
+    __slots__ = ("asf_id", "projects", "github_login", "github_mfa", "github_id", "real_name")
+
+    def save(self, dbhandle: typing.Union[asfpy.sqlite.DB, "LinkTable"]):
         document = {
             "asfid": self.asf_id,
             "githubid": self.github_login,
@@ -16,17 +28,18 @@ class Committer:
         dbhandle.upsert("ids", document, asfid=self.asf_id)
 
     def __init__(
-        self, asf_id: str, linkdb: asfpy.sqlite.DB,
+        self, asf_id: str, linkdb: typing.Union[asfpy.sqlite.DB, "LinkTable", None],
     ):
-        self.asf_id = asf_id
-        self.repositories: typing.Set[plugins.repositories.Repository] = set()
+        self.asf_id = sys.intern(asf_id)
         self.projects: typing.Set[Project] = set()
-        if linkdb:
+        if isinstance(linkdb, LinkTable):
+            row = linkdb.get(asf_id)
+        elif linkdb:
             row = linkdb.fetchone("ids", limit=1, asfid=asf_id)
         else:
             row = None
         if row:
-            self.github_login = row["githubid"]
+            self.github_login = sys.intern(row["githubid"]) if row["githubid"] else row["githubid"]
             self.github_mfa = bool(row["mfa"])
             self.real_name = ""
         else:
@@ -34,6 +47,19 @@ class Committer:
             self.github_mfa = False
             self.real_name = ""
 
+    @property
+    def repositories(self) -> typing.Set[plugins.repositories.Repository]:
+        """The repositories this committer has access to: the public repositories of the projects they are a
+        committer on, and the private repositories of the projects they are on the PMC of. Worked out from the
+        projects when asked for, rather than kept in a set per person, as that would mean a million or so links."""
+        repositories: typing.Set[plugins.repositories.Repository] = set()
+        for project in self.projects:
+            if project.public_repos and self in project.committers:
+                repositories.update(project.public_repos)
+            if project.private_repos and self in project.pmc:
+                repositories.update(project.private_repos)
+        return repositories
+
     def __repr__(self):
         return self.asf_id
 
@@ -48,7 +74,173 @@ class Committer:
         return hash((self.asf_id,))
 
 
+class LinkTable:
+    """In-memory copy of the ids link table (asfid -> githubid, mfa), read from the database in a single query
+    instead of one query per committer. It can be passed to Committer.save in place of the database handle.
+
+    Writes to the ids table are write-behind: they show in the in-memory copy right away, but are queued, coalesced
+    per ASF ID, and written to the database in one transaction per batch, once flush_batch rows are queued or
+    flush_interval seconds after the first one was, whichever comes first, and on flush(). With a flush_interval of
+    0, or outside of an event loop, every write goes straight to the database.
+
+    Given a store (plugins.database.Database), batches are written, and refresh() reads the table, on the store's
+    database threads instead of on the event loop."""
+
+    def __init__(self, db: asfpy.sqlite.DB, flush_interval: float = 0, flush_batch: int = 500, store=None):
+        self.db = db
+        self.store = store
+        self.rows: typing.Dict[str, dict] = {}
+        self.loaded = False
+        self.changed: typing.Set[str] = set()  # ASF IDs whose link changed since the last pop_changed()
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self.pending: typing.Dict[str, dict] = {}  # Rows not written to the database yet, by ASF ID
+        self.writing: typing.Dict[asyncio.Task, typing.Dict[str, dict]] = {}  # Batches being written by the store
+        self.timer: typing.Optional[asyncio.TimerHandle] = None
+        self.updates = 0
+        self.written = 0
+        self.flushes = 0
+
+    def load(self):
+        """(Re)reads the whole ids table, picking up any changes made to the database behind our back"""
+        self.apply(self.db.fetch("ids", limit=None))
+
+    async def refresh(self):
+        """Like load(), but reads the table off the event loop, if there is a store to do that"""
+        if self.store is None:
+            self.load()
+        else:
+            self.apply(await self.store.fetch_links())
+
+    async def ready(self):
+        """Reads the table if that hasn't been done yet, so get() won't have to do it on the event loop"""
+        if not self.loaded:
+            await self.refresh()
+
+    def apply(self, rows: typing.Iterable[dict]):
+        rows = {row["asfid"]: row for row in rows}
+        # Our own writes that haven't made it to the database yet are newer than what it has
+        for asf_id in self.unsaved():
+            if asf_id in self.rows:
+                rows[asf_id] = self.rows[asf_id]
+        if self.loaded:
+            self.changed.update(rows.keys() ^ self.rows.keys())
+            for asf_id, row in rows.items():
+                old = self.rows.get(asf_id)
+                if old and (old["githubid"], bool(old["mfa"])) != (row["githubid"], bool(row["mfa"])):
+                    self.changed.add(asf_id)
+        self.rows = rows
+        self.loaded = True
+
+    def unsaved(self) -> typing.Set[str]:
+        """Returns the ASF IDs with writes that are queued or being written"""
+        unsaved = set(self.pending)
+        for batch in self.writing.values():
+            unsaved.update(batch)
+        return unsaved
+
+    def pop_changed(self) -> typing.Set[str]:
+        """Returns the ASF IDs whose link was changed, by us or in the database, since the last call"""
+        changed, self.changed = self.changed, set()
+        return changed
+
+    def get(self, asf_id: str) -> typing.Optional[dict]:
+        if not self.loaded:
+            self.load()
+        return self.rows.get(asf_id)
+
+    def upsert(self, table: str, document: dict, **target):
+        if table != "ids":
+            self.db.upsert(table, document, **target)
+            return
+        self.rows[document["asfid"]] = dict(document)
+        self.changed.add(document["asfid"])
+        self.pending[document["asfid"]] = dict(document)
+        self.updates += 1
+        if len(self.pending) >= self.flush_batch or self.flush_interval <= 0:
+            self.flush()
+        elif self.timer is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:  # Nothing to flush it later, so write it now
+                self.flush()
+                return
+            self.timer = loop.call_later(self.flush_interval, self.flush)
+
+    def flush(self):
+        """Writes the queued rows to the database, in a single transaction. If that fails, they stay queued."""
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, {}
+        if self.store is not None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                loop = None
+            if loop is not None:
+                task = loop.create_task(self.write_behind(pending))
+                self.writing[task] = pending
+                task.add_done_callback(lambda done: self.writing.pop(done, None))
+                return
+        try:
+            if getattr(self.db, "upserts_supported", False):
+                cursor = self.db.connector.cursor()
+                cursor.execute("BEGIN")
+                try:
+                    cursor.executemany(IDS_UPSERT, [link_values(row) for row in pending.values()])
+                    cursor.execute("COMMIT")
+                except Exception:
+                    cursor.execute("ROLLBACK")
+                    raise
+            else:  # Older SQLite without upserts, one at a time
+                for asf_id, row in pending.items():
+                    self.db.upsert("ids", row, asfid=asf_id)
+        except Exception as e:  # Whatever went wrong, the batch is not lost
+            self.requeue(pending, e)
+            return
+        self.written += len(pending)
+        self.flushes += 1
+
+    async def write_behind(self, pending: typing.Dict[str, dict]):
+        try:
+            await self.store.upsert_links([link_values(row) for row in pending.values()])
+        except Exception as e:  # Whatever went wrong, the batch is not lost
+            self.requeue(pending, e)
+            return
+        self.written += len(pending)
+        self.flushes += 1
+
+    def requeue(self, pending: typing.Dict[str, dict], e: Exception):
+        print("Could not write %u GitHub links to the database, will try again: %s" % (len(pending), e))
+        for asf_id, row in pending.items():
+            self.pending.setdefault(asf_id, row)  # Anything queued since is newer
+        if self.flush_interval > 0 and self.timer is None:
+            try:
+                self.timer = asyncio.get_running_loop().call_later(self.flush_interval, self.flush)
+            except RuntimeError:
+                pass
+
+    async def sync(self):
+        """Writes everything queued, and waits for all of it to be written"""
+        self.flush()
+        if self.writing:
+            await asyncio.gather(*self.writing)
+
+    def statistics(self) -> dict:
+        return {"updates": self.updates, "written": self.written, "flushes": self.flushes, "pending": len(self.pending)}
+
+
+def link_values(row: dict) -> tuple:
+    """Returns the values of an ids row in the order IDS_UPSERT takes them"""
+    return row["asfid"], row["githubid"], row["mfa"], row["updated"]
+
+
 class Project:
+    __slots__ = ("name", "committers", "pmc", "public_repos", "private_repos")
+
     def __init__(self, org: "Organization", name: str, committers: list, pmc: list):
         self.name: str = name
         self.committers: typing.List[Committer] = []
@@ -71,12 +263,13 @@ class Project:
         """Adds a repository to a project and assigns the repo to the commmitter/PMC group as applicable"""
         if private:
             self.private_repos.append(repo)
-            for account in self.pmc:
-                account.repositories.add(repo)
         else:
             self.public_repos.append(repo)
-            for account in self.committers:
-                account.repositories.add(repo)
+
+    def remove_repository(self, repo: plugins.repositories.Repository):
+        """Removes a repository (by path) from a project, as when it is no longer on gitbox"""
+        self.public_repos = [x for x in self.public_repos if x.filepath != repo.filepath]
+        self.private_repos = [x for x in self.private_repos if x.filepath != repo.filepath]
 
     def public_github_team(self, mfa = None):
         """Returns the GitHub IDs of everyone that should be on the GitHub team for this project"""
@@ -103,10 +296,16 @@ class Project:
 
 class Organization:
 
-    def __init__(self, linkdb: asfpy.sqlite.DB = None):
-        self.committers: typing.List[Committer] = list()
+    def __init__(self, linkdb: typing.Union[asfpy.sqlite.DB, LinkTable, None] = None):
+        self.accounts: typing.Dict[str, Committer] = dict()  # asf_id -> Committer, in the order they were added
+        self.github_logins: typing.Dict[str, Committer] = dict()  # github_login -> Committer
         self.projects: typing.Dict[str, Project] = dict()
-        self.linkdb: typing.Optional[asfpy.sqlite.DB] = linkdb
+        self.linkdb: typing.Union[asfpy.sqlite.DB, LinkTable, None] = linkdb
+
+    @property
+    def committers(self) -> typing.ValuesView[Committer]:
+        """All committers in the organization, in the order they were added"""
+        return self.accounts.values()
 
     def add_project(self, name: str, committers: typing.List[str], pmc: typing.List[str]) -> typing.Optional[Project]:
         if name and name not in self.projects:
@@ -116,32 +315,153 @@ class Organization:
             return project
         return None
 
+    def update_project(self, name: str, committers: typing.List[str], pmc: typing.List[str]) -> typing.Optional[Project]:
+        """Replaces the committers and PMC of an existing project, as when its LDAP group has changed,
+        and with it, access to its repositories"""
+        project = self.projects.get(name)
+        if not project:
+            return None
+        for account in set(project.committers + project.pmc):
+            account.projects.discard(project)
+        updated = Project(org=self, name=name, committers=committers, pmc=pmc)
+        project.committers = updated.committers
+        project.pmc = updated.pmc
+        for account in project.committers + project.pmc:
+            account.projects.discard(updated)
+            account.projects.add(project)
+        return project
+
+    def remove_project(self, name: str) -> typing.Optional[Project]:
+        """Removes a project from the organization, as when it no longer has any repositories.
+        Its committers stay in the organization, see remove_committer."""
+        project = self.projects.pop(name, None)
+        if project:
+            for account in set(project.committers + project.pmc):
+                account.projects.discard(project)
+        return project
+
     def add_committer(self, asf_id: str):
         """Adds a new committer to the organization.
         If already found in previous projects, returns the old committer object"""
-        if asf_id not in self.committers:
+        committer = self.accounts.get(asf_id)
+        if committer is None:
             committer = Committer(asf_id, self.linkdb)
-            self.committers.append(committer)
+            self.accounts[asf_id] = committer
+            if committer.github_login:
+                self.github_logins[committer.github_login] = committer
+        return committer
+
+    def remove_committer(self, asf_id: str) -> typing.Optional[Committer]:
+        """Removes a committer from the organization, as when they are no longer on any project"""
+        committer = self.accounts.pop(asf_id, None)
+        if committer and committer.github_login and self.github_logins.get(committer.github_login) is committer:
+            del self.github_logins[committer.github_login]
+        return committer
+
+    def get_committer(self, asf_id: str) -> typing.Optional[Committer]:
+        """Returns the committer with the given ASF ID, if they are in the organization"""
+        return self.accounts.get(asf_id)
+
+    def get_committer_by_github(self, github_login: str) -> typing.Optional[Committer]:
+        """Returns the committer linked to the given GitHub login, if any"""
+        committer = self.github_logins.get(github_login)
+        if committer and committer.github_login == github_login:  # Not relinked behind our back
             return committer
-        else:
-            for committer in self.committers:
-                if committer.asf_id == asf_id:
-                    return committer
+        return None
+
+    def link_github(self, committer: Committer, github_login: typing.Optional[str]):
+        """Sets (or clears) the GitHub login of a committer, keeping the GitHub login index up to date"""
+        if committer.github_login and self.github_logins.get(committer.github_login) is committer:
+            del self.github_logins[committer.github_login]
+        if github_login:
+            github_login = sys.intern(github_login)
+        committer.github_login = github_login
+        if github_login:
+            self.github_logins[github_login] = committer
+
+
+class ChangeSet:
+    """What update_data changed in the organization since the previous run. Later stages can use this to skip the
+    projects (and with them, the GitHub teams) and the people that were not touched."""
+
+    def __init__(self, full: bool = False):
+        self.full = full  # The organization was compiled from scratch, so assume everything changed
+        self.projects: typing.Set[str] = set()  # Added, or their members, repositories or members' MFA/links changed
+        self.removed_projects: typing.Set[str] = set()  # No longer have any repositories on gitbox
+        self.people: typing.Set[str] = set()  # ASF IDs of people who joined or left a project, or were relinked
+        self.removed_people: typing.Set[str] = set()  # ASF IDs of people no longer on any project
+        self.repositories_added = 0
+        self.repositories_removed = 0
+
+    def __bool__(self):
+        return self.full or bool(self.projects or self.removed_projects or self.people)
+
+    def __repr__(self):
+        if self.full:
+            return "ChangeSet<full>"
+        return (
+            f"ChangeSet<{len(self.projects)} projects changed, {len(self.removed_projects)} removed, "
+            f"{len(self.people)} people changed, {len(self.removed_people)} removed, "
+            f"{self.repositories_added} repositories added, {self.repositories_removed} removed>"
+        )
+
+    def touches(self, project: str) -> bool:
+        """Returns whether a project may have changed, and its GitHub teams thus need looking at"""
+        return self.full or project in self.projects or project in self.removed_projects
+
+    def touch_person(self, person: Committer):
+        """Records a change to a person, and with it, to all the projects they are on"""
+        self.people.add(person.asf_id)
+        self.projects.update(project.name for project in person.projects)
+
+
+def diff_mfa(previous: typing.Dict[str, bool], current: typing.Dict[str, bool]) -> typing.Dict[str, bool]:
+    """Returns the MFA statuses that changed between two GitHub snapshots. Logins that are no longer in the
+    organization are returned as not having MFA."""
+    changed = {login: has_mfa for login, has_mfa in current.items() if previous.get(login) != has_mfa}
+    changed.update((login, False) for login in previous.keys() - current.keys())
+    return changed
+
+
+def update_mfa(
+    person: Committer,
+    mfa: typing.Dict[str, bool],
+    linkdb: typing.Union[asfpy.sqlite.DB, LinkTable, None] = None,
+) -> bool:
+    """Sets the MFA status of a committer from the MFA statuses of the GitHub org members, saving it to the link
+    table if it changed. People not found on GitHub are flagged as not having MFA. Returns whether it changed."""
+    if person.github_login and person.github_login in mfa:
+        if person.github_mfa is not mfa[person.github_login]:
+            person.github_mfa = mfa[person.github_login]
+            if linkdb:
+                person.save(linkdb)  # Update sqlite db if changed
+            return True
+        return False
+    changed = bool(person.github_mfa)
+    person.github_mfa = False  # Flag as no MFA if person was not found
+    return changed
 
 
 async def compile_data(
     ldap: plugins.ldap.LDAPConfig,
     repositories: typing.List[plugins.repositories.Repository],
-    linkdb: typing.Optional[asfpy.sqlite.DB]
+    linkdb: typing.Union[asfpy.sqlite.DB, LinkTable, None],
+    client: typing.Optional[plugins.ldap.LDAPClient] = None,
 ) -> Organization:
-    """Compiles a comprehensive list of projects and people associated with them"""
+    """Compiles a comprehensive list of projects and people associated with them.
+    If an LDAP client is given, its connection pool is used and left open for the next run.
+    See update_data for bringing an organization compiled earlier up to date instead."""
     org = Organization(linkdb=linkdb)
     discovered = 0
-    async with plugins.ldap.LDAPClient(ldap) as lc:
+    lc = client or plugins.ldap.LDAPClient(ldap)
+    try:
+        await lc.connect()
+        await lc.sync(dict.fromkeys(repo.project for repo in repositories))
+        groups = lc.groups
         for repo in repositories:
             project = repo.project
             if project not in org.projects:
-                committers, pmc = await lc.get_members(project)
+                committers, pmc = groups[project]
                 if committers and pmc:
                     discovered += 1
                     # print(f"Discovered project: {project} - {len(committers)} committers, {len(pmc)} in pmc")
@@ -150,5 +470,133 @@ async def compile_data(
                 org.add_project(name=project, committers=committers, pmc=pmc)
             xproject = org.projects[project]
             xproject.add_repository(repo, repo.private)
+    finally:
+        if client is None:
+            await lc.close()
 
     return org
+
+
+async def update_data(
+    org: Organization,
+    ldap: plugins.ldap.LDAPConfig,
+    repositories: typing.List[plugins.repositories.Repository],
+    client: typing.Optional[plugins.ldap.LDAPClient] = None,
+    mfa: typing.Optional[typing.Dict[str, bool]] = None,
+    previous_mfa: typing.Optional[typing.Dict[str, bool]] = None,
+    relinked: typing.Iterable[str] = (),
+    changed_groups: typing.Iterable[str] = (),
+) -> ChangeSet:
+    """Incremental counterpart of compile_data: brings an organization compiled earlier up to date in place, and
+    returns what changed. Only the projects that gained or lost repositories or whose LDAP group changed are
+    touched, and only the people who joined or left one of those, whose GitHub link changed (relinked, by ASF ID)
+    or whose MFA status changed between previous_mfa and mfa are looked at again. If mfa is given, the MFA status
+    of those people is updated and saved to the link table, the way a full run does it for everyone (see sync_mfa).
+    Groups an earlier LDAP sync already found to have changed can be passed as changed_groups."""
+    changes = ChangeSet()
+    lc = client or plugins.ldap.LDAPClient(ldap)
+    try:
+        await lc.connect()
+        changed_groups = set(changed_groups) | await lc.sync(dict.fromkeys(repo.project for repo in repositories))
+    finally:
+        if client is None:
+            await lc.close()
+
+    # Repositories are matched by path: the ones no longer on gitbox are taken off their project, new ones added
+    current = {repo.filepath: repo for repo in repositories}
+    known = {}
+    for project in org.projects.values():
+        for repo in project.public_repos + project.private_repos:
+            known[repo.filepath] = repo
+    for filepath, repo in known.items():
+        if filepath not in current:
+            org.projects[repo.project].remove_repository(repo)
+            changes.projects.add(repo.project)
+            changes.repositories_removed += 1
+    added_projects = set()
+    for filepath, repo in current.items():
+        if filepath in known:
+            continue
+        project = org.projects.get(repo.project)
+        if project is None:
+            committers, pmc = lc.groups[repo.project]
+            project = org.add_project(name=repo.project, committers=committers, pmc=pmc)
+            added_projects.add(project.name)
+            changes.people.update(person.asf_id for person in project.committers + project.pmc)
+        project.add_repository(repo, repo.private)
+        changes.projects.add(project.name)
+        changes.repositories_added += 1
+
+    # Projects whose LDAP group changed get their new committers and PMC. Those who joined or left either changed.
+    for name in changed_groups:
+        project = org.projects.get(name)
+        if project is None or name in added_projects:
+            continue
+        committers, pmc = lc.groups[name]
+        old_committers = set(person.asf_id for person in project.committers)
+        old_pmc = set(person.asf_id for person in project.pmc)
+        org.update_project(name, committers, pmc)
+        new_committers = set(person.asf_id for person in project.committers)
+        new_pmc = set(person.asf_id for person in project.pmc)
+        if old_committers != new_committers or old_pmc != new_pmc:
+            changes.projects.add(name)
+            changes.people.update(old_committers ^ new_committers, old_pmc ^ new_pmc)
+
+    # Projects left without repositories are dropped, as compile_data would not have found them
+    for name, project in list(org.projects.items()):
+        if not project.public_repos and not project.private_repos:
+            changes.people.update(person.asf_id for person in project.committers + project.pmc)
+            org.remove_project(name)
+            changes.projects.discard(name)
+            changes.removed_projects.add(name)
+
+    # Likewise for people no longer on any project
+    for asf_id in list(changes.people):
+        person = org.get_committer(asf_id)
+        if person is not None and not person.projects:
+            org.remove_committer(asf_id)
+            changes.people.discard(asf_id)
+            changes.removed_people.add(asf_id)
+
+    # People who linked, unlinked or relinked their GitHub account since the last run
+    for asf_id in relinked:
+        person = org.get_committer(asf_id)
+        if person is None:
+            continue
+        if isinstance(org.linkdb, LinkTable):
+            row = org.linkdb.get(asf_id)
+        elif org.linkdb:
+            row = org.linkdb.fetchone("ids", limit=1, asfid=asf_id)
+        else:
+            row = None
+        github_login = row["githubid"] if row else None
+        if (github_login or None) == (person.github_login or None):
+            continue  # Only the MFA status was saved, sync_mfa deals with that
+        org.link_github(person, github_login)
+        person.github_mfa = bool(row["mfa"]) if row else False
+        changes.touch_person(person)
+
+    if mfa is not None:
+        sync_mfa(org, changes, mfa, previous_mfa)
+    return changes
+
+
+def sync_mfa(
+    org: Organization,
+    changes: ChangeSet,
+    mfa: typing.Dict[str, bool],
+    previous_mfa: typing.Optional[typing.Dict[str, bool]] = None,
+):
+    """Updates the MFA status of the people whose MFA status changed on GitHub between previous_mfa and mfa, and of
+    everyone in the change set, saving it to the link table. People whose status changed are added to the change
+    set."""
+    to_check = set(changes.people)
+    for login in diff_mfa(previous_mfa or {}, mfa):
+        person = org.get_committer_by_github(login)
+        if person is not None:
+            changes.touch_person(person)  # Their teams change with their MFA status, whatever we knew of it before
+            to_check.add(person.asf_id)
+    for asf_id in to_check:
+        person = org.get_committer(asf_id)
+        if person is not None and update_mfa(person, mfa, org.linkdb):
+            changes.touch_person(person)
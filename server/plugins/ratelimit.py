@@ -0,0 +1,169 @@
+"""GitHub API rate limit accounting for Boxer.
+   Tracks the hourly budget of each API resource (core REST, graphql) from the X-RateLimit-* headers and GraphQL
+   rateLimit fields that GitHub sends back with every response, and admits new requests through a token bucket per
+   resource. Calls only get paced when the budget is at risk, so the remaining budget is spread out until the next
+   reset instead of hitting the wall mid-run, without slowing down runs that have plenty of budget left."""
+import asyncio
+import time
+import typing
+
+import dateutil.parser
+
+DEFAULT_RESERVE = 25  # Always leave this many calls on the table, in case we need to do something by hand
+DEFAULT_BURST = 100  # Max number of calls that can be made back to back once pacing kicks in
+PROJECTION_WINDOW = 60  # Seconds of spending to go by before projecting when the budget runs out
+
+
+class RateLimitBucket:
+    """Token bucket for a single GitHub API resource"""
+
+    resource: str
+    limit: typing.Optional[int]
+    remaining: typing.Optional[int]
+    reset: float
+    spent: int
+    last_cost: int
+
+    def __init__(self, resource: str, reserve: int = DEFAULT_RESERVE, burst: int = DEFAULT_BURST):
+        self.resource = resource
+        self.reserve = reserve
+        self.burst = burst
+        self.limit = None
+        self.remaining = None
+        self.reset = 0.0
+        self.spent = 0
+        self.last_cost = 1
+        self.tokens = float(burst)
+        self.last_refill = time.time()
+        self.window_start: typing.Optional[typing.Tuple[float, int]] = None
+
+    def update(self, limit: int, remaining: int, reset: float):
+        """Updates the bucket with the budget as last reported by GitHub"""
+        if reset != self.reset or self.window_start is None:
+            self.window_start = (time.time(), remaining)
+        self.limit = limit
+        self.remaining = remaining
+        self.reset = reset
+
+    def budget(self) -> typing.Optional[int]:
+        """Returns how many calls can still be made before the reset, or None if GitHub has not told us yet"""
+        if self.remaining is None:
+            return None
+        if time.time() >= self.reset:
+            return self.limit - self.reserve
+        return max(self.remaining - self.reserve, 0)
+
+    def pacing(self, now: float) -> bool:
+        """Returns whether calls have to be paced to make the budget last till the reset: when no more than a burst
+        is left, or when spending at the rate seen so far this window would use it up before the reset"""
+        if self.remaining is None or now >= self.reset:
+            return False
+        if self.remaining - self.reserve <= self.burst:
+            return True
+        started = self.window_start[0] if self.window_start else now
+        return now - started >= PROJECTION_WINDOW and self.projected_exhaustion() is not None
+
+    def refill_rate(self, now: float) -> float:
+        """Returns how many calls per second we can afford to spend until the budget resets"""
+        if self.remaining is None:
+            return float(self.burst)  # No data yet, don't pace
+        return max(self.remaining - self.reserve, 0) / max(self.reset - now, 1)
+
+    async def acquire(self, cost: int = 1):
+        """Waits until the bucket admits a call of the given cost"""
+        while True:
+            now = time.time()
+            if self.remaining is not None and self.remaining - self.reserve < cost:
+                if now < self.reset:
+                    how_long_to_wait = self.reset - now + 1
+                    print(
+                        "GitHub %s rate limit reached, waiting till %u (%u seconds)"
+                        % (self.resource, self.reset, how_long_to_wait)
+                    )
+                    await asyncio.sleep(how_long_to_wait)
+                    continue
+                # Reset time has passed, assume we have a fresh budget till GitHub tells us otherwise
+                self.remaining = self.limit
+            rate = self.refill_rate(now)
+            self.tokens = min(float(self.burst), self.tokens + (now - self.last_refill) * rate)
+            self.last_refill = now
+            if not self.pacing(now) or self.tokens >= cost:
+                # Unpaced calls use up tokens as well, so there is no burst saved up for when pacing kicks in
+                self.tokens = max(self.tokens - cost, 0.0)
+                if self.remaining is not None:
+                    self.remaining -= cost  # Optimistically spend, the response headers will correct us
+                return
+            await asyncio.sleep((cost - self.tokens) / rate if rate else 1)
+
+    def projected_exhaustion(self) -> typing.Optional[float]:
+        """Returns the time at which the budget runs out at the current rate of spending, or None if it
+           will last until the reset"""
+        if self.remaining is None or not self.window_start:
+            return None
+        now = time.time()
+        started, remaining_at_start = self.window_start
+        spent = remaining_at_start - self.remaining
+        if spent <= 0 or now <= started:
+            return None
+        exhaustion = now + self.remaining / (spent / (now - started))
+        if exhaustion >= self.reset:
+            return None
+        return exhaustion
+
+    def status(self) -> dict:
+        return {
+            "limit": self.limit,
+            "remaining": self.remaining,
+            "reset": self.reset,
+            "spent": self.spent,
+            "projected_exhaustion": self.projected_exhaustion(),
+        }
+
+
+class RateLimitTracker:
+    """Keeps track of the GitHub API budget for each resource, as reported by GitHub itself"""
+
+    buckets: typing.Dict[str, RateLimitBucket]
+
+    def __init__(self, reserve: int = DEFAULT_RESERVE, burst: int = DEFAULT_BURST):
+        self.reserve = reserve
+        self.burst = burst
+        self.buckets = {}
+
+    def bucket(self, resource: str) -> RateLimitBucket:
+        if resource not in self.buckets:
+            self.buckets[resource] = RateLimitBucket(resource, reserve=self.reserve, burst=self.burst)
+        return self.buckets[resource]
+
+    async def acquire(self, resource: str, cost: typing.Optional[int] = None):
+        """Waits for budget for a call against the given resource. If no cost is given, the cost of the
+           previous call against the resource is used as an estimate."""
+        bucket = self.bucket(resource)
+        await bucket.acquire(cost or bucket.last_cost)
+
+    def update_from_headers(self, headers: typing.Mapping[str, str]):
+        """Updates the budget from the X-RateLimit-* headers of a response"""
+        if "X-RateLimit-Limit" not in headers:
+            return
+        bucket = self.bucket(headers.get("X-RateLimit-Resource", "core"))
+        bucket.update(
+            int(headers["X-RateLimit-Limit"]),
+            int(headers.get("X-RateLimit-Remaining", 0)),
+            float(headers.get("X-RateLimit-Reset", 0)),
+        )
+        if bucket.resource != "graphql":
+            bucket.spent += 1
+
+    def update_from_graphql(self, rate_limit: dict):
+        """Updates the GraphQL budget from the rateLimit field of a GraphQL response"""
+        bucket = self.bucket("graphql")
+        cost = int(rate_limit.get("cost", 1))
+        bucket.spent += cost
+        bucket.last_cost = max(cost, 1)
+        if "limit" in rate_limit and "remaining" in rate_limit and "resetAt" in rate_limit:
+            resets = dateutil.parser.parse(rate_limit["resetAt"]).timestamp()
+            bucket.update(int(rate_limit["limit"]), int(rate_limit["remaining"]), resets)
+
+    def status(self) -> typing.Dict[str, dict]:
+        """Returns the current budget and projected exhaustion time of each resource"""
+        return {resource: bucket.status() for resource, bucket in self.buckets.items()}
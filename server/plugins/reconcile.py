@@ -0,0 +1,337 @@
+"""Plan/apply reconciliation of GitHub teams for Boxer.
+   The planner works out every team creation, membership change and repository assignment needed to bring GitHub
+   in line with LDAP, MFA and gitbox, as a plain data structure, before anything is touched. The plan can be
+   exported as JSON for review, estimated against the remaining API budget, trimmed to fit that budget, and then
+   handed to the executor, which applies it team by team with bounded concurrency."""
+import asyncio
+import json
+import typing
+
+import plugins.basetypes
+import plugins.github
+import plugins.membership
+import plugins.projects
+import plugins.transport
+
+# Order in which changes are applied, and kept when a plan has to be trimmed to fit the API budget.
+# Teams must exist before anything can be done with them, and removals are more urgent than additions.
+ACTION_PRIORITY = ("create_team", "remove_member", "add_member", "add_repository", "remove_repository")
+ACTION_COST = {  # REST calls needed per change. None of the changes use GraphQL.
+    "create_team": 1,
+    "add_member": 1,
+    "remove_member": 1,
+    "add_repository": 1,
+    "remove_repository": 1,
+}
+
+
+class TeamChange:
+    """A single change to a GitHub team"""
+
+    action: str
+    team: str
+    target: str
+    project: str
+    role: str
+
+    def __init__(self, action: str, team: str, project: str, role: str, target: str = ""):
+        assert action in ACTION_COST, f"Unknown team change action: {action}"
+        self.action = action
+        self.team = team
+        self.project = project
+        self.role = role
+        self.target = target
+
+    def __repr__(self):
+        return f"TeamChange<{' '.join(x for x in (self.action, self.team, self.target) if x)}>"
+
+    def to_dict(self) -> dict:
+        return {
+            "action": self.action,
+            "team": self.team,
+            "project": self.project,
+            "role": self.role,
+            "target": self.target,
+        }
+
+
+class ReconciliationPlan:
+    """The full set of changes needed to reconcile the GitHub organization"""
+
+    changes: typing.List[TeamChange]
+    deferred: int
+
+    def __init__(self, changes: typing.Optional[typing.List[TeamChange]] = None):
+        self.changes = changes or []
+        self.deferred = 0
+        self.skipped = 0  # Teams left out because their fingerprints matched the last successful cycle
+        self.fingerprints: typing.Dict[str, int] = {}  # Desired state fingerprint of every team planned (or skipped)
+        self.github_repos: typing.Optional[int] = None  # Fingerprint of the GitHub repositories planned against
+
+    def __len__(self):
+        return len(self.changes)
+
+    def add(self, action: str, team: str, project: str, role: str, targets: typing.Iterable[str] = ("",)):
+        for target in targets:
+            self.changes.append(TeamChange(action, team, project, role, target))
+
+    def cost(self) -> typing.Dict[str, int]:
+        """Estimates the API cost of applying this plan, per rate limit resource"""
+        return {"core": sum(ACTION_COST[change.action] for change in self.changes), "graphql": 0}
+
+    def summary(self) -> typing.Dict[str, int]:
+        """Returns the number of changes in the plan, per action"""
+        counts = {action: 0 for action in ACTION_PRIORITY}
+        for change in self.changes:
+            counts[change.action] += 1
+        return counts
+
+    def to_json(self) -> str:
+        return json.dumps(
+            {
+                "summary": self.summary(),
+                "cost": self.cost(),
+                "deferred": self.deferred,
+                "changes": [change.to_dict() for change in self.changes],
+            },
+            indent=2,
+        )
+
+    def save(self, filename: str):
+        """Exports the plan as JSON, for review or for dry runs"""
+        with open(filename, "w") as f:
+            f.write(self.to_json())
+
+    def fit_to_budget(self, budget: typing.Optional[int]) -> "ReconciliationPlan":
+        """Returns a plan with as many changes as the REST budget allows, most urgent first. The changes left out
+           are not lost; they will show up again when the next run plans against the state of GitHub by then."""
+        ordered = sorted(self.changes, key=lambda change: ACTION_PRIORITY.index(change.action))
+        fitted = []
+        spent = 0
+        for change in ordered:
+            if budget is not None and spent + ACTION_COST[change.action] > budget:
+                break
+            spent += ACTION_COST[change.action]
+            fitted.append(change)
+        plan = ReconciliationPlan(fitted)
+        plan.deferred = len(self.changes) - len(fitted)
+        plan.skipped = self.skipped
+        # Teams with deferred changes are not done yet, so they must not be fingerprinted as such after applying
+        deferred_teams = set(change.team for change in ordered[len(fitted):])
+        plan.fingerprints = {team: fp for team, fp in self.fingerprints.items() if team not in deferred_teams}
+        plan.github_repos = self.github_repos
+        return plan
+
+
+class TeamFingerprints:
+    """Fingerprints of the desired state (members with MFA, managed repositories) and of the observed GitHub state
+    (members, repositories) of each team, as of the last cycle that planned and fully applied its changes. A team
+    whose fingerprints both still match has nothing to change and is skipped when planning. The desired state of
+    a team is only worked out again if the change set of the run says its project may have changed, or the list of
+    GitHub repositories changed, so planning cost follows churn rather than the size of the organization."""
+
+    def __init__(self):
+        self.desired: typing.Dict[str, int] = {}
+        self.observed: typing.Dict[str, typing.Optional[int]] = {}
+        self.github_repos: typing.Optional[int] = None
+
+    @staticmethod
+    def of_desired(members: typing.Optional[typing.FrozenSet[str]], repos: typing.Iterable[str]) -> int:
+        """Fingerprints the desired state of a team. Members are None if they are not managed (no LDAP data)."""
+        return hash((members, frozenset(repos)))
+
+    @staticmethod
+    def of_team(team: typing.Optional[plugins.github.GitHubTeam]) -> typing.Optional[int]:
+        """Fingerprints the observed GitHub state of a team"""
+        if team is None:
+            return None
+        return hash((frozenset(team.members), frozenset(team.repos)))
+
+    @staticmethod
+    def of_repositories(github_repos: typing.Iterable[str]) -> int:
+        return hash(frozenset(github_repos))
+
+    def known(self, team: str, github_repos: int, changes: typing.Optional[plugins.projects.ChangeSet], project: str):
+        """Returns the desired state fingerprint of a team from the last successful cycle if nothing it depends on
+        changed since, or None if it has to be worked out again"""
+        if changes is None or changes.touches(project) or github_repos != self.github_repos:
+            return None
+        return self.desired.get(team)
+
+    def matches(self, team: str, desired: int, observed: typing.Optional[int]) -> bool:
+        return observed is not None and self.desired.get(team) == desired and self.observed.get(team) == observed
+
+    def forget(self, projects: typing.Iterable[str]):
+        """Drops the fingerprints of the teams of projects that were changed outside of a change set"""
+        for project in projects:
+            for role in ("committers", "private"):
+                self.desired.pop(f"{project} {role}", None)
+                self.observed.pop(f"{project} {role}", None)
+
+    def clear(self):
+        """Drops all fingerprints, so every team is planned in full"""
+        self.desired.clear()
+        self.observed.clear()
+        self.github_repos = None
+
+    def commit(self, plan: ReconciliationPlan, teams: typing.Iterable[plugins.github.GitHubTeam]):
+        """Records the fingerprints of the teams of an applied plan. Only teams that exist and had all of their
+        changes applied are recorded, the others are planned again in full next time."""
+        teams_by_name = {team.name: team for team in teams}
+        for name, desired in plan.fingerprints.items():
+            team = teams_by_name.get(name)
+            if team is None or team.errors:
+                self.desired.pop(name, None)
+                self.observed.pop(name, None)
+                continue
+            self.desired[name] = desired
+            self.observed[name] = self.of_team(team)
+        if plan.github_repos is not None:
+            self.github_repos = plan.github_repos
+
+
+def plan_reconciliation(
+    server: plugins.basetypes.Server,
+    org: plugins.github.GitHubOrganisation,
+    projects: typing.Optional[typing.Iterable[str]] = None,
+    fingerprints: typing.Optional[TeamFingerprints] = None,
+) -> ReconciliationPlan:
+    """Works out the team creations, membership changes and repository assignments needed for the whole org, or
+    only for the given projects:
+    - Teams are created for projects with public (committers team) or private (private team) repositories
+    - LDAP members with MFA enabled are added, and people no longer in LDAP or with MFA enabled are removed
+    - GitBox repositories that also exist on GitHub are assigned to the team of the project they belong to
+    If fingerprints from earlier cycles are given, teams whose desired and observed state did not change since
+    are skipped.
+    """
+    plan = ReconciliationPlan()
+    teams = {team.name: team for team in org.teams}
+    if projects is None:
+        to_plan = list(server.data.projects.values())
+    else:
+        to_plan = [server.data.projects[name] for name in projects if name in server.data.projects]
+    github_repos = TeamFingerprints.of_repositories(server.data.github_repos)
+    plan.github_repos = github_repos
+    # Teams whose desired state is known from an earlier cycle, and whose GitHub state did not change since, are
+    # done. Only the projects left need their desired team memberships worked out.
+    if fingerprints is not None:
+        unsettled = []
+        for project in to_plan:
+            settled = True
+            for role, repos in (("committers", project.public_repos), ("private", project.private_repos)):
+                if not repos:
+                    continue
+                team_name = f"{project.name} {role}"
+                desired = fingerprints.known(team_name, github_repos, server.data.changes, project.name)
+                observed = TeamFingerprints.of_team(teams.get(team_name))
+                if desired is not None and fingerprints.matches(team_name, desired, observed):
+                    plan.fingerprints[team_name] = desired
+                    plan.skipped += 1
+                else:
+                    settled = False
+            if not settled:
+                unsettled.append(project)
+        to_plan = unsettled
+    # Desired team memberships for all projects to plan, with MFA applied, in one go
+    matrix = plugins.membership.MembershipMatrix(to_plan, server.data.mfa)
+    for project in to_plan:
+        for role, repos, people in (
+            ("committers", project.public_repos, project.committers),
+            ("private", project.private_repos, project.pmc),
+        ):
+            team_name = f"{project.name} {role}"
+            if not repos or team_name in plan.fingerprints:
+                continue
+            team = teams.get(team_name)
+            managed_repos = [x.filename for x in repos if x.filename in server.data.github_repos]
+            desired = TeamFingerprints.of_desired(matrix.desired(project.name, role) if people else None, managed_repos)
+            plan.fingerprints[team_name] = desired
+            if fingerprints is not None and fingerprints.matches(team_name, desired, TeamFingerprints.of_team(team)):
+                plan.skipped += 1
+                continue
+            if team is None:
+                plan.add("create_team", team_name, project.name, role)
+            if people:  # Only set if we got LDAP data back
+                to_add, to_remove = matrix.diff(project.name, role, team.members if team else [])
+                plan.add("add_member", team_name, project.name, role, to_add)
+                plan.add("remove_member", team_name, project.name, role, to_remove)
+            to_add, to_remove = plugins.github.GitHubTeam.diff_repositories(team.repos if team else [], managed_repos)
+            plan.add("add_repository", team_name, project.name, role, to_add)
+            plan.add("remove_repository", team_name, project.name, role, to_remove)
+
+    if projects is None:
+        for team in org.teams:
+            if team.type in ("committers", "private") and team.project not in server.data.projects:
+                print(f"Could not find an ASF project for team {team.slug}!!")
+    return plan
+
+
+async def apply_team_changes(team: plugins.github.GitHubTeam, changes: typing.List[TeamChange]):
+    """Applies the changes for a single team with bounded concurrency, keeping the team's view of its members and
+       repositories up to date, and recording failed changes in team.errors in plan order"""
+    jobs = []
+    for change in changes:
+        if change.action == "add_member":
+            jobs.append(team.add_member(change.target))
+        elif change.action == "remove_member":
+            jobs.append(team.remove_member(change.target))
+        elif change.action == "add_repository":
+            jobs.append(team.add_repository(change.target))
+        elif change.action == "remove_repository":
+            jobs.append(team.remove_repository(change.target))
+    results = await team.org.run_bounded(jobs, team.org.team_inflight)
+    team.errors = []
+    applied: typing.Dict[str, typing.List[str]] = {action: [] for action in ACTION_PRIORITY}
+    for change, error in zip(changes, results):
+        if error is not None:
+            team.errors.append((change.action.replace("_", " ") + f" {change.target}", error))
+            continue
+        applied[change.action].append(change.target)
+        if change.action == "add_member" and change.target not in team.members:
+            team.members.append(change.target)
+        elif change.action == "remove_member" and change.target in team.members:
+            team.members.remove(change.target)
+        elif change.action == "add_repository" and change.target not in team.repos:
+            team.repos.append(change.target)
+        elif change.action == "remove_repository" and change.target in team.repos:
+            team.repos.remove(change.target)
+    if applied["add_member"]:
+        print(f"Added {len(applied['add_member'])} members to team {team.slug}: {', '.join(applied['add_member'])}")
+    if applied["remove_member"]:
+        print(
+            f"Removed {len(applied['remove_member'])} members from team {team.slug}: "
+            f"{', '.join(applied['remove_member'])}"
+        )
+    for repo in applied["add_repository"]:
+        print(f"- Added {repo}.git to GitHub team {team.slug}")
+    for repo in applied["remove_repository"]:
+        print(f"- Removed {repo}.git from GitHub team {team.slug}")
+
+
+async def apply_plan(org: plugins.github.GitHubOrganisation, plan: ReconciliationPlan):
+    """Applies a reconciliation plan. Missing teams are created first, then the changes for every team are applied
+       concurrently, bounded by the organization's in-flight limits. A failure on one team does not stop the rest."""
+    teams = {team.name: team for team in org.teams}
+    for change in plan.changes:
+        if change.action == "create_team" and change.team not in teams:
+            print(f"Team '{change.team}' was not found on GitHub, setting it up for the first time.")
+            try:
+                teams[change.team] = await org.create_team(change.project, change.role)
+            except (plugins.transport.GitHubAPIError, AssertionError) as e:
+                print(f"Could not set up team '{change.team}': {e}")
+
+    per_team: typing.Dict[str, typing.List[TeamChange]] = {}
+    for change in plan.changes:
+        if change.action != "create_team":
+            per_team.setdefault(change.team, []).append(change)
+    batches = [(teams[name], changes) for name, changes in per_team.items() if name in teams]
+    results = await asyncio.gather(
+        *[apply_team_changes(team, changes) for team, changes in batches], return_exceptions=True
+    )
+    for (team, changes), result in zip(batches, results):
+        if isinstance(result, Exception):
+            print(f"Could not adjust team {team.slug}: {result}")
+            team.errors.append(("adjust team", result))  # So it is not fingerprinted as done
+            continue
+        for action, error in team.errors:
+            print(f"Could not {action} for team {team.slug}: {error}")
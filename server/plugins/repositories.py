@@ -1,22 +1,49 @@
 import aiohttp
+import asyncio
+import ctypes
+import ctypes.util
+import errno
+import json
 import os
 import re
+import struct
+import sys
+import typing
+
+# inotify(7) event flags
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_ONLYDIR
+EVENT_HEADER = struct.Struct("iIII")  # struct inotify_event: wd, mask, cookie, len, followed by the name
 
 
 class RepoConfig:
     public: str
     private: str
     fallback: str
+    fallback_cache: str
+    watch: bool
 
     def __init__(self, subyaml: dict):
         self.public = subyaml.get("public", "/x1/repos/asf/")
         self.private = subyaml.get("private", "/x1/repos/private/")
         self.fallback = subyaml.get("fallback", "")
+        # Where to keep the last good copy of the fallback list, so it can be served while the remote is down
+        self.fallback_cache = subyaml.get("fallback_cache", "")
+        # Watch the repo dirs for changes through inotify, instead of listing them every time
+        self.watch = bool(subyaml.get("watch", True))
         assert isinstance(self.public, str) and os.path.isdir(self.public), "Public repo dir must exist!"
         assert isinstance(self.private, str) and os.path.isdir(self.private), "Private repo dir must exist!"
 
 
 class Repository:
+    __slots__ = ("private", "filename", "filepath", "project")
     private: bool
     filename: str
     filepath: str
@@ -24,13 +51,13 @@ class Repository:
 
     def __init__(self, private, filepath):
         self.private = private
-        self.filename = os.path.basename(filepath).replace('.git', '')
+        self.filename = sys.intern(os.path.basename(filepath).replace('.git', ''))
         self.filepath = filepath
         m = re.match(r"^(?:incubator-)?(empire-db|[^-.]+)-?.*(?:\.git)?$", self.filename)
         if m:
-            self.project = m.group(1)
+            self.project = sys.intern(m.group(1))
         else:
-            self.project = self.filename.split('-', 1)[0]  # ????
+            self.project = sys.intern(self.filename.split('-', 1)[0])  # ????
 
     def __str__(self):
         return self.filename
@@ -39,37 +66,318 @@ class Repository:
         return f"Repository<{self.filepath}>"
 
 
-async def list_all(cfg: RepoConfig) -> list:
-    """ Fetches all local and fallback-via-remote repositories we host.
+def scan_project(path: str, repositories: typing.Dict[str, Repository]):
+    """Adds the private repositories in a project's directory under the private repo dir"""
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.name.endswith('.git'):
+                repositories[entry.path] = Repository(True, entry.path)
+
+
+def scan_local(cfg: RepoConfig) -> typing.Dict[str, Repository]:
+    """ Lists the repositories on local disk, in a single os.scandir pass over the public repo dir and the project
+    directories under the private repo dir.
 
     :param cfg: Repository configuration object
-    :return: A list of all repositories we manage, as Repository objects
+    :return: All local repositories, as Repository objects by path
     """
-    repositories = []
-    public_found = 0
-    private_found = 0
-
+    repositories: typing.Dict[str, Repository] = {}
     # Add public repos, should all be in one big directory
-    for repo in [x for x in os.listdir(cfg.public) if x.endswith('.git')]:
-        public_found += 1
-        filepath = os.path.join(cfg.public, repo)
-        repositories.append(Repository(False, filepath))
-
+    with os.scandir(cfg.public) as entries:
+        for entry in entries:
+            if entry.name.endswith('.git'):
+                repositories[entry.path] = Repository(False, entry.path)
     # Add private repos, should be in individual sub dirs, one per project
-    for project in os.listdir(cfg.private):
-        path = os.path.join(cfg.private, project)
-        for repo in [x for x in os.listdir(path) if x.endswith('.git')]:
-            filepath = os.path.join(cfg.private, project, repo)
-            private_found += 1
-            repositories.append(Repository(True, filepath))
+    with os.scandir(cfg.private) as projects:
+        for project in projects:
+            if project.is_dir():
+                scan_project(project.path, repositories)
+    return repositories
+
+
+class RepositoryWatcher:
+    """Keeps the set of local repositories current through Linux inotify events on the public repo dir, the private
+    repo dir and each project directory under it, after one initial scan, instead of listing thousands of
+    directories every time. Repositories added and removed since the last call to drain() are kept track of, and
+    listeners are called whenever there are new ones. If the event queue overflows, everything is scanned again."""
+
+    def __init__(self, cfg: RepoConfig):
+        self.cfg = cfg
+        self.repositories: typing.Dict[str, Repository] = {}
+        self.added: typing.Dict[str, Repository] = {}
+        self.removed: typing.Dict[str, Repository] = {}
+        self.listeners: typing.List[typing.Callable[[], None]] = []
+        self.watches: typing.Dict[int, typing.Tuple[str, str]] = {}  # Watch descriptor -> (kind, directory)
+        self.fd = -1
+        self.libc: typing.Optional[ctypes.CDLL] = None
+        self.events = 0
+        self.rescans = 0
+
+    @property
+    def active(self) -> bool:
+        return self.fd >= 0
+
+    def start(self):
+        """Scans the repository dirs and starts watching them. Raises OSError if inotify can't be used here."""
+        if not sys.platform.startswith("linux"):
+            raise OSError(errno.ENOSYS, "inotify is only available on Linux")
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "Could not set up inotify")
+        self.fd = fd
+        try:
+            self.scan()
+        except OSError:
+            self.close()
+            raise
+        self.added = {}  # What was there to begin with is not news
+        asyncio.get_event_loop().add_reader(self.fd, self.read_events)
+        print(f"Watching {len(self.watches)} directories for repositories, {len(self.repositories)} found")
+
+    def close(self):
+        if self.fd >= 0:
+            try:
+                asyncio.get_event_loop().remove_reader(self.fd)
+            except RuntimeError:  # No event loop (any more)
+                pass
+            os.close(self.fd)
+        self.fd = -1
+        self.watches = {}
+
+    def watch(self, path: str, kind: str):
+        """Starts watching a directory: the public repo dir ("public"), the private one ("private") or a project
+        directory under the private one ("project")"""
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"Could not watch {path}")
+        self.watches[wd] = (kind, path)
+
+    def scan(self):
+        """Watches all repository dirs that are not watched yet, and (re)scans them. Directories are watched before
+        they are scanned, so a repository created in between is not missed."""
+        watched = set(path for kind, path in self.watches.values())
+        if self.cfg.public not in watched:
+            self.watch(self.cfg.public, "public")
+        if self.cfg.private not in watched:
+            self.watch(self.cfg.private, "private")
+        found: typing.Dict[str, Repository] = {}
+        with os.scandir(self.cfg.public) as entries:
+            for entry in entries:
+                if entry.name.endswith('.git'):
+                    found[entry.path] = self.repositories.get(entry.path) or Repository(False, entry.path)
+        with os.scandir(self.cfg.private) as projects:
+            for project in projects:
+                if project.is_dir():
+                    if project.path not in watched:
+                        self.watch(project.path, "project")
+                    scan_project(project.path, found)
+        for path in list(self.repositories):
+            if path not in found:
+                self.remove(path)
+        for path, repo in found.items():
+            self.add(repo)
+
+    def add(self, repo: Repository):
+        if repo.filepath in self.repositories:
+            return
+        self.repositories[repo.filepath] = repo
+        if self.removed.pop(repo.filepath, None) is None:
+            self.added[repo.filepath] = repo
+
+    def remove(self, path: str):
+        repo = self.repositories.pop(path, None)
+        if repo is None:
+            return
+        if self.added.pop(path, None) is None:
+            self.removed[path] = repo
+
+    def read_events(self):
+        """Reads and handles all inotify events waiting, then tells the listeners if anything changed"""
+        changes = len(self.added) + len(self.removed)
+        while self.fd >= 0:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+                name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].split(b"\0", 1)[0]
+                offset += EVENT_HEADER.size + length
+                self.events += 1
+                self.handle(wd, mask, os.fsdecode(name))
+        if len(self.added) + len(self.removed) != changes:
+            for listener in self.listeners:
+                listener()
+
+    def handle(self, wd: int, mask: int, name: str):
+        if mask & IN_Q_OVERFLOW:  # Lost events, so we don't know what changed anymore
+            self.rescans += 1
+            self.scan()
+            return
+        if wd not in self.watches:
+            return
+        kind, directory = self.watches[wd]
+        if mask & IN_IGNORED:  # Directory is gone
+            del self.watches[wd]
+            if kind != "project":
+                print(f"Repository dir {directory} is gone, no longer watching for repositories")
+                self.close()
+            return
+        path = os.path.join(directory, name)
+        if kind == "private":
+            if not mask & IN_ISDIR:
+                return
+            if mask & (IN_CREATE | IN_MOVED_TO):  # New project dir, which may already have repositories in it
+                self.watch(path, "project")
+                found: typing.Dict[str, Repository] = {}
+                scan_project(path, found)
+                for repo in found.values():
+                    self.add(repo)
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                for repo_path in [x for x in self.repositories if x.startswith(path + os.sep)]:
+                    self.remove(repo_path)
+                for project_wd, (project_kind, project_dir) in list(self.watches.items()):
+                    if project_kind == "project" and project_dir == path:
+                        self.libc.inotify_rm_watch(self.fd, project_wd)
+                        del self.watches[project_wd]
+        elif name.endswith('.git'):
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                self.add(Repository(kind == "project", path))
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                self.remove(path)
+
+    def drain(self) -> typing.Tuple[typing.List[Repository], typing.List[Repository]]:
+        """Returns the repositories added and removed since the last call"""
+        added, removed = list(self.added.values()), list(self.removed.values())
+        self.added = {}
+        self.removed = {}
+        return added, removed
+
+
+class FallbackList:
+    """The list of repositories still hosted on the old server (repositories/fallback). It is fetched with
+    If-None-Match/If-Modified-Since, so it is only downloaded and parsed again when it changed, and the last good
+    copy is kept in memory and on disk (repositories/fallback_cache), to be served when the remote is down."""
+
+    def __init__(self, cfg: RepoConfig):
+        self.url = cfg.fallback
+        self.cache_file = cfg.fallback_cache
+        self.etag = ""
+        self.last_modified = ""
+        self.repositories: typing.Optional[typing.List[Repository]] = None
+        self.session: typing.Optional[aiohttp.ClientSession] = None
+        self.fetches = 0
+        self.not_modified = 0
+        self.failures = 0
+        if self.cache_file:
+            self.load()
+
+    def parse(self, data: str):
+        self.repositories = [Repository(False, repo) for repo in sorted(data.split("\n")) if repo.strip()]
+
+    def load(self):
+        """Loads the copy saved by a previous fetch, if it is from the same URL"""
+        if not os.path.exists(self.cache_file):
+            return
+        try:
+            with open(self.cache_file) as f:
+                cached = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Could not load cached fallback repository list from {self.cache_file}: {e}")
+            return
+        if cached.get("url") != self.url:
+            return
+        self.etag = cached.get("etag", "")
+        self.last_modified = cached.get("last_modified", "")
+        self.repositories = [Repository(False, repo) for repo in cached.get("repositories", [])]
+
+    def save(self):
+        cached = {
+            "url": self.url,
+            "etag": self.etag,
+            "last_modified": self.last_modified,
+            "repositories": [repo.filepath for repo in self.repositories],
+        }
+        tmpfile = self.cache_file + ".tmp"
+        try:
+            with open(tmpfile, "w") as f:
+                json.dump(cached, f)
+            os.replace(tmpfile, self.cache_file)
+        except OSError as e:
+            print(f"Could not save fallback repository list to {self.cache_file}: {e}")
+
+    async def fetch(self) -> typing.List[Repository]:
+        """Returns the repositories on the fallback list, fetching it again if it changed. If the remote can't be
+        reached, the last good copy is returned; only if there is none, the error is raised."""
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30))
+        headers = {}
+        if self.repositories is not None:  # Only ask for changes if we have something to fall back on
+            if self.etag:
+                headers["If-None-Match"] = self.etag
+            if self.last_modified:
+                headers["If-Modified-Since"] = self.last_modified
+        self.fetches += 1
+        try:
+            async with self.session.get(self.url, headers=headers) as rv:
+                if rv.status == 304:
+                    self.not_modified += 1
+                    return self.repositories
+                rv.raise_for_status()
+                data = await rv.text()
+                self.etag = rv.headers.get("ETag", "")
+                self.last_modified = rv.headers.get("Last-Modified", "")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.failures += 1
+            if self.repositories is None:
+                raise
+            print(f"Could not fetch fallback repository list from {self.url}, using the last good copy: {e}")
+            return self.repositories
+        self.parse(data)
+        if self.cache_file:
+            self.save()
+        return self.repositories
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+
+async def list_all(
+    cfg: RepoConfig,
+    watcher: typing.Optional[RepositoryWatcher] = None,
+    fallback: typing.Optional[FallbackList] = None,
+) -> list:
+    """ Fetches all local and fallback-via-remote repositories we host.
+
+    :param cfg: Repository configuration object
+    :param watcher: Repository watcher to take the local repositories from, instead of listing the repo dirs
+    :param fallback: Fallback list to fetch the remote repositories through, kept across calls so they are only
+                     downloaded again when they changed
+    :return: A list of all repositories we manage, as Repository objects
+    """
+    if watcher is not None and watcher.active:
+        local = watcher.repositories
+    else:
+        local = scan_local(cfg)
+    repositories = list(local.values())
+    public_found = sum(1 for repo in repositories if not repo.private)
+    private_found = len(repositories) - public_found
 
     # If fallback from old server, add those into the mix
     if cfg.fallback:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(cfg.fallback) as rv:
-                data = await rv.text()
-                for repo in sorted(data.split("\n")):
-                    public_found += 1
-                    repositories.append(Repository(False, repo))
+        if fallback is None:
+            fallback = FallbackList(cfg)
+            try:
+                remote = await fallback.fetch()
+            finally:
+                await fallback.close()
+        else:
+            remote = await fallback.fetch()
+        public_found += len(remote)
+        repositories.extend(remote)
     print(f"Located {len(repositories)} repositories ({public_found} public, {private_found} private)")
     return repositories
@@ -0,0 +1,140 @@
+"""Event-driven scheduler for Boxer's background work.
+   Every job (listing gitbox, checking MFA, reconciling the projects that changed, a full background run) has its
+   own interval and priority, and can be triggered from outside as well: by a new repository on disk, an LDAP
+   change or an admin asking for it. Triggers for a job that is already pending are coalesced into a single run,
+   and can name the projects they affect, so the job only has to look at those. Jobs run one at a time, most urgent
+   first, so they never work on the same data at the same time."""
+import asyncio
+import time
+import typing
+
+
+class Job:
+    """A scheduled job. The coroutine function it runs is given the projects named by the triggers since its last
+    run, whether it runs because it was triggered or because its interval is up (an empty set if there were none),
+    or None if it was triggered for everything."""
+
+    def __init__(
+        self,
+        name: str,
+        run: typing.Callable[[typing.Optional[typing.Set[str]]], typing.Awaitable],
+        interval: typing.Optional[float],
+        priority: int,
+        covers: typing.Iterable[str],
+    ):
+        self.name = name
+        self.run = run
+        self.interval = interval  # Seconds between runs, or None to only run when triggered
+        self.priority = priority  # Lower runs first
+        self.covers = tuple(covers)  # Jobs that running this one does the work of as well
+        self.due: typing.Optional[float] = time.monotonic() if interval else None
+        self.pending = False
+        self.projects: typing.Optional[typing.Set[str]] = set()
+        self.runs = 0
+        self.triggers = 0
+        self.coalesced = 0
+        self.failures = 0
+
+    def __repr__(self):
+        return f"Job<{self.name}>"
+
+    def reset(self, now: float):
+        self.pending = False
+        self.projects = set()
+        if self.interval:
+            self.due = now + self.interval
+
+
+class Scheduler:
+    """Runs jobs when their interval is up or when they are triggered, one at a time, most urgent first"""
+
+    def __init__(self):
+        self.jobs: typing.Dict[str, Job] = {}
+        self.wakeup = asyncio.Event()
+        self.current: typing.Optional[Job] = None
+
+    def add(
+        self,
+        name: str,
+        run: typing.Callable[[typing.Optional[typing.Set[str]]], typing.Awaitable],
+        interval: typing.Optional[float] = None,
+        priority: int = 0,
+        covers: typing.Iterable[str] = (),
+    ):
+        """Adds a job. Jobs with an interval run right away, and then every interval seconds. If running a job also
+        does the work of other jobs (covers), their pending triggers are dropped and their intervals restarted."""
+        for covered in covers:
+            assert covered in self.jobs, f"Job {name} covers unknown job {covered}"
+        self.jobs[name] = Job(name, run, interval, priority, covers)
+        self.wakeup.set()
+
+    def trigger(self, name: str, projects: typing.Optional[typing.Iterable[str]] = None):
+        """Asks for a job to be run as soon as possible, for the given projects, or for everything if none are
+        given. Triggers for a job that has not run yet since it was last triggered are merged into one."""
+        job = self.jobs[name]
+        job.triggers += 1
+        if job.pending:
+            job.coalesced += 1
+        job.pending = True
+        if projects is None:
+            job.projects = None
+        elif job.projects is not None:
+            job.projects.update(projects)
+        self.wakeup.set()
+
+    def defer(self, name: str, delay: float):
+        """Puts off the next run of a job, as when a source it depends on is down"""
+        job = self.jobs[name]
+        job.pending = False
+        job.due = time.monotonic() + delay
+
+    def next_job(self) -> typing.Tuple[typing.Optional[Job], typing.Optional[float]]:
+        """Returns the job to run now, if any, or else how long to wait for the next one to be due"""
+        now = time.monotonic()
+        ready = [job for job in self.jobs.values() if job.pending or (job.due is not None and job.due <= now)]
+        if ready:
+            return min(ready, key=lambda job: (job.priority, job.due or now)), None
+        due = [job.due - now for job in self.jobs.values() if job.due is not None]
+        return None, min(due) if due else None
+
+    async def run_job(self, job: Job):
+        now = time.monotonic()
+        # Projects triggered for must never be dropped, also not when the interval is up at the same time, or when
+        # they were triggered for a job this one covers
+        projects = job.projects
+        for covered in job.covers:
+            if self.jobs[covered].projects is None:
+                projects = None  # Triggered for everything
+            elif projects is not None and self.jobs[covered].projects:
+                projects = projects | self.jobs[covered].projects
+        job.reset(now)
+        for covered in job.covers:
+            self.jobs[covered].reset(now)
+        self.current = job
+        job.runs += 1
+        try:
+            await job.run(projects)
+        except Exception as e:
+            job.failures += 1
+            print(f"Scheduled job {job.name} failed: {e}")
+        finally:
+            self.current = None
+
+    async def run(self):
+        """Runs jobs forever"""
+        while True:
+            self.wakeup.clear()
+            job, wait = self.next_job()
+            if job is None:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self.run_job(job)
+
+    def statistics(self) -> typing.Dict[str, dict]:
+        return {
+            name: {"runs": job.runs, "triggers": job.triggers, "coalesced": job.coalesced, "failures": job.failures}
+            for name, job in self.jobs.items()
+        }
@@ -0,0 +1,116 @@
+"""Persistent state for Boxer.
+   After each background run, the last known state of GitHub (teams, repositories, MFA) and of gitbox/LDAP (projects,
+   repositories and people) is saved to disk as versioned, gzipped JSON. On startup it is loaded back into the
+   server's InterData, so the web tier has data to serve right away and the first background run starts warm."""
+import gzip
+import json
+import os
+import time
+import typing
+
+import plugins.basetypes
+import plugins.github
+import plugins.projects
+import plugins.repositories
+
+STATE_VERSION = 1
+
+
+def save_state(server: plugins.basetypes.Server, filename: str):
+    """Saves the current state to disk. The file is replaced atomically, so a crash mid-write never leaves a
+       broken state file behind."""
+    state = {
+        "version": STATE_VERSION,
+        "saved": int(time.time()),
+        "repositories": [[repo.private, repo.filepath] for repo in server.data.repositories],
+        "github_repos": server.data.github_repos,
+        "mfa": server.data.mfa,
+        "teams": [
+            {"id": team.id, "slug": team.slug, "name": team.name, "members": team.members, "repos": team.repos}
+            for team in server.data.teams
+        ],
+        "projects": {
+            name: {
+                "committers": [person.asf_id for person in project.committers],
+                "pmc": [person.asf_id for person in project.pmc],
+                "public_repos": [repo.filepath for repo in project.public_repos],
+                "private_repos": [repo.filepath for repo in project.private_repos],
+            }
+            for name, project in server.data.projects.items()
+        },
+        "people": [
+            [person.asf_id, person.github_login, person.github_mfa, person.real_name] for person in server.data.people
+        ],
+    }
+    tmpfile = filename + ".tmp"
+    with gzip.open(tmpfile, "wt") as f:
+        json.dump(state, f, separators=(",", ":"))
+    os.replace(tmpfile, filename)
+
+
+def load_state(server: plugins.basetypes.Server, filename: str) -> bool:
+    """Loads a previously saved state into the server's InterData. Returns True if the state was loaded, False if
+       there was no (usable) state file to load."""
+    if not os.path.exists(filename):
+        return False
+    try:
+        with gzip.open(filename, "rt") as f:
+            state = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Could not load saved state from {filename}: {e}")
+        return False
+    if state.get("version") != STATE_VERSION:
+        print(f"Saved state in {filename} is version {state.get('version')}, expected {STATE_VERSION}, ignoring it.")
+        return False
+
+    repositories = {
+        filepath: plugins.repositories.Repository(private, filepath) for private, filepath in state["repositories"]
+    }
+    # With the link table, the first run can bring this organization up to date instead of compiling a new one
+    org = plugins.projects.Organization(server.database.links)
+    for name, project_data in state["projects"].items():
+        project = org.add_project(name=name, committers=project_data["committers"], pmc=project_data["pmc"])
+        if not project:
+            continue
+        for filepath in project_data["public_repos"]:
+            repo = repositories.get(filepath) or plugins.repositories.Repository(False, filepath)
+            project.add_repository(repo, False)
+        for filepath in project_data["private_repos"]:
+            repo = repositories.get(filepath) or plugins.repositories.Repository(True, filepath)
+            project.add_repository(repo, True)
+    for asf_id, _, _, real_name in state["people"]:
+        # The GitHub link and MFA status come from the link table, as they are now rather than when the state was
+        # saved, the way compiling the organization would have them
+        person = org.add_committer(asf_id)
+        person.real_name = real_name
+
+    github_org: typing.Optional[plugins.github.GitHubOrganisation] = server.data.github_org
+    teams = []
+    if github_org:
+        for team_data in state["teams"]:
+            nodedata = {
+                "node": {
+                    "databaseId": team_data["id"],
+                    "slug": team_data["slug"],
+                    "name": team_data["name"],
+                    "members": {"edges": [{"node": {"login": login}} for login in team_data["members"]]},
+                    "repositories": {"edges": [{"node": {"name": name}} for name in team_data["repos"]]},
+                },
+            }
+            teams.append(plugins.github.GitHubTeam(github_org, nodedata))
+        github_org.teams = teams
+        github_org.repositories = state["github_repos"]
+
+    server.data.repositories = list(repositories.values())
+    server.data.github_repos = state["github_repos"]
+    server.data.mfa = state["mfa"]
+    server.data.teams = teams
+    server.data.organization = org
+    server.data.projects = org.projects
+    server.data.people = list(org.committers)
+    age = int(time.time()) - state.get("saved", 0)
+    print(
+        f"Loaded saved state from {filename} ({age} seconds old): {len(server.data.projects)} projects, "
+        f"{len(server.data.people)} people, {len(teams)} GitHub teams."
+    )
+    return True
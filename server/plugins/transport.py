@@ -0,0 +1,152 @@
+"""Resilient HTTP transport for GitHub API calls in Boxer.
+   Every call is admitted through the rate limit tracker, retried with exponential backoff and jitter on transient
+   failures (5xx, secondary rate limits, rate limited or timed out GraphQL queries, connection errors), and
+   short-circuited while GitHub keeps failing.
+   Failures that retrying will not fix (most 4xx responses) are raised straight away."""
+import asyncio
+import json
+import random
+import time
+import typing
+
+import aiohttp
+
+import plugins.ratelimit
+
+MAX_RETRIES = 5  # Max number of retries for a single call before giving up
+BACKOFF_BASE = 1.0  # Base delay (in seconds) for exponential backoff
+BACKOFF_MAX = 60.0  # Never back off for more than this many seconds at a time
+BREAKER_THRESHOLD = 5  # Consecutive server errors before the circuit breaker trips
+BREAKER_COOLDOWN = 60.0  # How long (in seconds) the breaker stays open before letting a trial call through
+RETRYABLE_STATUSES = (500, 502, 503, 504)
+RETRYABLE_GRAPHQL_ERRORS = ("RATE_LIMITED", "TIMEOUT")  # GraphQL error types that go away by retrying later
+
+
+class GitHubAPIError(Exception):
+    """A failed GitHub API call. Retryable errors are transient, fatal errors will not go away by retrying."""
+
+    def __init__(self, method: str, url: str, status: int, message: str, retryable: bool = False):
+        self.method = method
+        self.url = url
+        self.status = status
+        self.retryable = retryable
+        super().__init__(f"Unexpected return code for {method} on {url}: {status} {message}".strip())
+
+
+class CircuitBreaker:
+    """Trips after a number of consecutive server errors, failing calls fast until GitHub has had time to recover"""
+
+    def __init__(self, threshold: int = BREAKER_THRESHOLD, cooldown: float = BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: typing.Optional[float] = None
+
+    @property
+    def is_open(self) -> bool:
+        """Whether calls should currently be refused. Once the cooldown has passed, the breaker is half-open and
+           lets calls through again; the first failure trips it right back open."""
+        return self.opened_at is not None and time.time() - self.opened_at < self.cooldown
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= self.threshold:
+            if not self.is_open:
+                print(f"GitHub API circuit breaker tripped after {self.failures} consecutive server errors")
+            self.opened_at = time.time()
+
+
+class Transport:
+    """Issues GitHub API calls on a shared session, with rate limiting, retries and a circuit breaker"""
+
+    def __init__(
+        self,
+        session_factory: typing.Callable[[], aiohttp.ClientSession],
+        ratelimit: plugins.ratelimit.RateLimitTracker,
+        max_retries: int = MAX_RETRIES,
+    ):
+        self.session_factory = session_factory
+        self.ratelimit = ratelimit
+        self.max_retries = max_retries
+        self.breaker = CircuitBreaker()
+        self.retries = 0
+
+    @staticmethod
+    def backoff(attempt: int) -> float:
+        """Exponential backoff with full jitter"""
+        return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+    @staticmethod
+    def classify(status: int, headers: typing.Mapping[str, str], text: str) -> typing.Tuple[bool, float]:
+        """Classifies a failed response as retryable or fatal.
+           Returns whether to retry, and the minimum number of seconds GitHub asked us to wait before doing so."""
+        wait = 0.0
+        if "Retry-After" in headers:
+            try:
+                wait = float(headers["Retry-After"])
+            except ValueError:
+                pass
+        if status == 429 or (status == 403 and ("Retry-After" in headers or "secondary rate limit" in text.lower())):
+            return True, wait
+        if status == 403 and headers.get("X-RateLimit-Remaining") == "0":
+            return True, max(wait, float(headers.get("X-RateLimit-Reset", 0)) - time.time())
+        if status in RETRYABLE_STATUSES:
+            return True, wait
+        return False, 0.0
+
+    @staticmethod
+    def classify_graphql(text: str) -> bool:
+        """Whether a GraphQL response that came back with a 200 status failed in a way that retrying can fix.
+           GitHub reports rate limited and timed out queries that way, with no data and the reason in the errors."""
+        try:
+            js = json.loads(text)
+        except ValueError:
+            return False
+        if not isinstance(js, dict) or js.get("data") is not None:
+            return False
+        errors = js.get("errors") or []
+        return any(str(error.get("type", "")).upper() in RETRYABLE_GRAPHQL_ERRORS for error in errors)
+
+    async def request(
+        self,
+        method: str,
+        url: str,
+        expected: typing.Iterable[int] = (200,),
+        resource: str = "core",
+        **kwargs,
+    ) -> typing.Tuple[int, str]:
+        """Performs an API call, retrying transient failures. Returns the status code and body of the response,
+           or raises a GitHubAPIError if the call failed for good."""
+        attempt = 0
+        while True:
+            if self.breaker.is_open:
+                raise GitHubAPIError(method, url, 0, "(circuit breaker open, not calling GitHub)", retryable=True)
+            await self.ratelimit.acquire(resource)
+            try:
+                async with self.session_factory().request(method, url, **kwargs) as rv:
+                    text = await rv.text()
+                    if rv.status in expected:
+                        self.breaker.record_success()
+                        if resource != "graphql" or not self.classify_graphql(text):
+                            return rv.status, text
+                        retryable, wait = True, 0.0
+                    else:
+                        retryable, wait = self.classify(rv.status, rv.headers, text)
+                    error = GitHubAPIError(method, url, rv.status, text[:200], retryable=retryable)
+                    if rv.status in RETRYABLE_STATUSES:
+                        self.breaker.record_failure()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                retryable, wait = True, 0.0
+                error = GitHubAPIError(method, url, 0, f"({e.__class__.__name__}: {e})", retryable=True)
+                self.breaker.record_failure()
+            if not retryable or attempt >= self.max_retries:
+                raise error
+            delay = max(wait, self.backoff(attempt))
+            attempt += 1
+            self.retries += 1
+            print(f"{error} - retrying in {delay:.1f} seconds (attempt {attempt}/{self.max_retries})")
+            await asyncio.sleep(delay)
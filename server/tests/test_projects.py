@@ -0,0 +1,160 @@
+"""Tests for plugins.projects. Run from the server directory with: python3 -m unittest discover tests"""
+import asyncio
+import datetime
+import unittest
+
+import bench.fakeldap
+import bench.synthetic
+import plugins.ldap
+import plugins.projects
+import plugins.repositories
+
+
+class FakeLinkDB:
+    """The part of asfpy.sqlite.DB that the link table uses, holding the ids table in a dict"""
+
+    def __init__(self, rows: dict):
+        self.rows = rows
+
+    def fetch(self, table: str, limit=None) -> list:
+        return [dict(row) for row in self.rows.values()]
+
+    def fetchone(self, table: str, limit=1, asfid=None):
+        row = self.rows.get(asfid)
+        return dict(row) if row else None
+
+    def upsert(self, table: str, document: dict, **target):
+        self.rows[document["asfid"]] = dict(document)
+
+
+def link(asf_id: str, github_login, mfa: bool) -> dict:
+    return {"asfid": asf_id, "githubid": github_login, "mfa": int(mfa), "updated": datetime.datetime.now()}
+
+
+def repositories_of(synthetic: bench.synthetic.SyntheticOrg) -> list:
+    repositories = []
+    for project in synthetic.projects.values():
+        for repo in project.public_repos:
+            repositories.append(plugins.repositories.Repository(False, f"/x1/repos/asf/{repo}.git"))
+        for repo in project.private_repos:
+            repositories.append(plugins.repositories.Repository(True, f"/x1/repos/private/{project.name}/{repo}.git"))
+    return repositories
+
+
+def describe(org: plugins.projects.Organization) -> dict:
+    """Everything about an organization that the later stages go by"""
+    return {
+        "projects": {
+            name: (
+                sorted(person.asf_id for person in project.committers),
+                sorted(person.asf_id for person in project.pmc),
+                sorted(repo.filepath for repo in project.public_repos),
+                sorted(repo.filepath for repo in project.private_repos),
+            )
+            for name, project in org.projects.items()
+        },
+        "people": {
+            person.asf_id: (person.github_login, person.github_mfa, sorted(p.name for p in person.projects))
+            for person in org.committers
+        },
+        "github_logins": {login: person.asf_id for login, person in org.github_logins.items()},
+    }
+
+
+class UpdateDataTest(unittest.TestCase):
+    def test_update_data_gives_the_same_organization_as_compile_data(self):
+        async def scenario():
+            synthetic = bench.synthetic.SyntheticOrg(projects=12, people=150, repos=36, seed=3)
+            ldap = bench.fakeldap.FakeLDAP(synthetic, latency=0, connect_latency=0)
+            config = plugins.ldap.LDAPConfig({"groupbase": bench.fakeldap.GROUP_BASE})
+            links = plugins.projects.LinkTable(
+                FakeLinkDB({a: link(a, p.github_login, p.mfa) for a, p in synthetic.people.items()})
+            )
+            repositories = repositories_of(synthetic)
+            client = plugins.ldap.LDAPClient(config, None, backend=ldap)
+            org = await plugins.projects.compile_data(config, repositories, links, client=client)
+            links.pop_changed()
+
+            # Someone leaves a project and someone else joins, a project loses all of its repositories, another
+            # one gains a repository, and someone links a different GitHub account
+            project = synthetic.projects["project001"]
+            leaving = project.committers[0]
+            joining = next(a for a in synthetic.people if a not in project.committers)
+            ldap.modify("project001", project.committers[1:] + [joining], [x for x in project.pmc if x != leaving])
+            repositories = [repo for repo in repositories if repo.project != "project002"]
+            repositories.append(plugins.repositories.Repository(False, "/x1/repos/asf/project003-new.git"))
+            relinked = next(iter(org.projects["project004"].committers)).asf_id
+            links.upsert("ids", link(relinked, "gh-someone-else", True))
+
+            changes = await plugins.projects.update_data(
+                org, config, repositories, client=client, relinked=links.pop_changed()
+            )
+            fresh = await plugins.projects.compile_data(
+                config, repositories, links, client=plugins.ldap.LDAPClient(config, None, backend=ldap)
+            )
+            return org, fresh, changes, relinked
+
+        org, fresh, changes, relinked = asyncio.run(scenario())
+        self.assertEqual(describe(org), describe(fresh))
+        self.assertIn("project001", changes.projects)
+        self.assertIn("project003", changes.projects)
+        self.assertIn("project002", changes.removed_projects)
+        self.assertIn(relinked, changes.people)
+        self.assertEqual(org.get_committer(relinked).github_login, "gh-someone-else")
+
+
+class FailingStore:
+    """A link store whose writes fail until told otherwise"""
+
+    def __init__(self):
+        self.failing = True
+        self.written = []
+
+    async def upsert_links(self, values: list):
+        if self.failing:
+            raise RuntimeError("Disk on fire")
+        self.written.extend(values)
+
+
+class LinkTableTest(unittest.TestCase):
+    def test_failed_batch_is_requeued(self):
+        async def scenario():
+            store = FailingStore()
+            links = plugins.projects.LinkTable(FakeLinkDB({}), flush_interval=60, store=store)
+            links.upsert("ids", link("alice", "gh-alice", False))
+            links.upsert("ids", link("bob", "gh-bob", True))
+            await links.sync()
+            requeued = set(links.pending)
+            # A write queued since the batch failed is newer than the one in the batch
+            links.upsert("ids", link("alice", "gh-alice", True))
+            store.failing = False
+            await links.sync()
+            return requeued, store.written, links
+
+        requeued, written, links = asyncio.run(scenario())
+        self.assertEqual(requeued, {"alice", "bob"})
+        self.assertEqual(
+            sorted((asf_id, login, mfa) for asf_id, login, mfa, _ in written),
+            [("alice", "gh-alice", 1), ("bob", "gh-bob", 1)],
+        )
+        self.assertEqual(links.pending, {})
+        self.assertEqual(links.written, 2)
+        self.assertEqual(links.rows["alice"]["mfa"], 1)
+
+    def test_writes_are_coalesced_per_person(self):
+        async def scenario():
+            store = FailingStore()
+            store.failing = False
+            links = plugins.projects.LinkTable(FakeLinkDB({}), flush_interval=60, store=store)
+            for mfa in (False, True, False):
+                links.upsert("ids", link("alice", "gh-alice", mfa))
+            await links.sync()
+            return store.written, links
+
+        written, links = asyncio.run(scenario())
+        self.assertEqual([(asf_id, mfa) for asf_id, _, mfa, _ in written], [("alice", 0)])
+        self.assertEqual((links.updates, links.flushes), (3, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,263 @@
+"""Tests for plugins.reconcile. Run from the server directory with: python3 -m unittest discover tests"""
+import asyncio
+import types
+import unittest
+
+import bench.fakegithub
+import bench.sync
+import bench.synthetic
+import plugins.configuration
+import plugins.github
+import plugins.projects
+import plugins.reconcile
+import plugins.repositories
+
+
+def make_server(projects: dict, people: dict, github_repos: list) -> types.SimpleNamespace:
+    """Builds just enough of a Server to plan against. projects maps a project name to its committers, PMC, public
+    and private repositories, people maps an ASF ID to its GitHub login and MFA status."""
+    org = plugins.projects.Organization()
+    for name, (committers, pmc, public_repos, private_repos) in projects.items():
+        project = org.add_project(name=name, committers=committers, pmc=pmc)
+        for repo in public_repos:
+            project.add_repository(plugins.repositories.Repository(False, f"/x1/repos/asf/{repo}.git"), False)
+        for repo in private_repos:
+            project.add_repository(plugins.repositories.Repository(True, f"/x1/repos/private/{name}/{repo}.git"), True)
+    for person in org.committers:
+        login, mfa = people[person.asf_id]
+        org.link_github(person, login)
+        person.github_mfa = mfa
+    server = types.SimpleNamespace(data=plugins.configuration.InterData())
+    server.data.projects = org.projects
+    server.data.github_repos = list(github_repos)
+    server.data.mfa = {login: mfa for login, mfa in people.values() if login}
+    return server
+
+
+def make_team(name: str, members: list = (), repos: list = ()) -> plugins.github.GitHubTeam:
+    """Builds a GitHub team the way the snapshot query returns it"""
+    return plugins.github.GitHubTeam(
+        None,
+        {
+            "node": {
+                "databaseId": 1,
+                "slug": name.replace(" ", "-"),
+                "name": name,
+                "members": {"totalCount": len(members), "edges": [{"node": {"login": x}} for x in members]},
+                "repositories": {"totalCount": len(repos), "edges": [{"node": {"name": x}} for x in repos]},
+            }
+        },
+    )
+
+
+def changes_of(plan: plugins.reconcile.ReconciliationPlan) -> set:
+    return set((change.action, change.team, change.target) for change in plan.changes)
+
+
+PEOPLE = {
+    "alice": ("gh-alice", True),
+    "bob": ("gh-bob", True),
+    "carol": ("gh-carol", False),  # No MFA, so not on any team
+    "dave": (None, False),  # Not linked to GitHub
+}
+
+
+class PlanTest(unittest.TestCase):
+    def test_plan_adds_and_removes_members_and_assigns_repositories(self):
+        server = make_server(
+            {"foo": (["alice", "bob", "carol", "dave"], ["alice"], ["foo", "foo-site"], ["foo-private"])},
+            PEOPLE,
+            ["foo", "foo-site", "foo-private"],
+        )
+        teams = [make_team("foo committers", ["bob", "gh-carol", "gh-mallory"], ["foo"])]
+        plan = plugins.reconcile.plan_reconciliation(server, types.SimpleNamespace(teams=teams))
+        self.assertEqual(
+            changes_of(plan),
+            {
+                ("add_member", "foo committers", "gh-alice"),
+                ("add_member", "foo committers", "gh-bob"),
+                ("remove_member", "foo committers", "bob"),
+                ("remove_member", "foo committers", "gh-carol"),
+                ("remove_member", "foo committers", "gh-mallory"),
+                ("add_repository", "foo committers", "foo-site"),
+                ("create_team", "foo private", ""),
+                ("add_member", "foo private", "gh-alice"),
+                ("add_repository", "foo private", "foo-private"),
+            },
+        )
+
+    def test_plan_only_manages_repositories_that_are_on_github(self):
+        server = make_server({"foo": (["alice"], ["alice"], ["foo", "foo-new"], [])}, PEOPLE, ["foo"])
+        teams = [make_team("foo committers", ["gh-alice"], ["foo"])]
+        plan = plugins.reconcile.plan_reconciliation(server, types.SimpleNamespace(teams=teams))
+        self.assertEqual(len(plan), 0)
+
+    def test_plan_leaves_ci_accounts_alone(self):
+        server = make_server({"foo": (["alice"], ["alice"], ["foo"], [])}, PEOPLE, ["foo"])
+        server.data.mfa["asf-ci-deploy"] = True
+        teams = [make_team("foo committers", ["gh-alice", "asf-ci-bot", "asf-ci-deploy"], ["foo"])]
+        plan = plugins.reconcile.plan_reconciliation(server, types.SimpleNamespace(teams=teams))
+        self.assertEqual(len(plan), 0)
+
+    def test_plan_does_not_touch_members_without_ldap_data(self):
+        # An empty LDAP group means the lookup came back empty, not that everyone left the project
+        server = make_server({"foo": ([], [], ["foo", "foo-site"], [])}, PEOPLE, ["foo", "foo-site"])
+        teams = [make_team("foo committers", ["gh-alice", "gh-bob"], ["foo"])]
+        plan = plugins.reconcile.plan_reconciliation(server, types.SimpleNamespace(teams=teams))
+        self.assertEqual(changes_of(plan), {("add_repository", "foo committers", "foo-site")})
+
+    def test_plan_for_some_projects(self):
+        server = make_server(
+            {"foo": (["alice"], ["alice"], ["foo"], []), "bar": (["bob"], ["bob"], ["bar"], [])},
+            PEOPLE,
+            ["foo", "bar"],
+        )
+        plan = plugins.reconcile.plan_reconciliation(server, types.SimpleNamespace(teams=[]), projects=["bar", "baz"])
+        self.assertEqual(set(change.team for change in plan.changes), {"bar committers"})
+
+
+class FitToBudgetTest(unittest.TestCase):
+    def make_plan(self) -> plugins.reconcile.ReconciliationPlan:
+        plan = plugins.reconcile.ReconciliationPlan()
+        plan.add("add_repository", "foo committers", "foo", "committers", ["foo"])
+        plan.add("add_member", "foo committers", "foo", "committers", ["gh-alice", "gh-bob"])
+        plan.add("remove_member", "bar committers", "bar", "committers", ["gh-carol", "gh-dave"])
+        plan.add("create_team", "foo committers", "foo", "committers")
+        plan.fingerprints = {"foo committers": 1, "bar committers": 2, "baz committers": 3}
+        plan.skipped = 1
+        plan.github_repos = 4
+        return plan
+
+    def test_most_urgent_changes_first(self):
+        fitted = self.make_plan().fit_to_budget(3)
+        self.assertEqual(
+            [(change.action, change.target) for change in fitted.changes],
+            [("create_team", ""), ("remove_member", "gh-carol"), ("remove_member", "gh-dave")],
+        )
+        self.assertEqual(fitted.deferred, 3)
+        self.assertEqual(fitted.skipped, 1)
+        self.assertEqual(fitted.github_repos, 4)
+
+    def test_teams_with_deferred_changes_are_not_fingerprinted(self):
+        fitted = self.make_plan().fit_to_budget(3)
+        self.assertEqual(fitted.fingerprints, {"bar committers": 2, "baz committers": 3})
+
+    def test_no_budget_information(self):
+        fitted = self.make_plan().fit_to_budget(None)
+        self.assertEqual(len(fitted), 6)
+        self.assertEqual(fitted.deferred, 0)
+        self.assertEqual(fitted.fingerprints, {"foo committers": 1, "bar committers": 2, "baz committers": 3})
+
+    def test_cost(self):
+        self.assertEqual(self.make_plan().cost(), {"core": 6, "graphql": 0})
+
+
+class FingerprintTest(unittest.TestCase):
+    def setUp(self):
+        self.server = make_server(
+            {"foo": (["alice", "bob"], ["alice"], ["foo"], []), "bar": (["bob"], ["bob"], ["bar"], [])},
+            PEOPLE,
+            ["foo", "bar"],
+        )
+        self.teams = [
+            make_team("foo committers", ["gh-alice", "gh-bob"], ["foo"]),
+            make_team("bar committers", ["gh-bob"], ["bar"]),
+        ]
+        self.org = types.SimpleNamespace(teams=self.teams)
+        self.fingerprints = plugins.reconcile.TeamFingerprints()
+        plan = plugins.reconcile.plan_reconciliation(self.server, self.org, fingerprints=self.fingerprints)
+        self.assertEqual((len(plan), plan.skipped), (0, 0))
+        self.fingerprints.commit(plan, self.teams)
+        self.server.data.changes = plugins.projects.ChangeSet()  # Nothing changed since
+
+    def plan(self) -> plugins.reconcile.ReconciliationPlan:
+        return plugins.reconcile.plan_reconciliation(self.server, self.org, fingerprints=self.fingerprints)
+
+    def test_unchanged_teams_are_skipped(self):
+        plan = self.plan()
+        self.assertEqual((len(plan), plan.skipped), (0, 2))
+        self.assertEqual(set(plan.fingerprints), {"foo committers", "bar committers"})
+
+    def test_team_that_drifted_on_github_is_planned(self):
+        self.teams[0].members.remove("gh-bob")
+        plan = self.plan()
+        self.assertEqual(changes_of(plan), {("add_member", "foo committers", "gh-bob")})
+        self.assertEqual(plan.skipped, 1)
+
+    def test_changed_project_is_planned(self):
+        self.server.data.projects["foo"].committers.remove(self.server.data.projects["foo"].committers[1])
+        self.server.data.changes.projects.add("foo")
+        plan = self.plan()
+        self.assertEqual(changes_of(plan), {("remove_member", "foo committers", "gh-bob")})
+
+    def test_change_in_github_repositories_replans_every_team(self):
+        self.server.data.github_repos.append("foo-site")
+        self.server.data.projects["foo"].add_repository(
+            plugins.repositories.Repository(False, "/x1/repos/asf/foo-site.git"), False
+        )
+        plan = self.plan()
+        self.assertEqual(changes_of(plan), {("add_repository", "foo committers", "foo-site")})
+        self.assertEqual(plan.skipped, 1)  # bar was worked out again, and found to be unchanged
+
+    def test_forgotten_and_cleared_teams_are_planned(self):
+        self.fingerprints.forget(["foo"])
+        self.assertEqual(self.plan().skipped, 1)
+        self.fingerprints.clear()
+        self.assertEqual(self.plan().skipped, 0)
+
+    def test_teams_with_errors_are_not_recorded(self):
+        self.teams[0].members.remove("gh-bob")
+        plan = self.plan()
+        self.teams[0].errors = [("add member gh-bob", Exception("Nope"))]
+        self.fingerprints.commit(plan, self.teams)
+        self.assertNotIn("foo committers", self.fingerprints.desired)
+        self.assertIn("bar committers", self.fingerprints.desired)
+
+
+class ApplyTest(unittest.TestCase):
+    def test_plan_and_apply_against_fake_github(self):
+        async def scenario():
+            synthetic = bench.synthetic.SyntheticOrg(projects=8, people=120, repos=24, drift=0.2, seed=7)
+            github = bench.fakegithub.FakeGitHub(synthetic, login="apache")
+            runner, url = await github.start()
+            github_org = plugins.github.GitHubOrganisation(
+                login="apache", personal_access_token="0" * 40, api_url=url
+            )
+            server = bench.sync.BenchServer()
+            fingerprints = plugins.reconcile.TeamFingerprints()
+            plans = []
+            try:
+                await github_org.get_id()
+                for cycle in range(2):
+                    snapshot = await github_org.load_snapshot()
+                    server.data.mfa = snapshot.mfa
+                    server.data.github_repos = snapshot.repositories
+                    asf_org = await bench.sync.compile_synthetic(synthetic)
+                    server.data.projects = asf_org.projects
+                    plan = plugins.reconcile.plan_reconciliation(server, github_org, fingerprints=fingerprints)
+                    await plugins.reconcile.apply_plan(github_org, plan)
+                    fingerprints.commit(plan, github_org.teams)
+                    plans.append(plan)
+                # What GitHub has now is what LDAP and MFA say it should have
+                snapshot = await github_org.load_snapshot()
+                desired = {}
+                for project in asf_org.projects.values():
+                    logins = set(p.github_login for p in project.committers if snapshot.mfa.get(p.github_login))
+                    desired[f"{project.name} committers"] = logins
+                actual = {
+                    team.name: set(team.members) for team in github.teams.values() if team.name in desired
+                }
+            finally:
+                await github_org.close()
+                await runner.cleanup()
+            return plans, desired, actual
+
+        plans, desired, actual = asyncio.run(scenario())
+        self.assertGreater(plans[0].summary()["remove_member"], 0)
+        self.assertEqual(len(plans[1]), 0)
+        self.assertEqual(plans[1].skipped, len(plans[1].fingerprints))
+        self.assertEqual(actual, desired)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+"""Tests for plugins.scheduler. Run from the server directory with: python3 -m unittest discover tests"""
+import asyncio
+import time
+import unittest
+
+import plugins.scheduler
+
+
+class SchedulerTest(unittest.TestCase):
+    def test_triggered_projects_reach_a_job_whose_interval_is_due(self):
+        async def scenario():
+            scheduler = plugins.scheduler.Scheduler()
+            seen = []
+
+            async def job(projects):
+                seen.append(projects)
+
+            scheduler.add("reconcile", job, interval=60)
+            scheduler.trigger("reconcile", ["foo"])
+            scheduler.trigger("reconcile", ["bar"])
+            self.assertLessEqual(scheduler.jobs["reconcile"].due, time.monotonic())
+            job_to_run, _ = scheduler.next_job()
+            await scheduler.run_job(job_to_run)
+            # Not triggered since, so the next interval run has nothing extra to look at
+            scheduler.jobs["reconcile"].due = time.monotonic()
+            await scheduler.run_job(scheduler.jobs["reconcile"])
+            return seen
+
+        self.assertEqual(asyncio.run(scenario()), [{"foo", "bar"}, set()])
+
+    def test_triggered_projects_of_a_covered_job_reach_the_covering_job(self):
+        async def scenario():
+            scheduler = plugins.scheduler.Scheduler()
+            seen = []
+
+            async def job(projects):
+                seen.append(projects)
+
+            scheduler.add("reconcile", job, interval=60)
+            scheduler.add("run", job, interval=60, covers=("reconcile",))
+            scheduler.trigger("reconcile", ["foo"])
+            await scheduler.run_job(scheduler.jobs["run"])
+            return seen, scheduler.jobs["reconcile"].pending
+
+        self.assertEqual(asyncio.run(scenario()), ([{"foo"}], False))
+
+    def test_trigger_for_everything(self):
+        async def scenario():
+            scheduler = plugins.scheduler.Scheduler()
+            seen = []
+
+            async def job(projects):
+                seen.append(projects)
+
+            scheduler.add("reconcile", job)
+            scheduler.trigger("reconcile", ["foo"])
+            scheduler.trigger("reconcile")
+            await scheduler.run_job(scheduler.next_job()[0])
+            return seen
+
+        self.assertEqual(asyncio.run(scenario()), [None])
+
+    def test_trigger_for_everything_of_a_covered_job(self):
+        async def scenario():
+            scheduler = plugins.scheduler.Scheduler()
+            seen = []
+
+            async def job(projects):
+                seen.append(projects)
+
+            scheduler.add("reconcile", job)
+            scheduler.add("run", job, covers=("reconcile",))
+            scheduler.trigger("run", ["foo"])
+            scheduler.trigger("reconcile")
+            await scheduler.run_job(scheduler.jobs["run"])
+            return seen
+
+        self.assertEqual(asyncio.run(scenario()), [None])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+"""Tests for plugins.transport. Run from the server directory with: python3 -m unittest discover tests"""
+import json
+import time
+import unittest
+
+import plugins.transport
+
+Transport = plugins.transport.Transport
+
+
+class ClassifyTest(unittest.TestCase):
+    def test_server_errors_are_retried(self):
+        for status in (500, 502, 503, 504):
+            self.assertEqual(Transport.classify(status, {}, "Server Error"), (True, 0.0))
+
+    def test_secondary_rate_limits_are_retried_after_the_wait_asked_for(self):
+        self.assertEqual(Transport.classify(429, {"Retry-After": "30"}, ""), (True, 30.0))
+        self.assertEqual(Transport.classify(403, {"Retry-After": "5"}, "Slow down"), (True, 5.0))
+        self.assertEqual(
+            Transport.classify(403, {}, "You have exceeded a secondary rate limit. Please wait."), (True, 0.0)
+        )
+        self.assertEqual(Transport.classify(429, {"Retry-After": "soon"}, ""), (True, 0.0))
+
+    def test_exhausted_rate_limit_is_retried_after_the_reset(self):
+        headers = {"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": str(int(time.time()) + 120)}
+        retry, wait = Transport.classify(403, headers, "API rate limit exceeded")
+        self.assertTrue(retry)
+        self.assertGreater(wait, 100)
+
+    def test_client_errors_are_fatal(self):
+        for status in (400, 401, 404, 422):
+            self.assertEqual(Transport.classify(status, {}, "Nope"), (False, 0.0))
+        self.assertEqual(Transport.classify(403, {"X-RateLimit-Remaining": "42"}, "Forbidden"), (False, 0.0))
+
+    def test_graphql_rate_limits_and_timeouts_are_retried(self):
+        for error_type in ("RATE_LIMITED", "TIMEOUT"):
+            body = json.dumps({"data": None, "errors": [{"type": error_type, "message": "Try again"}]})
+            self.assertTrue(Transport.classify_graphql(body))
+
+    def test_graphql_partial_data_and_other_errors_are_not_retried(self):
+        partial = {"data": {"organization": None}, "errors": [{"type": "RATE_LIMITED", "message": "Partial"}]}
+        self.assertFalse(Transport.classify_graphql(json.dumps(partial)))
+        not_found = {"data": None, "errors": [{"type": "NOT_FOUND", "message": "No such organization"}]}
+        self.assertFalse(Transport.classify_graphql(json.dumps(not_found)))
+        self.assertFalse(Transport.classify_graphql(json.dumps({"data": {"organization": {}}})))
+        self.assertFalse(Transport.classify_graphql("<html>Unicorn!</html>"))
+
+
+if __name__ == "__main__":
+    unittest.main()